@@ -0,0 +1,83 @@
+# Declarative map of CloudTrail create events to the resources they create.
+#
+# Entries are keyed by (eventSource, eventName), since event names are not
+# unique across services. Each entry names a JSONPath-style path into the CloudTrail `detail` that
+# yields resource IDs or ARNs, and the backend used to tag them:
+#   ec2      ec2.create_tags with resource IDs
+#   tagging  resourcegroupstaggingapi.tag_resources with ARNs
+#   propagate  copy changed instance tags to attached and derived resources
+# Paths use dots for keys and [*] to fan out over a list. An optional ARN
+# template turns the extracted value into an ARN; it can use {value},
+# {partition}, {region} and {account}.
+
+from collections import namedtuple
+
+Extractor = namedtuple('Extractor', ['path', 'backend', 'arn_template', 'extract'])
+
+
+# Compile "a.b[*].c" into a function returning every value at that path
+def compile_path(path):
+    steps = []
+    for token in path.split('.'):
+        if token.endswith('[*]'):
+            steps.append((token[:-3], True))
+        else:
+            steps.append((token, False))
+
+    def extract(document):
+        values = [document]
+        for key, fan_out in steps:
+            found = []
+            for value in values:
+                if not isinstance(value, dict) or value.get(key) is None:
+                    continue
+                if fan_out:
+                    found.extend(value[key])
+                else:
+                    found.append(value[key])
+            values = found
+        return [value for value in values if isinstance(value, str)]
+
+    return extract
+
+
+def extractor(path, backend, arn_template=None):
+    return Extractor(path, backend, arn_template, compile_path(path))
+
+
+EVENT_REGISTRY = {
+    # EC2
+    ("ec2.amazonaws.com", "CreateVolume"): extractor("responseElements.volumeId", "ec2"),
+    ("ec2.amazonaws.com", "RunInstances"): extractor("responseElements.instancesSet.items[*].instanceId", "ec2"),
+    ("ec2.amazonaws.com", "CreateImage"): extractor("responseElements.imageId", "ec2"),
+    ("ec2.amazonaws.com", "CreateSnapshot"): extractor("responseElements.snapshotId", "ec2"),
+    ("ec2.amazonaws.com", "CreateSecurityGroup"): extractor("responseElements.groupId", "ec2"),
+    ("ec2.amazonaws.com", "CreateLaunchTemplate"): extractor("responseElements.CreateLaunchTemplateResponse.launchTemplate.launchTemplateId", "ec2"),
+    ("ec2.amazonaws.com", "AllocateAddress"): extractor("responseElements.allocationId", "ec2"),
+    ("ec2.amazonaws.com", "CreateNatGateway"): extractor("responseElements.CreateNatGatewayResponse.natGateway.natGatewayId", "ec2"),
+    # instance tag changes, propagated rather than tagged with Owner
+    ("ec2.amazonaws.com", "CreateTags"): extractor("requestParameters.resourcesSet.items[*].resourceId", "propagate"),
+    # other services, tagged by ARN
+    ("s3.amazonaws.com", "CreateBucket"): extractor("requestParameters.bucketName", "tagging", "arn:{partition}:s3:::{value}"),
+    ("rds.amazonaws.com", "CreateDBInstance"): extractor("responseElements.dBInstanceArn", "tagging"),
+    ("lambda.amazonaws.com", "CreateFunction20150331"): extractor("responseElements.functionArn", "tagging"),
+    ("dynamodb.amazonaws.com", "CreateTable"): extractor("responseElements.tableDescription.tableArn", "tagging"),
+}
+
+
+# Extractor for a CloudTrail event detail, None for events not handled
+def find_extractor(detail):
+    return EVENT_REGISTRY.get((detail.get('eventSource'), detail.get('eventName')))
+
+
+# Resource IDs or ARNs created by the event
+def extract_resources(spec, detail):
+    values = spec.extract(detail)
+    if spec.arn_template:
+        identity_arn = detail.get('userIdentity', {}).get('arn', 'arn:aws')
+        values = [spec.arn_template.format(
+            value=value,
+            partition=identity_arn.split(':')[1],
+            region=detail.get('awsRegion', ''),
+            account=detail.get('recipientAccountId', '')) for value in values]
+    return values
@@ -0,0 +1,37 @@
+# Run independent pieces of one invocation's work (describe calls, tagging
+# jobs for different owners, expansions of different events) concurrently.
+# boto3 calls block, so the fan-out is a bounded thread pool; the API rates
+# stay bounded by the limiters in ratelimit.py.
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Concurrent tasks per fan-out
+FANOUT_MAX_WORKERS = int(os.environ.get('FANOUT_MAX_WORKERS', 16))
+
+
+def _call(task):
+    try:
+        return task(), None
+    except Exception as e:
+        return None, e
+
+
+# Run zero-argument callables concurrently. Returns one (result, exception)
+# pair per task, in order; a single task runs on the calling thread.
+def run_all(tasks, max_workers=FANOUT_MAX_WORKERS):
+    tasks = list(tasks)
+    if len(tasks) <= 1:
+        return [_call(task) for task in tasks]
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tasks)))) as pool:
+        return list(pool.map(_call, tasks))
+
+
+# run_all for tasks that must all succeed: re-raises the first exception
+def gather(tasks, max_workers=FANOUT_MAX_WORKERS):
+    results = []
+    for result, error in run_all(tasks, max_workers):
+        if error is not None:
+            raise error
+        results.append(result)
+    return results
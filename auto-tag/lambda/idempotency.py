@@ -0,0 +1,132 @@
+# Skip CloudTrail events that were already handled. EventBridge delivers at
+# least once, and a duplicate or replayed RunInstances would otherwise repeat
+# every describe and tagging call.
+#
+# An event is claimed under its eventID plus the IDs it creates, for
+# IDEMPOTENCY_WINDOW_SECONDS (0 disables this). Claims are kept in-process,
+# and with IDEMPOTENCY_TABLE set also in DynamoDB (partition key
+# "idempotency_key", TTL attribute "expires_at") through a conditional put,
+# so that concurrent invocations do not both handle one event. A claim is
+# released when the event's tagging fails, together with what is remembered
+# about its resources, so the retry is not skipped.
+#
+# Resources tagged with an Owner/PrincipalId pair are remembered in-process
+# for the same window: they are not tagged again with that pair, and an event
+# whose resources were all already tagged with its pair is skipped entirely.
+
+import os
+import time
+import hashlib
+import logging
+from session_cache import get_client
+from identity import TTLCache
+from metrics import count
+
+IDEMPOTENCY_WINDOW_SECONDS = int(os.environ.get('IDEMPOTENCY_WINDOW_SECONDS', 3600))
+IDEMPOTENCY_TABLE = os.environ.get('IDEMPOTENCY_TABLE')
+MAX_CLAIMED_EVENTS = 8192
+MAX_TRACKED_RESOURCES = 65536
+
+_claims = TTLCache(MAX_CLAIMED_EVENTS, IDEMPOTENCY_WINDOW_SECONDS)
+# resource id -> (owner, principal) it was tagged with
+_tagged = TTLCache(MAX_TRACKED_RESOURCES, IDEMPOTENCY_WINDOW_SECONDS)
+
+
+def event_key(detail, ids):
+    digest = hashlib.sha256("\n".join(sorted(ids)).encode()).hexdigest()[:32]
+    return detail.get('eventID', '') + "#" + digest
+
+
+def _claim_shared(key):
+    from botocore.exceptions import ClientError
+
+    now = int(time.time())
+    try:
+        get_client('dynamodb').put_item(
+            TableName=IDEMPOTENCY_TABLE,
+            Item={
+                "idempotency_key": {"S": key},
+                "expires_at": {"N": str(now + IDEMPOTENCY_WINDOW_SECONDS)}
+            },
+            # DynamoDB TTL deletion is lazy, so an expired claim can be taken over
+            ConditionExpression="attribute_not_exists(idempotency_key) OR expires_at < :now",
+            ExpressionAttributeValues={":now": {"N": str(now)}}
+        )
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+            return False
+        raise
+    return True
+
+
+# Claim the event for this invocation. Returns None when it is a duplicate,
+# otherwise the key to release if handling it fails. owner is the
+# (Owner, PrincipalId) pair the event tags its resources with, if any. The
+# shared table failing does not block tagging.
+def claim(detail, ids, owner=None):
+    if IDEMPOTENCY_WINDOW_SECONDS <= 0 or not detail.get('eventID'):
+        return ""
+    if owner and ids and all(_tagged.get(i) == (True, owner) for i in ids):
+        count("DuplicateEvents")
+        return None
+
+    key = event_key(detail, ids)
+    found, _ = _claims.get(key)
+    if found:
+        count("DuplicateEvents")
+        return None
+    if IDEMPOTENCY_TABLE:
+        try:
+            if not _claim_shared(key):
+                logging.info("Event " + key + " already claimed by another invocation")
+                count("DuplicateEvents")
+                _claims.put(key, [])
+                return None
+        except Exception as e:
+            logging.warning("Shared idempotency table unavailable: " + str(e))
+    _claims.put(key, ids)
+    return key
+
+
+# Forget the claim and the event's resources; part of the event (another
+# chunk, propagation) failed, so its retry has to run in full
+def release(key):
+    if not key:
+        return
+    found, ids = _claims.get(key)
+    _claims.discard(key)
+    for resource_id in ids if found else []:
+        _tagged.discard(resource_id)
+    if IDEMPOTENCY_TABLE:
+        try:
+            get_client('dynamodb').delete_item(
+                TableName=IDEMPOTENCY_TABLE,
+                Key={"idempotency_key": {"S": key}}
+            )
+        except Exception as e:
+            logging.warning("Could not release event claim " + key + ": " + str(e))
+
+
+# IDs not already tagged with this Owner/PrincipalId inside the window
+def untagged(ids, user, principal):
+    if IDEMPOTENCY_WINDOW_SECONDS <= 0:
+        return ids
+    pending = [i for i in ids if _tagged.get(i) != (True, (user, principal))]
+    if len(pending) < len(ids):
+        count("DuplicateResourcesSkipped", len(ids) - len(pending))
+    return pending
+
+
+# Remember the resources of the successful chunk results
+def remember_tagged(results, user, principal):
+    if IDEMPOTENCY_WINDOW_SECONDS <= 0:
+        return
+    for result in results:
+        if result["success"]:
+            for resource_id in result["resources"]:
+                _tagged.put(resource_id, (user, principal))
+
+
+def clear():
+    _claims.clear()
+    _tagged.clear()
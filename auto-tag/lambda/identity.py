@@ -0,0 +1,263 @@
+# Resolve a CloudTrail userIdentity to the canonical Owner tag value.
+#
+# Resolvers are tried in IDENTITY_RESOLVERS order (comma-separated names from
+# RESOLVERS) and the first non-empty answer wins; when none answers, the
+# identity's own name is used (IAM user name, role session name, service).
+#   mapping          IDENTITY_MAP_PATH JSON file mapping an identity ARN, role
+#                    ARN or principal ID to an owner
+#   role_tags        value of the OWNER_ROLE_TAG tag on the assumed IAM role
+#   identity_center  primary email (or display name) of the Identity Center
+#                    user of an SSO session, looked up in IDENTITY_STORE_ID
+#
+# Answers are kept in a bounded TTL LRU cache, so a burst of events from one
+# role costs one lookup. With IDENTITY_CACHE_TABLE set they are shared with
+# concurrent invocations through DynamoDB (partition key "identity_key", TTL
+# attribute "expires_at").
+
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from session_cache import get_client
+from metrics import count, timer
+
+IDENTITY_RESOLVERS = [name.strip() for name in os.environ.get('IDENTITY_RESOLVERS', 'role_tags').split(',')
+                      if name.strip()]
+IDENTITY_MAP_PATH = os.environ.get('IDENTITY_MAP_PATH')
+OWNER_ROLE_TAG = os.environ.get('OWNER_ROLE_TAG', 'Owner')
+IDENTITY_STORE_ID = os.environ.get('IDENTITY_STORE_ID')
+IDENTITY_CACHE_TABLE = os.environ.get('IDENTITY_CACHE_TABLE')
+IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 3600))
+MAX_CACHED_IDENTITIES = 4096
+# Role name prefix of Identity Center permission set roles
+SSO_ROLE_PREFIX = "AWSReservedSSO_"
+
+
+# Thread-safe LRU map whose entries expire after ttl seconds
+class TTLCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    # (True, value) for a live entry, (False, None) otherwise
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return False, None
+            if item[0] < time.monotonic():
+                del self._items[key]
+                return False, None
+            self._items.move_to_end(key)
+            return True, item[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+# Resolutions shared between invocations, one DynamoDB item per cache key
+class DynamoDBIdentityStore:
+    def __init__(self, table, ttl):
+        self.table = table
+        self.ttl = ttl
+
+    def get(self, key):
+        item = get_client('dynamodb').get_item(
+            TableName=self.table,
+            Key={"identity_key": {"S": key}}
+        ).get("Item")
+        # DynamoDB TTL deletion is lazy, so expiry is checked here as well
+        if item is None or int(item["expires_at"]["N"]) < time.time():
+            return False, None
+        return True, item["owner"]["S"] or None
+
+    def put(self, key, owner):
+        get_client('dynamodb').put_item(
+            TableName=self.table,
+            Item={
+                "identity_key": {"S": key},
+                "owner": {"S": owner or ""},
+                "expires_at": {"N": str(int(time.time()) + self.ttl)}
+            }
+        )
+
+
+_cache = TTLCache(MAX_CACHED_IDENTITIES, IDENTITY_CACHE_TTL)
+_store = None
+_mapping = None
+
+
+def get_store():
+    global _store
+    if _store is None and IDENTITY_CACHE_TABLE:
+        _store = DynamoDBIdentityStore(IDENTITY_CACHE_TABLE, IDENTITY_CACHE_TTL)
+    return _store
+
+
+# Cached loader(): in-process first, then the shared store. Lookup failures
+# are not cached, so the next event tries again.
+def cached(key, loader):
+    found, value = _cache.get(key)
+    if found:
+        count("IdentityCacheHits")
+        return value
+
+    store = get_store()
+    if store is not None:
+        try:
+            found, value = store.get(key)
+        except Exception as e:
+            logging.warning("Shared identity cache unavailable: " + str(e))
+        if found:
+            count("IdentitySharedCacheHits")
+            _cache.put(key, value)
+            return value
+
+    count("IdentityLookups")
+    value = loader()
+    _cache.put(key, value)
+    if store is not None:
+        try:
+            store.put(key, value)
+        except Exception as e:
+            logging.warning("Could not share identity resolution: " + str(e))
+    return value
+
+
+# ARN of the IAM role behind an assumed-role identity
+def role_arn(identity):
+    issuer = identity.get('sessionContext', {}).get('sessionIssuer', {})
+    if issuer.get('type') == 'Role':
+        return issuer.get('arn')
+    return None
+
+
+# Name the identity carries itself
+def default_owner(identity):
+    user_type = identity.get('type')
+    if user_type == 'IAMUser':
+        return identity.get('userName')
+    if user_type == 'AWSService':
+        return identity.get('invokedBy')
+    if user_type == 'Root':
+        return 'root'
+    principal = identity.get('principalId', '')
+    # AssumedRole and FederatedUser principal IDs are "<id>:<session name>"
+    return principal.split(':', 1)[1] if ':' in principal else principal or None
+
+
+def load_mapping():
+    global _mapping
+    if _mapping is None:
+        _mapping = {}
+        if IDENTITY_MAP_PATH:
+            with open(IDENTITY_MAP_PATH) as f:
+                _mapping = json.load(f)
+    return _mapping
+
+
+def resolve_mapping(identity):
+    mapping = load_mapping()
+    for key in (identity.get('arn'), role_arn(identity), identity.get('principalId')):
+        if key and key in mapping:
+            return mapping[key]
+    return None
+
+
+def resolve_role_tags(identity):
+    arn = role_arn(identity)
+    if not arn:
+        return None
+
+    def lookup():
+        role_name = arn.rsplit('/', 1)[-1]
+        with timer("ListRoleTags"):
+            tags = get_client('iam').list_role_tags(RoleName=role_name).get('Tags', [])
+        return next((tag['Value'] for tag in tags if tag['Key'] == OWNER_ROLE_TAG), None)
+    return cached("role:" + arn, lookup)
+
+
+def resolve_identity_center(identity):
+    arn = role_arn(identity)
+    if not IDENTITY_STORE_ID or not arn or not arn.rsplit('/', 1)[-1].startswith(SSO_ROLE_PREFIX):
+        return None
+    session = default_owner(identity)
+    if not session:
+        return None
+
+    def lookup():
+        from botocore.exceptions import ClientError
+
+        store = get_client('identitystore')
+        try:
+            with timer("IdentityStoreLookup"):
+                user_id = store.get_user_id(
+                    IdentityStoreId=IDENTITY_STORE_ID,
+                    AlternateIdentifier={"UniqueAttribute": {
+                        "AttributePath": "userName", "AttributeValue": session}})['UserId']
+                user = store.describe_user(IdentityStoreId=IDENTITY_STORE_ID, UserId=user_id)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ResourceNotFoundException':
+                return None
+            raise
+        return identity_center_owner(user)
+    return cached("sso:" + session, lookup)
+
+
+# The session name already is the user name; the owner is the user's primary
+# email, or any email, or the display name
+def identity_center_owner(user):
+    emails = user.get('Emails') or []
+    for email in sorted(emails, key=lambda e: not e.get('Primary')):
+        if email.get('Value'):
+            return email['Value']
+    return user.get('DisplayName') or user.get('UserName')
+
+
+RESOLVERS = {
+    "mapping": resolve_mapping,
+    "role_tags": resolve_role_tags,
+    "identity_center": resolve_identity_center,
+}
+
+
+# Canonical owner for a CloudTrail userIdentity. Resolver errors fall through
+# to the next resolver.
+def resolve_owner(identity):
+    for name in IDENTITY_RESOLVERS:
+        resolver = RESOLVERS.get(name)
+        if resolver is None:
+            logging.warning("Unknown identity resolver " + name)
+            continue
+        try:
+            owner = resolver(identity)
+        except Exception as e:
+            logging.warning("Identity resolver " + name + " failed: " + str(e))
+            count("IdentityResolverErrors")
+            continue
+        if owner:
+            return owner
+    return default_owner(identity)
+
+
+def clear():
+    global _store, _mapping
+    _cache.clear()
+    _store = None
+    _mapping = None
@@ -1,114 +1,301 @@
 from __future__ import print_function
-import boto3
+import os
+import json
 import logging
+from session_cache import get_client
+from extractors import extract_resources, find_extractor
+from fanout import gather, run_all
+from identity import resolve_owner
+from idempotency import claim, release, remember_tagged, untagged
+from metrics import count, instrumented, log_payload
+from propagation import (OWNER_TAG_KEYS, apply_deltas, build_index, propagate_from_instances,
+                         propagate_to_children, tag_deltas)
+from retry_queue import send_retry
+from tagging import create_tags, tag_resources
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# IAM role the function runs as. Its own create_tags calls come back as
+# CreateTags events, which must not be handled again.
+AUTO_TAG_ROLE_ARN = os.environ.get('AUTO_TAG_ROLE_ARN')
 
+
+@instrumented
 def lambda_handler(event, context):
     # logger.info(Event:  + str(event))
     # print(Received event:  + json.dumps(event, indent=2))
 
-    ids = []
+    if 'Records' in event:
+        return process_records(event['Records'])
+    if event.get('detail-type') == 'Scheduled Event':
+        from propagation import reconcile_handler
+        return reconcile_handler(event, context)
 
+    job = None
     try:
-        detail = event['detail']
-        eventname = detail['eventName']
-        arn = detail['userIdentity']['arn']
-        principal = detail['userIdentity']['principalId']
-        userType = detail['userIdentity']['type']
-
-        if userType == "IAMUser":
-            user = detail['userIdentity']['userName']
-
-        else:
-            user = principal.split(":")[1]
-
-        logger.info("principalId: " + str(principal))
-        logger.info("eventName: " + str(eventname))
-        logger.info("detail: " + str(detail))
-
-        if not detail['responseElements']:
-            logger.warning("Not responseElements found")
-            if detail['errorCode']:
-                logger.error("errorCode: " + detail['errorCode'])
-            if detail['errorMessage']:
-                logger.error("errorMessage: " + detail['errorMessage'])
+        job = parse_event(event['detail'])
+        if job is None:
+            return True
+        if job is False:
             return False
 
-        ec2 = boto3.resource('ec2')
-
-        if eventname == "CreateVolume":
-            ids.append(detail['responseElements']['volumeId'])
-            logger.info(ids)
-
-        elif eventname == "RunInstances":
-            items = detail['responseElements']['instancesSet']['items']
-            for item in items:
-                ids.append(item['instanceId'])
-                add_root_volume_tags(item['instanceId'])
-            logger.info(ids)
-            logger.info("number of instances: " + str(len(ids)))
-
-            base = ec2.instances.filter(InstanceIds=ids)
-
-            # loop through the instances
-            for instance in base:
-                for vol in instance.volumes.all():
-                    ids.append(vol.id)
-                for eni in instance.network_interfaces:
-                    ids.append(eni.id)
-
-        elif eventname == "CreateImage":
-            ids.append(detail['responseElements']['imageId'])
-            logger.info(ids)
-
-        elif eventname == "CreateSnapshot":
-            ids.append(detail['responseElements']['snapshotId'])
-            logger.info(ids)
-        else:
-            logger.warning("Not supported action")
-
-        if ids:
-            for resourceid in ids:
-                print("Tagging resource" + resourceid)
-            ec2.create_tags(Resources=ids, Tags=[
-                {
-                    "Key": "Owner",
-                    "Value": user
-                },
-                {
-                    "Key": "PrincipalId",
-                    "Value": principal
-                }]
-            )
+        ids = job['ids']
+        tasks = []
+        expand = EXPANDERS.get(job['eventname'])
+        if expand:
+            ids, tasks = expand(get_client('ec2'), ids)
+        results = run_tasks(tasks + [owner_task(job['backend'], ids, job['user'], job['principal'])])
 
+        failed = [r for r in results if not r["success"]]
+        if failed:
+            logger.error(str(len(failed)) + " of " + str(len(results)) +
+                         " tagging chunks failed")
+            release(job['claim'])
+            send_retry(event)
+            return False
         return True
     except Exception as e:
         logger.error("Something went wrong: " + str(e))
+        if job:
+            release(job['claim'])
+        send_retry(event)
+        return False
+
+
+# Work out what one CloudTrail event asks us to tag. Returns None for events
+# we do not handle or already handled (see idempotency.py) and False for
+# failed API calls.
+def parse_event(detail):
+    eventname = detail['eventName']
+    identity = detail['userIdentity']
+    principal = identity.get('principalId') or identity.get('invokedBy') or ""
+
+    logger.info("principalId: " + str(principal))
+    logger.info("eventName: " + str(eventname))
+    log_payload("detail", detail)
+
+    if is_own_event(identity):
+        logger.info("Skipping event caused by this function")
+        count("OwnEventsSkipped")
+        return None
+
+    spec = find_extractor(detail)
+    if spec is None:
+        logger.warning("Not supported action")
+        count("UnsupportedEvents")
+        return None
+
+    if detail.get('errorCode') or (
+            spec.path.startswith('responseElements') and not detail.get('responseElements')):
+        logger.warning("Not responseElements found")
+        if detail.get('errorCode'):
+            logger.error("errorCode: " + detail['errorCode'])
+        if detail.get('errorMessage'):
+            logger.error("errorMessage: " + detail['errorMessage'])
         return False
 
+    ids = extract_resources(spec, detail)
+    if spec.backend == "propagate":
+        # only instance tags are propagated; tags written on volumes, ENIs,
+        # snapshots or AMIs have nothing to propagate to
+        ids = [i for i in ids if i.startswith("i-")]
+        if not ids:
+            return None
+    logger.info(ids)
+    count("Events")
+    # resolvers may call IAM or Identity Center, so only for events we tag
+    user = (resolve_owner(identity) if spec.backend in OWNER_BACKENDS else None) or principal
+    key = claim(detail, ids, (user, principal) if spec.backend in OWNER_BACKENDS else None)
+    if key is None:
+        logger.info("Skipping duplicate event " + str(detail.get('eventID')))
+        return None
+    return {
+        'eventname': eventname,
+        'backend': spec.backend,
+        'ids': ids,
+        'user': user,
+        'principal': principal,
+        'claim': key
+    }
+
+
+# True when the call was made by this function's own role
+def is_own_event(identity):
+    issuer = identity.get('sessionContext', {}).get('sessionIssuer', {}).get('arn')
+    return bool(AUTO_TAG_ROLE_ARN) and issuer == AUTO_TAG_ROLE_ARN
+
+
+# SQS-buffered mode: each record body is an EventBridge event. Resources from
+# events that share an (Owner, PrincipalId) pair are tagged together, and the
+# messages behind any failed chunk are returned for partial-batch retry.
+# Expansions of different events, and the tagging for different owners, run
+# concurrently.
+def process_records(records):
+    failures = set()
+    # message id -> idempotency claim, released if the message fails
+    claims = {}
+    # (eventname, backend, user, principal) -> [ids, message ids]
+    events = {}
+    for record in records:
+        try:
+            job = parse_event(json.loads(record['body'])['detail'])
+        except Exception as e:
+            logger.error("Something went wrong: " + str(e))
+            failures.add(record['messageId'])
+            continue
+        if not job:
+            continue
+        claims[record['messageId']] = job['claim']
+        key = (job['eventname'], job['backend'], job['user'], job['principal'])
+        group = events.setdefault(key, [[], set()])
+        group[0].extend(job['ids'])
+        group[1].add(record['messageId'])
+
+    keys = list(events)
+    expansions = run_all(expansion_task(key[0], events[key][0]) for key in keys)
+
+    # (backend, user, principal) -> [ids, message ids, deferred tasks]
+    owners = {}
+    for (eventname, backend, user, principal), (expanded, error) in zip(keys, expansions):
+        ids, message_ids = events[(eventname, backend, user, principal)]
+        if error is not None:
+            logger.error("Something went wrong: " + str(error))
+            failures |= message_ids
+            continue
+        ids, tasks = expanded
+        group = owners.setdefault((backend, user, principal), [[], set(), []])
+        group[0].extend(ids)
+        group[1] |= message_ids
+        group[2].extend(tasks)
+
+    owner_keys = list(owners)
+    outcomes = run_all(owner_group_task(key, owners[key]) for key in owner_keys)
+    for key, (results, error) in zip(owner_keys, outcomes):
+        if error is not None:
+            logger.error("Something went wrong: " + str(error))
+            results = [{"success": False}]
+        if any(not r["success"] for r in results):
+            failures |= owners[key][1]
+
+    for message_id in failures:
+        release(claims.get(message_id))
+    logger.info("Processed " + str(len(records)) + " records, " +
+                str(len(failures)) + " failed")
+    return {"batchItemFailures": [{"itemIdentifier": m} for m in sorted(failures)]}
+
+
+# Expander for one event group, as a task returning (ids, deferred tasks)
+def expansion_task(eventname, ids):
+    expand = EXPANDERS.get(eventname)
+    if expand is None:
+        return lambda: (ids, [])
+    return lambda: expand(get_client('ec2'), ids)
+
+
+def owner_task(backend, ids, user, principal):
+    return lambda: BACKENDS[backend](ids, user, principal)
+
+
+# Owner tagging for one (backend, user, principal) group, together with the
+# deferred tasks of the events in it
+def owner_group_task(key, group):
+    backend, user, principal = key
+    ids, _, tasks = group
+    return lambda: run_tasks(tasks + [owner_task(backend, ids, user, principal)])
+
+
+# Run tagging tasks concurrently and concatenate their chunk results
+def run_tasks(tasks):
+    return [result for results in gather(tasks) for result in results]
+
+
+def owner_tags(user, principal):
+    return [
+        {
+            "Key": "Owner",
+            "Value": user
+        },
+        {
+            "Key": "PrincipalId",
+            "Value": principal
+        }]
+
+
+# Tag EC2 resource IDs with create_tags. Resources this function already
+# tagged with the same pair inside the idempotency window are skipped.
+def tag_ec2_resources(ids, user, principal):
+    ids = untagged(ids, user, principal)
+    if not ids:
+        return []
+    for resourceid in ids:
+        print("Tagging resource" + resourceid)
+    ec2 = get_client('ec2')
+    results = create_tags(ec2, [(ids, owner_tags(user, principal))])
+    remember_tagged(results, user, principal)
+    return results
+
+
+# Tag ARNs through the Resource Groups Tagging API
+def tag_arn_resources(ids, user, principal):
+    ids = untagged(ids, user, principal)
+    if not ids:
+        return []
+    for resourceid in ids:
+        print("Tagging resource" + resourceid)
+    tagging = get_client('resourcegroupstaggingapi')
+    results = tag_resources(tagging, [(ids, {
+        tag["Key"]: tag["Value"] for tag in owner_tags(user, principal)})])
+    remember_tagged(results, user, principal)
+    return results
+
+
+# Expanders return the full list of IDs to tag with Owner tags, plus tasks
+# that run concurrently with that tagging and return chunk results. Those
+# tasks never write OWNER_TAG_KEYS, so the two write disjoint keys and the
+# result does not depend on which finishes first.
+
+# RunInstances also tags the instances' volumes and ENIs, and copies instance
+# tags to them (see propagation.py)
+def expand_instances(ec2, ids):
+    logger.info("number of instances: " + str(len(ids)))
+
+    # one describe for every instance in the event; the volumes and ENIs were
+    # created with the instances, so their current tags need no lookup
+    index = build_index(ec2, ids, kinds=("volume", "eni"), child_tags=False)
+    # the volumes and ENIs get Owner/PrincipalId from the Owner tagging that
+    # runs concurrently, never from the instance
+    deltas = tag_deltas(index, excluded=OWNER_TAG_KEYS)
+    return list(ids) + list(index.parents), [lambda: apply_deltas(ec2, deltas)]
+
+
+# Snapshots and AMIs inherit the tags of the instance they were taken from
+def expand_snapshots(ec2, ids):
+    return ids, [lambda: propagate_to_children(ec2, snapshot_ids=ids)]
+
+
+def expand_images(ec2, ids):
+    return ids, [lambda: propagate_to_children(ec2, image_ids=ids)]
+
 
-def add_root_volume_tags(instance_id):
+# Extra work for events whose resources imply further resources to tag
+EXPANDERS = {
+    "RunInstances": expand_instances,
+    "CreateSnapshot": expand_snapshots,
+    "CreateImage": expand_images,
+}
 
-    ec2 = boto3.resource('ec2')
-    instance = ec2.Instance(instance_id)
-    ec2tags = instance.tags
-    logging.info('Instance Tags:' + str(ec2tags))
 
-    for volume in instance.volumes.all():
-        logging.info('Volume Id: ' + str(volume))
-    #    Create tags on volume if they don't match the instance
-        if volume.tags != ec2tags:
-            logging.warn("Tags don't match. Updating... ")
-            # remove aws tags
-            tag_list = []
+# Instance tags changed: copy the change to everything derived from the
+# instances. Owner tags are not touched.
+def propagate_instance_tags(ids, user, principal):
+    return propagate_from_instances(get_client('ec2'), ids)
 
-            for tag in ec2tags:
-                if not tag['Key'].startswith('aws'):
-                    tag_list.append(tag)
 
-            volume.create_tags(DryRun=False, Tags=tag_list)
-            logging.warn("Volume " + str(volume) +
-                         "updated with tags: " + str(volume.tags))
+BACKENDS = {
+    "ec2": tag_ec2_resources,
+    "tagging": tag_arn_resources,
+    "propagate": propagate_instance_tags,
+}
+# Backends that tag resources with the caller's Owner/PrincipalId
+OWNER_BACKENDS = ("ec2", "tagging")
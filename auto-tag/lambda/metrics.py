@@ -0,0 +1 @@
+../../common/metrics.py
\ No newline at end of file
@@ -0,0 +1,288 @@
+# Keep instance tags in sync on the resources attached to or created from
+# each instance: EBS volumes, ENIs, snapshots of those volumes and AMIs built
+# from those snapshots.
+#
+# A relationship index (child resource -> instance, plus the current tags of
+# both) is built from bulk paginated describe calls, the missing or
+# different tags of each child are computed as a set difference against its
+# instance's tags, and only those deltas are written, one create_tags job per
+# distinct delta. Tags the child has of its own are left alone; removing a tag
+# from an instance is not propagated.
+#
+# Runs as event hooks (RunInstances, CreateTags on instances, CreateSnapshot,
+# CreateImage) and as a scheduled reconciliation of the whole account.
+
+import os
+import time
+import logging
+from fanout import gather
+from metrics import count, instrumented, record
+from tagging import create_tags
+
+# Values per describe filter
+FILTER_BATCH_SIZE = 200
+# InstanceIds per describe_instances call
+DESCRIBE_BATCH_SIZE = 1000
+# Instance tag keys that are never copied, besides reserved aws: keys
+PROPAGATION_EXCLUDED_KEYS = frozenset(
+    key.strip() for key in os.environ.get('PROPAGATION_EXCLUDED_KEYS', '').split(',') if key.strip())
+# Tags naming the principal that created a resource, written by index.py
+OWNER_TAG_KEYS = ("Owner", "PrincipalId")
+CHILD_KINDS = ("volume", "eni", "snapshot", "image")
+
+
+# Parents, children and current tags of one propagation scope
+class RelationshipIndex:
+    def __init__(self):
+        # instance id -> {key: value}
+        self.instances = {}
+        # child id -> instance id
+        self.parents = {}
+        # child id -> {key: value}, or None when not looked up
+        self.tags = {}
+
+
+def tag_dict(tags):
+    return {tag['Key']: tag['Value'] for tag in tags or []}
+
+
+# Time each page fetch of a paginator separately
+def timed_pages(pages, name):
+    pages = iter(pages)
+    while True:
+        start = time.perf_counter()
+        page = next(pages, None)
+        if page is None:
+            return
+        record(name + "Ms", (time.perf_counter() - start) * 1000.0)
+        count(name + "Calls")
+        yield page
+
+
+# Every item of a paginated describe call. With filter_name, values are
+# spread over as many concurrent calls as needed; an empty values list yields
+# nothing.
+def describe_all(ec2, operation, result_key, filter_name=None, values=None, **params):
+    paginator = ec2.get_paginator(operation)
+    name = "".join(part.capitalize() for part in operation.split("_"))
+    if filter_name is None:
+        batches = [params]
+    else:
+        values = list(values)
+        batches = [dict(params, Filters=[{"Name": filter_name, "Values": values[i:i + FILTER_BATCH_SIZE]}])
+                   for i in range(0, len(values), FILTER_BATCH_SIZE)]
+
+    def fetch(batch):
+        return lambda: [item for page in timed_pages(paginator.paginate(**batch), name)
+                        for item in page.get(result_key, [])]
+    return [item for items in gather(fetch(batch) for batch in batches) for item in items]
+
+
+# Collect tags, attached volume IDs and ENI IDs for the given instances (all
+# instances when instance_ids is None) with concurrent paginated
+# describe_instances calls
+def describe_instances(ec2, instance_ids=None):
+    instances = {}
+    paginator = ec2.get_paginator('describe_instances')
+    if instance_ids is None:
+        batches = [{}]
+    else:
+        batches = [{"InstanceIds": instance_ids[i:i + DESCRIBE_BATCH_SIZE]}
+                   for i in range(0, len(instance_ids), DESCRIBE_BATCH_SIZE)]
+
+    def fetch(batch):
+        return lambda: list(timed_pages(paginator.paginate(**batch), "DescribeInstances"))
+    for pages in gather(fetch(batch) for batch in batches):
+        for page in pages:
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    instances[instance['InstanceId']] = {
+                        'tags': instance.get('Tags', []),
+                        'volumes': [mapping['Ebs']['VolumeId']
+                                    for mapping in instance.get('BlockDeviceMappings', [])
+                                    if 'Ebs' in mapping],
+                        'enis': [eni['NetworkInterfaceId']
+                                 for eni in instance.get('NetworkInterfaces', [])]
+                    }
+    return instances
+
+
+# Index instances and their children, downward from instance_ids (the whole
+# account when None). Without child_tags the children's current tags are not
+# looked up and every instance tag counts as missing, which saves the
+# describes for resources that were just created.
+def build_index(ec2, instance_ids=None, kinds=CHILD_KINDS, child_tags=True):
+    index = RelationshipIndex()
+    instances = describe_instances(ec2, instance_ids)
+    for instance_id, instance in instances.items():
+        index.instances[instance_id] = tag_dict(instance['tags'])
+        for child in (instance['volumes'] if "volume" in kinds else []) + \
+                (instance['enis'] if "eni" in kinds else []):
+            index.parents[child] = instance_id
+            index.tags[child] = None
+    whole_account = instance_ids is None
+
+    def child_tag_lookup(operation, result_key, id_key, tags_key, prefix, filter_name):
+        def lookup():
+            if whole_account:
+                items = describe_all(ec2, operation, result_key)
+            else:
+                ids = [child for child in index.parents if child.startswith(prefix)]
+                items = describe_all(ec2, operation, result_key, filter_name, ids)
+            return [(item[id_key], tag_dict(item.get(tags_key))) for item in items]
+        return lookup
+
+    def derived_lookup():
+        volume_parents = {}
+        for instance_id, instance in instances.items():
+            for volume_id in instance['volumes']:
+                volume_parents[volume_id] = instance_id
+        snapshots = describe_all(ec2, 'describe_snapshots', 'Snapshots', OwnerIds=['self']) if whole_account else \
+            describe_all(ec2, 'describe_snapshots', 'Snapshots', 'volume-id', volume_parents, OwnerIds=['self'])
+        derived = RelationshipIndex()
+        snapshot_parents = index_snapshots(derived, snapshots, volume_parents, "snapshot" in kinds)
+        if "image" in kinds and snapshot_parents:
+            images = describe_all(ec2, 'describe_images', 'Images', Owners=['self']) if whole_account else \
+                describe_all(ec2, 'describe_images', 'Images', 'block-device-mapping.snapshot-id',
+                             snapshot_parents, Owners=['self'])
+            index_images(derived, images, snapshot_parents)
+        return derived
+
+    # the volume, ENI and snapshot/image lookups are independent
+    lookups = []
+    if child_tags and "volume" in kinds:
+        lookups.append(child_tag_lookup('describe_volumes', 'Volumes', 'VolumeId', 'Tags',
+                                        "vol-", 'volume-id'))
+    if child_tags and "eni" in kinds:
+        lookups.append(child_tag_lookup('describe_network_interfaces', 'NetworkInterfaces',
+                                        'NetworkInterfaceId', 'TagSet', "eni-", 'network-interface-id'))
+    derived = None
+    if "snapshot" in kinds or "image" in kinds:
+        lookups.append(derived_lookup)
+        derived = len(lookups) - 1
+
+    for n, result in enumerate(gather(lookups)):
+        if n == derived:
+            index.parents.update(result.parents)
+            index.tags.update(result.tags)
+            continue
+        for child, tags in result:
+            if child in index.parents:
+                index.tags[child] = tags
+    return index
+
+
+def index_snapshots(index, snapshots, volume_parents, add_children=True):
+    snapshot_parents = {}
+    for snapshot in snapshots:
+        instance_id = volume_parents.get(snapshot.get('VolumeId'))
+        if instance_id is None:
+            continue
+        snapshot_parents[snapshot['SnapshotId']] = instance_id
+        if add_children:
+            index.parents[snapshot['SnapshotId']] = instance_id
+            index.tags[snapshot['SnapshotId']] = tag_dict(snapshot.get('Tags'))
+    return snapshot_parents
+
+
+def index_images(index, images, snapshot_parents):
+    for image in images:
+        for mapping in image.get('BlockDeviceMappings', []):
+            instance_id = snapshot_parents.get(mapping.get('Ebs', {}).get('SnapshotId'))
+            if instance_id is not None:
+                index.parents[image['ImageId']] = instance_id
+                index.tags[image['ImageId']] = tag_dict(image.get('Tags'))
+                break
+
+
+# Index upward from new snapshots and images to the instances whose volumes
+# they were created from
+def build_index_for_children(ec2, snapshot_ids=(), image_ids=()):
+    index = RelationshipIndex()
+    images = list(describe_all(ec2, 'describe_images', 'Images', 'image-id', image_ids, Owners=['self']))
+    image_snapshots = [mapping['Ebs']['SnapshotId']
+                       for image in images for mapping in image.get('BlockDeviceMappings', [])
+                       if mapping.get('Ebs', {}).get('SnapshotId')]
+    snapshots = list(describe_all(ec2, 'describe_snapshots', 'Snapshots', 'snapshot-id',
+                                  list(snapshot_ids) + image_snapshots, OwnerIds=['self']))
+
+    volume_parents = {}
+    volumes = describe_all(ec2, 'describe_volumes', 'Volumes', 'volume-id',
+                           {snapshot['VolumeId'] for snapshot in snapshots if snapshot.get('VolumeId')})
+    for volume in volumes:
+        for attachment in volume.get('Attachments', []):
+            volume_parents[volume['VolumeId']] = attachment['InstanceId']
+
+    requested = set(snapshot_ids)
+    index_snapshots(index, [s for s in snapshots if s['SnapshotId'] in requested], volume_parents)
+    index_images(index, images, index_snapshots(RelationshipIndex(), snapshots, volume_parents))
+
+    parent_ids = sorted(set(index.parents.values()))
+    if parent_ids:
+        for instance_id, instance in describe_instances(ec2, parent_ids).items():
+            index.instances[instance_id] = tag_dict(instance['tags'])
+    return index
+
+
+# Instance tags that children should carry
+def propagated_tags(tags):
+    return {key: value for key, value in tags.items()
+            if not key.startswith('aws:') and key not in PROPAGATION_EXCLUDED_KEYS}
+
+
+# {frozenset of (key, value) to write: [child ids]}, minimal per child.
+# Keys in excluded are left out, for tags the child gets from elsewhere.
+def tag_deltas(index, excluded=()):
+    desired = {instance_id: {(key, value) for key, value in propagated_tags(tags).items()
+                             if key not in excluded}
+               for instance_id, tags in index.instances.items()}
+    deltas = {}
+    for child, instance_id in index.parents.items():
+        if instance_id not in desired:
+            continue
+        current = index.tags.get(child) or {}
+        delta = frozenset(desired[instance_id] - set(current.items()))
+        if delta:
+            deltas.setdefault(delta, []).append(child)
+    return deltas
+
+
+def apply_deltas(ec2, deltas):
+    jobs = [(sorted(ids), [{"Key": key, "Value": value} for key, value in sorted(delta)])
+            for delta, ids in deltas.items()]
+    count("PropagatedResources", sum(len(ids) for ids, _ in jobs))
+    return create_tags(ec2, jobs)
+
+
+# Event hooks. Each returns create_tags chunk results.
+
+# Instance tags changed: sync everything derived from those instances
+def propagate_from_instances(ec2, instance_ids):
+    instance_ids = [i for i in instance_ids if i.startswith("i-")]
+    if not instance_ids:
+        return []
+    return apply_deltas(ec2, tag_deltas(build_index(ec2, instance_ids), excluded=OWNER_TAG_KEYS))
+
+
+def propagate_to_children(ec2, snapshot_ids=(), image_ids=()):
+    index = build_index_for_children(ec2, snapshot_ids, image_ids)
+    return apply_deltas(ec2, tag_deltas(index, excluded=OWNER_TAG_KEYS))
+
+
+# Scheduled reconciliation of every instance in the account and region
+@instrumented
+def reconcile_handler(event, context):
+    from session_cache import get_client
+
+    ec2 = get_client('ec2')
+    index = build_index(ec2)
+    deltas = tag_deltas(index, excluded=OWNER_TAG_KEYS)
+    results = apply_deltas(ec2, deltas)
+    summary = {
+        "instances": len(index.instances),
+        "children": len(index.parents),
+        "updated": sum(len(ids) for ids in deltas.values()),
+        "failed": sum(len(r["resources"]) for r in results if not r["success"])
+    }
+    logging.info("Tag propagation reconciled: " + str(summary))
+    return summary
@@ -0,0 +1 @@
+../../common/ratelimit.py
\ No newline at end of file
@@ -0,0 +1 @@
+../../common/session_cache.py
\ No newline at end of file
@@ -0,0 +1,136 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from metrics import count, record, timer
+from ratelimit import THROTTLE_ERRORS, backoff, client_region, get_limiter
+
+# Resource IDs per create_tags call
+CREATE_TAGS_CHUNK_SIZE = int(os.environ.get('CREATE_TAGS_CHUNK_SIZE', 500))
+# TagResources accepts at most 20 ARNs per call
+TAG_RESOURCES_CHUNK_SIZE = 20
+# Concurrent create_tags calls per invocation
+TAGGING_MAX_WORKERS = int(os.environ.get('TAGGING_MAX_WORKERS', 8))
+TAGGING_MAX_RETRIES = 5
+
+
+def _tag_chunk(ec2, resource_ids, tags):
+    # botocore is already loaded by the time a client exists
+    from botocore.exceptions import ClientError
+
+    limiter = get_limiter("ec2:CreateTags", region=client_region(ec2))
+    result = {"resources": resource_ids, "success": False, "attempts": 0, "error": None}
+    for attempt in range(TAGGING_MAX_RETRIES + 1):
+        result["attempts"] = attempt + 1
+        limiter.acquire()
+        try:
+            with timer("CreateTags"):
+                ec2.create_tags(Resources=resource_ids, Tags=tags)
+            result["success"] = True
+            result["error"] = None
+            count("ResourcesTagged", len(resource_ids))
+            record("ResourcesPerTagCall", len(resource_ids), "Count")
+            return result
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code')
+            result["error"] = code or str(e)
+            if code not in THROTTLE_ERRORS:
+                return result
+            count("ThrottleRetries")
+            limiter.throttled()
+            backoff(attempt)
+    return result
+
+
+# Split each (resource_ids, tags) job into chunks and run the chunks
+# concurrently. Returns one result dict per chunk.
+def create_tags(ec2, jobs, chunk_size=CREATE_TAGS_CHUNK_SIZE, max_workers=TAGGING_MAX_WORKERS):
+    chunks = []
+    for resource_ids, tags in jobs:
+        for i in range(0, len(resource_ids), chunk_size):
+            chunks.append((resource_ids[i:i + chunk_size], tags))
+    if not chunks:
+        return []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as pool:
+        results = list(pool.map(lambda chunk: _tag_chunk(ec2, *chunk), chunks))
+
+    for result in results:
+        if result["success"]:
+            logging.info("Tagged " + str(len(result["resources"])) +
+                         " resources in " + str(result["attempts"]) + " attempt(s)")
+        else:
+            logging.error("Failed to tag " + str(result["resources"]) +
+                          ": " + str(result["error"]))
+    return results
+
+
+# Failed ARNs of a TagResources call worth retrying: throttled or 5xx
+def _retryable(failure):
+    return failure.get('ErrorCode') in THROTTLE_ERRORS or failure.get('StatusCode', 0) >= 500
+
+
+def _tag_arn_chunk(client, arns, tags):
+    from botocore.exceptions import ClientError
+
+    limiter = get_limiter("tag:TagResources", region=client_region(client))
+    result = {"resources": arns, "success": False, "attempts": 0, "error": None}
+    pending = arns
+    # ARN -> failure, for ARNs that will not succeed on retry
+    failed = {}
+    for attempt in range(TAGGING_MAX_RETRIES + 1):
+        result["attempts"] = attempt + 1
+        limiter.acquire()
+        try:
+            with timer("TagResources"):
+                response = client.tag_resources(ResourceARNList=pending, Tags=tags)
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code')
+            result["error"] = code or str(e)
+            if code not in THROTTLE_ERRORS:
+                return result
+            count("ThrottleRetries")
+            limiter.throttled()
+            backoff(attempt)
+            continue
+        failures = response.get('FailedResourcesMap', {})
+        count("ResourcesTagged", len(pending) - len(failures))
+        record("ResourcesPerTagCall", len(pending) - len(failures), "Count")
+        # retry only the throttled and 5xx ARNs, the rest fail now
+        pending = [arn for arn, failure in failures.items() if _retryable(failure)]
+        failed.update((arn, failure) for arn, failure in failures.items() if arn not in pending)
+        if not pending:
+            break
+        result["error"] = str(dict(failed, **{arn: failures[arn] for arn in pending}))
+        if any(failures[arn].get('ErrorCode') in THROTTLE_ERRORS for arn in pending):
+            count("ThrottleRetries")
+            limiter.throttled()
+        count("TagResourcesRetries")
+        backoff(attempt)
+    if pending:
+        return result
+    if failed:
+        result["error"] = str(failed)
+        return result
+    result["success"] = True
+    result["error"] = None
+    return result
+
+
+# Same as create_tags, for ARN-addressed resources through the Resource Groups
+# Tagging API. tags is a {key: value} dict.
+def tag_resources(client, jobs, max_workers=TAGGING_MAX_WORKERS):
+    chunks = []
+    for arns, tags in jobs:
+        for i in range(0, len(arns), TAG_RESOURCES_CHUNK_SIZE):
+            chunks.append((arns[i:i + TAG_RESOURCES_CHUNK_SIZE], tags))
+    if not chunks:
+        return []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as pool:
+        results = list(pool.map(lambda chunk: _tag_arn_chunk(client, *chunk), chunks))
+
+    for result in results:
+        if not result["success"]:
+            logging.error("Failed to tag " + str(result["resources"]) +
+                          ": " + str(result["error"]))
+    return results
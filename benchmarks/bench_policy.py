@@ -0,0 +1,104 @@
+# Micro-benchmark: required tag evaluation with the original nested loops vs
+# the compiled TagPolicy.
+#
+# Usage: python benchmarks/bench_policy.py [--resources N] [--tags N] [--required N]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "config", "required_tags", "lambda"))
+
+from policy import get_policy  # noqa: E402
+
+
+# The find_violation loop as it was before TagPolicy, minus logging/remediation
+def legacy_check(current_tags, required_tags):
+    incorrect_value = []
+    case_mismatch = []
+    tag_not_present = []
+
+    for rtag, rvalues in required_tags.items():
+        if rtag not in ['exec_role', 'Name']:
+            tag_present = False
+            value_match = False
+            for key, value in current_tags.items():
+                if key == rtag:
+                    tag_present = True
+                    rvaluesplit = rvalues.split(",")
+                    for rvalue in rvaluesplit:
+                        if value == rvalue:
+                            value_match = True
+                    if not value_match:
+                        incorrect_value += [rtag]
+                    break
+                elif key.lower() == rtag.lower():
+                    case_mismatch += [rtag]
+                    break
+
+            if not (tag_present and value_match):
+                tag_not_present += [rtag]
+
+    return incorrect_value, tag_not_present, case_mismatch
+
+
+def build_corpus(resources, tags, required, seed=7):
+    rng = random.Random(seed)
+    rule_parameters = {"exec_role": "arn:aws:iam::123456789012:role/configRemediationLambdaRole"}
+    for i in range(required):
+        rule_parameters["Required" + str(i)] = ",".join("v" + str(j) for j in range(5))
+
+    corpus = []
+    for _ in range(resources):
+        current_tags = {}
+        for i in range(required):
+            roll = rng.random()
+            if roll < 0.8:
+                current_tags["Required" + str(i)] = "v" + str(rng.randrange(6))
+            elif roll < 0.9:
+                current_tags["required" + str(i)] = "v0"
+        for i in range(max(tags - len(current_tags), 0)):
+            current_tags["Extra" + str(i)] = "x" + str(i)
+        corpus.append(current_tags)
+    return rule_parameters, corpus
+
+
+def run(name, check, corpus):
+    start = time.perf_counter()
+    for current_tags in corpus:
+        check(current_tags)
+    elapsed = time.perf_counter() - start
+    print("{:<10} {:>10.0f} resources/s  ({:.3f}s)".format(name, len(corpus) / elapsed, elapsed))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resources", type=int, default=20000)
+    parser.add_argument("--tags", type=int, default=50)
+    parser.add_argument("--required", type=int, default=30)
+    args = parser.parse_args()
+
+    rule_parameters, corpus = build_corpus(args.resources, args.tags, args.required)
+    print("{} resources, {} tags each, {} required keys".format(args.resources, args.tags, args.required))
+
+    policy = get_policy(rule_parameters)
+    for current_tags in corpus[:100]:
+        legacy = legacy_check(current_tags, rule_parameters)
+        compiled = policy.check(current_tags)
+        assert sorted(legacy[0]) == sorted(compiled[0]), (legacy, compiled)
+        # the legacy loop also reported incorrect values as not present
+        assert sorted(legacy[1]) == sorted(compiled[0] + compiled[1]), (legacy, compiled)
+        assert sorted(legacy[2]) == sorted(compiled[2]), (legacy, compiled)
+
+    legacy = run("legacy", lambda t: legacy_check(t, rule_parameters), corpus)
+    compiled = run("compiled", policy.check, corpus)
+    # per-resource policy lookup, as find_violation does when handed a dict
+    lookup = run("memoized", lambda t: get_policy(rule_parameters).check(t), corpus)
+    print("speedup    {:>10.1f}x compiled, {:.1f}x memoized".format(legacy / compiled, legacy / lookup))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# Import-time (cold start) profile of both Lambda handlers.
+#
+# Runs `python -X importtime -c "import <handler>"` in a fresh interpreter for
+# each Lambda and reports the total import time and the slowest modules, and
+# the wall time of importing the handler and creating the first client it
+# needs, which is what a cold start that makes any AWS call pays. With
+# --baseline REF the same handlers are profiled from another git revision
+# (e.g. the commit before lazy boto3 loading) to show the difference.
+#
+#   python benchmarks/importtime.py
+#   python benchmarks/importtime.py --baseline HEAD~1 --runs 5
+#
+# Requires boto3/botocore to be installed, as in the Lambda runtime. The last
+# recorded run is in importtime.txt.
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# (name, lambda directory relative to the repo root, module to import,
+# service of the first client)
+HANDLERS = [
+    ("config", os.path.join("config", "required_tags", "lambda"), "handler", "config"),
+    ("autotag", os.path.join("auto-tag", "lambda"), "index", "ec2"),
+]
+# Linked into the lambda directories in later revisions (see build.py)
+SHARED = "common"
+FIRST_CLIENT = ("import time; start = time.perf_counter(); import {module}, boto3; "
+                "boto3.client('{service}', region_name='us-east-1'); print(time.perf_counter() - start)")
+
+LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+# Return (total microseconds, [(cumulative us, module)]) for one import
+def profile(lambda_dir, module):
+    result = run(lambda_dir, ["-X", "importtime", "-c", "import " + module])
+
+
+    modules = []
+    total = 0
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if not match:
+            continue
+        cumulative, depth, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        modules.append((cumulative, name))
+        if depth == 1:
+            total += cumulative
+    return total, sorted(modules, reverse=True)
+
+
+# Milliseconds to import module and create a client of service
+def first_client(lambda_dir, module, service):
+    result = run(lambda_dir, ["-c", FIRST_CLIENT.format(module=module, service=service)])
+    return float(result.stdout) * 1000.0
+
+
+def run(lambda_dir, args):
+    env = dict(os.environ, LOG_LEVEL="ERROR", PYTHONDONTWRITEBYTECODE="1")
+    result = subprocess.run([sys.executable] + args, cwd=lambda_dir, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return result
+
+
+def report(label, root, runs, top):
+    print("== " + label)
+    for name, lambda_dir, module, service in HANDLERS:
+        try:
+            samples = [profile(os.path.join(root, lambda_dir), module) for _ in range(runs)]
+            clients = [first_client(os.path.join(root, lambda_dir), module, service) for _ in range(runs)]
+        except RuntimeError as e:
+            print("{:<8} import failed: {}".format(name, e))
+            continue
+        totals = [total for total, _ in samples]
+        print("{:<8} median {:>8.1f} ms  (min {:.1f} ms over {} runs)".format(
+            name, statistics.median(totals) / 1000.0, min(totals) / 1000.0, runs))
+        for cumulative, module_name in samples[totals.index(min(totals))][1][:top]:
+            print("           {:>8.1f} ms  {}".format(cumulative / 1000.0, module_name))
+        print("{:<8} median {:>8.1f} ms  import and first {} client (wall time)".format(
+            "", statistics.median(clients), service))
+
+
+# Extract the lambda directories at ref into a temporary tree
+def checkout(ref, target):
+    paths = [lambda_dir for _, lambda_dir, _, _ in HANDLERS]
+    if subprocess.run(["git", "cat-file", "-e", ref + ":" + SHARED], cwd=ROOT, capture_output=True).returncode == 0:
+        paths.append(SHARED)
+    archive = subprocess.run(["git", "archive", "--format=tar", ref] + paths,
+                             cwd=ROOT, capture_output=True, check=True)
+    tar_path = os.path.join(target, "tree.tar")
+    with open(tar_path, "wb") as tar:
+        tar.write(archive.stdout)
+    with tarfile.open(tar_path) as tar:
+        tar.extractall(target)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time profile of the Lambda handlers")
+    parser.add_argument("--baseline", help="git revision to compare against")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.baseline:
+        with tempfile.TemporaryDirectory() as tree:
+            checkout(args.baseline, tree)
+            report("baseline " + args.baseline, tree, args.runs, args.top)
+    report("working tree", ROOT, args.runs, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+# Offline replay harness for both Lambdas.
+#
+# Replays a JSONL corpus of recorded events through the handlers with every
+# AWS call answered in-process by StubAWS, and reports throughput, latency
+# percentiles and API calls per event.
+#
+#   python benchmarks/replay.py generate config --resources 10000 -o config.jsonl
+#   python benchmarks/replay.py generate autotag --resources 10000 -o autotag.jsonl
+#   python benchmarks/replay.py run config config.jsonl
+#   python benchmarks/replay.py run config-batch config.jsonl --batch-size 500
+#   python benchmarks/replay.py run autotag autotag.jsonl --min-eps 500
+#
+# Corpus lines are the events as the Lambda receives them: Config rule events
+# (invokingEvent/ruleParameters/resultToken) or EventBridge CloudTrail events
+# ({"detail": {...}}). With --min-eps / --max-p99-ms / --max-calls-per-event
+# the run exits non-zero when the threshold is missed, for use as a gate.
+# Only the standard library is needed; boto3 and botocore are stubbed when
+# they are not installed.
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import random
+import sys
+import time
+import types
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+CONFIG_LAMBDA = os.path.join(ROOT, "config", "required_tags", "lambda")
+AUTOTAG_LAMBDA = os.path.join(ROOT, "auto-tag", "lambda")
+
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+# Measure handler overhead, not the client-side API rate limits
+os.environ.setdefault("RATE_LIMITS", "ec2:CreateTags=1e9,tag:TagResources=1e9,config:PutEvaluations=1e9")
+
+
+# Register minimal boto3/botocore modules when the SDK is not installed, so
+# the harness runs on the standard library alone. StubAWS answers every call
+# either way; the handlers only need boto3.session.Session to patch and
+# botocore.exceptions.ClientError to catch.
+def install_sdk_stubs():
+    try:
+        import boto3.session  # noqa: F401
+        import botocore.exceptions  # noqa: F401
+        return
+    except ImportError:
+        pass
+
+    class ClientError(Exception):
+        def __init__(self, error_response, operation_name):
+            super().__init__(str(error_response))
+            self.response = error_response
+            self.operation_name = operation_name
+
+    class Session:
+        def __init__(self, *args, **kwargs):
+            raise RuntimeError("boto3 is not installed; only replay() can create sessions")
+
+    boto3 = types.ModuleType("boto3")
+    boto3.session = types.ModuleType("boto3.session")
+    boto3.session.Session = Session
+    botocore = types.ModuleType("botocore")
+    botocore.exceptions = types.ModuleType("botocore.exceptions")
+    botocore.exceptions.ClientError = ClientError
+    sys.modules.update({"boto3": boto3, "boto3.session": boto3.session,
+                        "botocore": botocore, "botocore.exceptions": botocore.exceptions})
+
+
+install_sdk_stubs()
+
+
+# In-process stand-in for the AWS APIs the Lambdas call. It replaces
+# boto3.session.Session, so every call is counted and answered from RESPONDERS
+# (or with an empty response), after an optional simulated round-trip latency.
+class StubAWS:
+    def __init__(self, latency_ms=0.0):
+        self.latency = latency_ms / 1000.0
+        self.calls = Counter()
+
+    def session(self, *args, **kwargs):
+        return self
+
+    def client(self, service, *args, **kwargs):
+        return StubClient(self, service)
+
+    def call(self, service, operation, params):
+        self.calls[service + "." + operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        responder = RESPONDERS.get((service, operation))
+        return responder(params) if responder else {}
+
+
+class StubClient:
+    def __init__(self, aws, service):
+        self._aws = aws
+        self._service = service
+
+    def get_paginator(self, operation):
+        client = self
+
+        class Paginator:
+            def paginate(self, **params):
+                yield client._aws.call(client._service, operation, params)
+        return Paginator()
+
+    def __getattr__(self, operation):
+        if operation.startswith("_"):
+            raise AttributeError(operation)
+        return lambda **params: self._aws.call(self._service, operation, params)
+
+
+def _assume_role(params):
+    return {"Credentials": {
+        "AccessKeyId": "ASIASTUB", "SecretAccessKey": "stub", "SessionToken": "stub",
+        "Expiration": datetime.now(timezone.utc) + timedelta(hours=1)}}
+
+
+def _describe_instances(params):
+    return {"Reservations": [{"Instances": [{
+        "InstanceId": instance_id,
+        "Tags": [{"Key": "Name", "Value": "replay"}],
+        "BlockDeviceMappings": [{"Ebs": {"VolumeId": "vol-" + instance_id[2:]}}],
+        "NetworkInterfaces": [{"NetworkInterfaceId": "eni-" + instance_id[2:]}]
+    } for instance_id in params.get("InstanceIds", [])]}]}
+
+
+RESPONDERS = {
+    ("sts", "assume_role"): _assume_role,
+    ("ec2", "describe_instances"): _describe_instances,
+    ("config", "put_evaluations"): lambda params: {"FailedEvaluations": []},
+    ("resourcegroupstaggingapi", "tag_resources"): lambda params: {"FailedResourcesMap": {}},
+}
+
+
+# Synthetic corpora
+
+RULE_PARAMETERS = {
+    "exec_role": "arn:aws:iam::123456789012:role/configRemediationLambdaRole",
+    "CostCenter": "R&D,Ops,Finance",
+    "Environment": "Dev,Stage,Prod",
+    "Owner": "platform,data,web",
+    "BackupSchedule": "A,B,C",
+}
+
+
+def generate_config(resources, rng):
+    for n in range(resources):
+        resource_type = rng.choice(["AWS::EC2::Instance", "AWS::EC2::Volume"])
+        resource_id = ("i-" if resource_type == "AWS::EC2::Instance" else "vol-") + format(n, "017x")
+        tags = {"Name": "resource-" + str(n)}
+        for key, values in RULE_PARAMETERS.items():
+            if key == "exec_role" or rng.random() < 0.2:
+                continue
+            tags[key] = rng.choice(values.split(",") + ["wrong"])
+        configuration_item = {
+            "configurationItemCaptureTime": "2022-07-26T19:43:33.411Z",
+            "awsAccountId": "123456789012",
+            "configurationItemStatus": "OK",
+            "resourceType": resource_type,
+            "resourceId": resource_id,
+            "ARN": "arn:aws:ec2:us-east-1:123456789012:" +
+                   ("instance/" if resource_type == "AWS::EC2::Instance" else "volume/") + resource_id,
+            "awsRegion": "us-east-1",
+            "tags": tags,
+        }
+        yield {
+            "version": "1.0",
+            "invokingEvent": json.dumps({
+                "configurationItemDiff": None,
+                "configurationItem": configuration_item,
+                "messageType": "ConfigurationItemChangeNotification"}),
+            "ruleParameters": json.dumps(RULE_PARAMETERS),
+            "resultToken": "replay-" + str(n),
+            "configRuleName": "required_tag_remediation",
+            "accountId": "123456789012"
+        }
+
+
+def generate_autotag(resources, rng):
+    n = 0
+    while n < resources:
+        user = rng.choice(["alice", "bob", "pipeline"])
+        detail = {
+            "eventID": "%08x-%04x-%04x-%04x-%012x" % tuple(rng.getrandbits(b) for b in (32, 16, 16, 16, 48)),
+            "eventSource": "ec2.amazonaws.com",
+            "awsRegion": "us-east-1",
+            "recipientAccountId": "123456789012",
+            "userIdentity": {
+                "type": "AssumedRole",
+                "principalId": "AROASTUB:" + user,
+                "arn": "arn:aws:sts::123456789012:assumed-role/dev/" + user
+            }
+        }
+        kind = rng.random()
+        if kind < 0.4:
+            count = rng.randint(1, 50)
+            detail["eventName"] = "RunInstances"
+            detail["responseElements"] = {"instancesSet": {"items": [
+                {"instanceId": "i-" + format(n + i, "017x")} for i in range(count)]}}
+            n += count
+        elif kind < 0.8:
+            detail["eventName"] = "CreateVolume"
+            detail["responseElements"] = {"volumeId": "vol-" + format(n, "017x")}
+            n += 1
+        else:
+            detail["eventSource"] = "s3.amazonaws.com"
+            detail["eventName"] = "CreateBucket"
+            detail["requestParameters"] = {"bucketName": "bucket-" + str(n)}
+            detail["responseElements"] = None
+            n += 1
+        yield {"detail-type": "AWS API Call via CloudTrail", "source": "aws." + detail["eventSource"].split(".")[0],
+               "detail": detail}
+
+
+GENERATORS = {"config": generate_config, "autotag": generate_autotag}
+
+
+# Replay
+
+def load_corpus(path):
+    with open(path) as corpus:
+        return [json.loads(line) for line in corpus if line.strip()]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100.0))]
+
+
+def replay(target, events, aws, batch_size, log_level):
+    if target == "autotag":
+        sys.path.insert(0, AUTOTAG_LAMBDA)
+        import index
+        import session_cache
+        session_cache.clear()
+        invocations = [(index.lambda_handler, event, 1) for event in events]
+    else:
+        sys.path.insert(0, CONFIG_LAMBDA)
+        import handler
+        import session_cache
+        session_cache.clear()
+        if target == "config-batch":
+            invocations = []
+            for i in range(0, len(events), batch_size):
+                chunk = events[i:i + batch_size]
+                invocations.append((handler.batch_handler, {"Records": [
+                    {"messageId": str(i + j), "body": json.dumps(event)}
+                    for j, event in enumerate(chunk)]}, len(chunk)))
+        else:
+            invocations = [(handler.lambda_handler, event, 1) for event in events]
+
+    # the handlers set their own level at import
+    logging.getLogger().setLevel(log_level)
+
+    latencies = []
+    start = time.perf_counter()
+    with mock.patch("boto3.session.Session", aws.session), contextlib.redirect_stdout(io.StringIO()):
+        for function, event, _ in invocations:
+            t0 = time.perf_counter()
+            function(event, None)
+            latencies.append(time.perf_counter() - t0)
+    return time.perf_counter() - start, latencies, sum(size for _, _, size in invocations)
+
+
+def run(args):
+    events = load_corpus(args.corpus)
+    aws = StubAWS(args.api_latency_ms)
+    elapsed, latencies, count = replay(args.target, events, aws, args.batch_size, args.log_level)
+
+    total_calls = sum(aws.calls.values())
+    report = {
+        "target": args.target,
+        "events": count,
+        "invocations": len(latencies),
+        "seconds": round(elapsed, 3),
+        "events_per_second": round(count / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "api_calls_per_event": round(total_calls / count, 3),
+        "api_calls": dict(aws.calls.most_common()),
+    }
+    print(json.dumps(report, indent=2))
+
+    failed = []
+    if args.min_eps is not None and report["events_per_second"] < args.min_eps:
+        failed.append("events/s below " + str(args.min_eps))
+    if args.max_p99_ms is not None and report["p99_ms"] > args.max_p99_ms:
+        failed.append("p99 above " + str(args.max_p99_ms) + "ms")
+    if args.max_calls_per_event is not None and report["api_calls_per_event"] > args.max_calls_per_event:
+        failed.append("API calls per event above " + str(args.max_calls_per_event))
+    for reason in failed:
+        print("GATE FAILED: " + reason, file=sys.stderr)
+    return 1 if failed else 0
+
+
+# At-least-once delivery: each event is delivered again, a few events later,
+# with probability rate
+def with_duplicates(events, rate, rng):
+    pending = []
+    for event in events:
+        yield event
+        if rng.random() < rate:
+            pending.append(event)
+        if len(pending) > 8:
+            yield pending.pop(0)
+    for event in pending:
+        yield event
+
+
+def generate(args):
+    rng = random.Random(args.seed)
+    out = open(args.output, "w") if args.output else sys.stdout
+    with out:
+        for event in with_duplicates(GENERATORS[args.target](args.resources, rng), args.duplicate_rate, rng):
+            out.write(json.dumps(event) + "\n")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline replay harness for the tagging Lambdas")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    gen = commands.add_parser("generate", help="write a synthetic corpus")
+    gen.add_argument("target", choices=sorted(GENERATORS))
+    gen.add_argument("--resources", type=int, default=10000)
+    gen.add_argument("--seed", type=int, default=7)
+    gen.add_argument("--duplicate-rate", type=float, default=0.0,
+                     help="fraction of events delivered twice")
+    gen.add_argument("-o", "--output")
+    gen.set_defaults(func=generate)
+
+    rep = commands.add_parser("run", help="replay a corpus")
+    rep.add_argument("target", choices=["config", "config-batch", "autotag"])
+    rep.add_argument("corpus")
+    rep.add_argument("--batch-size", type=int, default=100)
+    rep.add_argument("--api-latency-ms", type=float, default=0.0)
+    rep.add_argument("--log-level", default="ERROR")
+    rep.add_argument("--min-eps", type=float)
+    rep.add_argument("--max-p99-ms", type=float)
+    rep.add_argument("--max-calls-per-event", type=float)
+    rep.set_defaults(func=run)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
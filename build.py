@@ -0,0 +1,55 @@
+# Package the Lambda functions as the zip files the CloudFormation stacks
+# deploy from S3 (FunctionS3ObjectName).
+#
+#   python build.py                      both functions, into dist/
+#   python build.py config -o lambda.zip
+#
+# The modules shared by both functions live once in common/ and are linked
+# into each function directory; the zip holds their contents, not the links.
+
+import os
+import sys
+import zipfile
+import argparse
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FUNCTIONS = {
+    "config": os.path.join(ROOT, "config", "required_tags", "lambda"),
+    "autotag": os.path.join(ROOT, "auto-tag", "lambda"),
+}
+
+
+def build(name, output):
+    source = FUNCTIONS[name]
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as package:
+        for directory, subdirectories, files in os.walk(source):
+            subdirectories[:] = [d for d in subdirectories if d != "__pycache__"]
+            for file_name in sorted(files):
+                if not file_name.endswith(".py"):
+                    continue
+                path = os.path.join(directory, file_name)
+                if not os.path.exists(path):
+                    sys.exit("Broken link " + path + "; is common/ checked out?")
+                # ZipFile.write stores what a link points to
+                package.write(path, os.path.relpath(path, source))
+    print(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Package the Lambda functions")
+    parser.add_argument("function", nargs="?", choices=sorted(FUNCTIONS))
+    parser.add_argument("-o", "--output", help="zip file, only with a single function")
+    args = parser.parse_args()
+
+    if args.output and not args.function:
+        parser.error("--output needs a function")
+    if args.function:
+        build(args.function, args.output or os.path.join(ROOT, "dist", args.function + ".zip"))
+        return
+    for name in sorted(FUNCTIONS):
+        build(name, os.path.join(ROOT, "dist", name + ".zip"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# Per-invocation timing and counting, emitted as one CloudWatch Embedded
+# Metric Format (EMF) line when the handler returns.
+#
+#   with timer("AssumeRole"):          AssumeRoleMs samples + AssumeRoleCalls
+#       ...
+#   count("ResourcesTagged", 20)       summed over the invocation
+#   record("ResourcesPerCall", 20, "Count")   one sample per call
+#
+# Safe to call from worker threads. Configured with METRICS_NAMESPACE,
+# METRICS_ENABLED and PAYLOAD_LOG_SAMPLE_RATE.
+#
+# Shared by both Lambdas: this is the only copy, linked into
+# config/required_tags/lambda and auto-tag/lambda (see build.py).
+
+import os
+import json
+import time
+import random
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'TagCompliance')
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+# Fraction of invocations that log full event payloads at INFO
+PAYLOAD_LOG_SAMPLE_RATE = float(os.environ.get('PAYLOAD_LOG_SAMPLE_RATE', 0.01))
+# EMF accepts at most 100 values per metric
+MAX_SAMPLES = 100
+
+_lock = threading.Lock()
+_counters = {}
+# name -> (unit, [values])
+_samples = {}
+_depth = 0
+_sampled = False
+
+
+def count(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def record(name, value, unit="Milliseconds"):
+    with _lock:
+        _samples.setdefault(name, (unit, []))[1].append(value)
+
+
+@contextmanager
+def timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name + "Ms", (time.perf_counter() - start) * 1000.0)
+        count(name + "Calls")
+
+
+# Log a large payload only on sampled invocations, or always at DEBUG
+def log_payload(label, payload):
+    if _sampled or logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.info(label + ": " + str(payload))
+
+
+def _downsample(values):
+    if len(values) <= MAX_SAMPLES:
+        return values
+    step = len(values) / float(MAX_SAMPLES)
+    return [values[int(i * step)] for i in range(MAX_SAMPLES)]
+
+
+# Build the EMF document for everything recorded since the last reset
+def emf_document(function_name):
+    with _lock:
+        counters = dict(_counters)
+        samples = {name: (unit, list(values)) for name, (unit, values) in _samples.items()}
+
+    document = {"FunctionName": function_name}
+    definitions = []
+    for name, (unit, values) in sorted(samples.items()):
+        document[name] = [round(v, 3) for v in _downsample(values)]
+        definitions.append({"Name": name, "Unit": unit})
+    for name, value in sorted(counters.items()):
+        document[name] = value
+        definitions.append({"Name": name, "Unit": "Count"})
+
+    document["_aws"] = {
+        "Timestamp": int(time.time() * 1000),
+        "CloudWatchMetrics": [{
+            "Namespace": NAMESPACE,
+            "Dimensions": [["FunctionName"]],
+            "Metrics": definitions
+        }]
+    }
+    return document
+
+
+def reset():
+    global _sampled
+    with _lock:
+        _counters.clear()
+        _samples.clear()
+    _sampled = random.random() < PAYLOAD_LOG_SAMPLE_RATE
+
+
+def flush(function_name):
+    if METRICS_ENABLED and (_counters or _samples):
+        # EMF must be a bare JSON line, so bypass the log formatter
+        print(json.dumps(emf_document(function_name)))
+    reset()
+
+
+# Wrap a handler so each invocation starts clean and emits one EMF line.
+# Nested instrumented handlers report through the outermost one.
+def instrumented(handler):
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global _depth
+        if _depth == 0:
+            reset()
+        _depth += 1
+        start = time.perf_counter()
+        try:
+            return handler(event, context)
+        finally:
+            _depth -= 1
+            if _depth == 0:
+                record("InvocationMs", (time.perf_counter() - start) * 1000.0)
+                flush(getattr(context, "function_name", None) or
+                      os.environ.get('AWS_LAMBDA_FUNCTION_NAME', handler.__name__))
+    return wrapper
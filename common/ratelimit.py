@@ -0,0 +1,240 @@
+# Adaptive client-side rate limiting for the tagging APIs.
+#
+# One token bucket per (API, account, region), starting at the API's
+# configured rate. A throttling response halves the bucket's rate
+# (multiplicative decrease); every second without throttling gives back
+# ADDITIVE_INCREASE calls/s, up to the configured rate (additive increase).
+#
+# With RATE_LIMIT_TABLE set, buckets draw their tokens in short leases from a
+# shared DynamoDB item per key instead of refilling locally, so concurrent
+# invocations share one budget and one adapted rate. Rates are configured
+# with RATE_LIMITS, e.g. "tag:TagResources=5,config:PutEvaluations=10".
+#
+# THROTTLE_ERRORS and backoff are the throttling error codes and the retry
+# delay of every tagging and reporting call.
+#
+# Shared by both Lambdas: this is the only copy, linked into
+# config/required_tags/lambda and auto-tag/lambda (see build.py).
+
+import os
+import time
+import random
+import logging
+import threading
+from metrics import count
+
+DEFAULT_RATES = {
+    "ec2:CreateTags": 20.0,
+    "tag:TagResources": 5.0,
+    "config:PutEvaluations": 10.0,
+}
+# calls/s regained per second without throttling
+ADDITIVE_INCREASE = 1.0
+MULTIPLICATIVE_DECREASE = 0.5
+MIN_RATE = 0.2
+# Tokens leased from the shared bucket at a time, in seconds of rate
+LEASE_SECONDS = 0.5
+LEASE_RETRIES = 3
+# Shared bucket items expire after an hour without use
+SHARED_STATE_TTL = 3600
+# Error codes of a throttled call, across EC2, Config and the tagging API
+THROTTLE_ERRORS = ('RequestLimitExceeded', 'Throttling', 'ThrottlingException', 'ThrottledException')
+BACKOFF_BASE_SECONDS = 0.2
+BACKOFF_MAX_SECONDS = 10
+
+RATE_LIMIT_TABLE = os.environ.get('RATE_LIMIT_TABLE')
+
+
+_rate_overrides = {}
+
+
+def configured_rates():
+    rates = dict(DEFAULT_RATES)
+    for setting in os.environ.get('RATE_LIMITS', '').split(','):
+        if '=' in setting:
+            api, rate = setting.rsplit('=', 1)
+            rates[api.strip()] = float(rate)
+    rates.update(_rate_overrides)
+    return rates
+
+
+# Full-jitter exponential backoff after failed attempt number attempt (from 0)
+def backoff(attempt):
+    time.sleep(random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt)))
+
+
+class TokenBucket:
+    def __init__(self, key, ceiling, store=None):
+        self.key = key
+        self.ceiling = ceiling
+        self.rate = ceiling
+        self.tokens = 0.0 if store else max(1.0, ceiling)
+        self.updated = time.monotonic()
+        self.store = store
+        self._lock = threading.Lock()
+
+    # Additive increase, and local refill when there is no shared store
+    def _advance(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        self.rate = min(self.ceiling, self.rate + ADDITIVE_INCREASE * elapsed)
+        if self.store is None:
+            self.tokens = min(max(1.0, self.rate), self.tokens + elapsed * self.rate)
+
+    def _lease(self):
+        try:
+            granted, rate = self.store.lease(self.key, max(1, int(self.rate * LEASE_SECONDS)), self.ceiling)
+        except Exception as e:
+            logging.warning("Shared rate limit unavailable, limiting locally: " + str(e))
+            self.store = None
+            return
+        self.tokens += granted
+        if rate is not None:
+            self.rate = rate
+
+    # Block until a call may be made
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._advance(time.monotonic())
+                if self.tokens < 1 and self.store is not None:
+                    self._lease()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate if self.store is None else 1.0 / self.rate
+            count("RateLimitWaits")
+            time.sleep(wait)
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(MIN_RATE, self.rate * MULTIPLICATIVE_DECREASE)
+            self.tokens = min(self.tokens, 0.0)
+            rate = self.rate
+        logging.info("Throttled on " + self.key + ", rate now " + str(round(rate, 2)) + "/s")
+        if self.store is not None:
+            try:
+                self.store.decrease(self.key, rate)
+            except Exception as e:
+                logging.warning("Could not share throttled rate: " + str(e))
+
+
+# Shared token buckets, one DynamoDB item per limiter key. Each lease is a
+# read plus a conditional write on the item's version, so concurrent
+# invocations never hand out the same tokens twice.
+class DynamoDBBucketStore:
+    def __init__(self, table):
+        self.table = table
+
+    def _client(self):
+        from session_cache import get_client
+        return get_client('dynamodb')
+
+    # Take up to want tokens. Returns (tokens granted, shared rate).
+    def lease(self, key, want, ceiling):
+        from botocore.exceptions import ClientError
+
+        client = self._client()
+        for _ in range(LEASE_RETRIES):
+            now = time.time()
+            item = client.get_item(
+                TableName=self.table,
+                Key={"limiter_key": {"S": key}},
+                ConsistentRead=True
+            ).get("Item")
+            if item:
+                rate = float(item["rate"]["N"])
+                tokens = float(item["tokens"]["N"])
+                elapsed = max(0.0, now - float(item["updated_at"]["N"]))
+                version = int(item["version"]["N"])
+            else:
+                rate, tokens, elapsed, version = ceiling, ceiling, 0.0, 0
+
+            rate = min(ceiling, rate + ADDITIVE_INCREASE * elapsed)
+            tokens = min(max(1.0, rate), tokens + elapsed * rate)
+            granted = min(want, int(tokens))
+            try:
+                client.put_item(
+                    TableName=self.table,
+                    Item={
+                        "limiter_key": {"S": key},
+                        "rate": {"N": repr(rate)},
+                        "tokens": {"N": repr(tokens - granted)},
+                        "updated_at": {"N": repr(now)},
+                        "version": {"N": str(version + 1)},
+                        "expires_at": {"N": str(int(now) + SHARED_STATE_TTL)}
+                    },
+                    ConditionExpression="attribute_not_exists(limiter_key) OR #version = :version",
+                    ExpressionAttributeNames={"#version": "version"},
+                    ExpressionAttributeValues={":version": {"N": str(version)}}
+                )
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                    continue
+                raise
+            return granted, rate
+        return 0, None
+
+    # Lower the shared rate, unless another invocation already lowered it more
+    def decrease(self, key, rate):
+        from botocore.exceptions import ClientError
+
+        try:
+            self._client().update_item(
+                TableName=self.table,
+                Key={"limiter_key": {"S": key}},
+                UpdateExpression="SET #rate = :rate",
+                ConditionExpression="#rate > :rate",
+                ExpressionAttributeNames={"#rate": "rate"},
+                ExpressionAttributeValues={":rate": {"N": repr(rate)}}
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                raise
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None and RATE_LIMIT_TABLE:
+        _store = DynamoDBBucketStore(RATE_LIMIT_TABLE)
+    return _store
+
+
+# Limiter for api ("service:Operation") in an account and region. account
+# None means the account the function runs in.
+def get_limiter(api, account=None, region=None):
+    key = ":".join([api, account or "self", region or os.environ.get('AWS_REGION', '')])
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                limiter = _limiters[key] = TokenBucket(
+                    key, configured_rates().get(api, 10.0), get_store())
+    return limiter
+
+
+# Change the ceiling of api for this process, e.g. from a command line flag
+def set_rate(api, rate):
+    _rate_overrides[api] = rate
+    for key, limiter in list(_limiters.items()):
+        if key.startswith(api + ":"):
+            limiter.ceiling = rate
+            limiter.rate = min(limiter.rate, rate)
+
+
+# Region a boto3 client was created for
+def client_region(client):
+    meta = getattr(client, "meta", None)
+    return getattr(meta, "region_name", None)
+
+
+def clear():
+    global _store
+    _limiters.clear()
+    _store = None
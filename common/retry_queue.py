@@ -0,0 +1,44 @@
+# Hand events whose tagging failed to an SQS retry queue instead of dropping
+# them. The queue is consumed by this same function (batch_handler in the
+# Config rule, process_records in auto-tag), and each event carries its
+# attempt number so it is given up after RETRY_MAX_ATTEMPTS. Disabled unless
+# RETRY_QUEUE_URL is set.
+#
+# Shared by both Lambdas: this is the only copy, linked into
+# config/required_tags/lambda and auto-tag/lambda (see build.py).
+
+import os
+import json
+import logging
+from metrics import count
+
+RETRY_QUEUE_URL = os.environ.get('RETRY_QUEUE_URL')
+RETRY_MAX_ATTEMPTS = int(os.environ.get('RETRY_MAX_ATTEMPTS', 3))
+RETRY_BASE_DELAY_SECONDS = 30
+# SQS caps DelaySeconds at 15 minutes
+RETRY_MAX_DELAY_SECONDS = 900
+
+
+# Queue event for another attempt. Returns False when it was not queued.
+def send_retry(event):
+    if not RETRY_QUEUE_URL:
+        return False
+
+    attempt = event.get("retryAttempt", 0) + 1
+    if attempt > RETRY_MAX_ATTEMPTS:
+        logging.error("Giving up after " + str(attempt - 1) + " retries")
+        count("RetriesExhausted")
+        return False
+
+    from session_cache import get_client
+    try:
+        get_client('sqs').send_message(
+            QueueUrl=RETRY_QUEUE_URL,
+            MessageBody=json.dumps(dict(event, retryAttempt=attempt)),
+            DelaySeconds=min(RETRY_MAX_DELAY_SECONDS, RETRY_BASE_DELAY_SECONDS * 2 ** (attempt - 1))
+        )
+    except Exception as e:
+        logging.error("Could not queue retry: " + str(e))
+        return False
+    count("RetriesQueued")
+    return True
@@ -0,0 +1,156 @@
+# Cached boto3 session, clients and assumed-role credentials.
+#
+# Shared by both Lambdas: this is the only copy, linked into
+# config/required_tags/lambda and auto-tag/lambda (see build.py).
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from metrics import timer
+
+# Refresh assumed-role credentials this long before their Expiration
+CREDENTIAL_REFRESH_WINDOW = timedelta(minutes=5)
+MAX_CACHED_CREDENTIALS = 64
+MAX_CACHED_CLIENTS = 256
+
+
+# Minimal thread-safe LRU map, lives at module level so it survives warm
+# invocations
+class LRUCache:
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+
+_credentials = LRUCache("credentials", MAX_CACHED_CREDENTIALS)
+_clients = LRUCache("clients", MAX_CACHED_CLIENTS)
+_session = None
+# boto3 sessions are not safe for concurrent client creation
+_session_lock = threading.Lock()
+
+
+# One boto3 session per process, built on first use. boto3 is imported here
+# rather than at module load so that importing the handler stays cheap, and
+# the session's loader only ever reads the models of services we create
+# clients for.
+def get_session():
+    global _session
+    if _session is None:
+        import boto3
+        _session = boto3.session.Session()
+    return _session
+
+
+def _region(region=None):
+    return region or os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION')
+
+
+def _expiring(credentials):
+    expiration = credentials.get('Expiration')
+    if expiration is None:
+        return False
+    if isinstance(expiration, str):
+        expiration = datetime.fromisoformat(expiration.replace("Z", "+00:00"))
+    return expiration - CREDENTIAL_REFRESH_WINDOW <= datetime.now(timezone.utc)
+
+
+# Return STS credentials for role_arn, assuming the role only when nothing
+# usable is cached for (role_arn, region)
+def get_credentials(role_arn, region=None):
+    key = (role_arn, _region(region))
+    credentials = _credentials.get(key)
+    if credentials is not None and _expiring(credentials):
+        logging.info("Cached credentials for " + role_arn + " are expiring, refreshing")
+        _credentials.pop(key)
+        credentials = None
+
+    if credentials is None:
+        sts_client = get_client('sts', region=region)
+        with timer("AssumeRole"):
+            assumed_role_object = sts_client.assume_role(
+                RoleArn=role_arn,
+                RoleSessionName="AsssumeCrossAccount"
+            )
+        credentials = assumed_role_object['Credentials']
+        _credentials.put(key, credentials)
+
+    log_stats()
+    return credentials
+
+
+# Return a client for service, built once per (service, credentials, region).
+# Without credentials the Lambda execution role is used.
+def get_client(service, credentials=None, region=None):
+    access_key = credentials['AccessKeyId'] if credentials else None
+    key = (service, access_key, _region(region))
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _session_lock:
+        client = _clients.get(key)
+        if client is None:
+            if credentials:
+                client = get_session().client(
+                    service,
+                    region_name=_region(region),
+                    aws_access_key_id=credentials['AccessKeyId'],
+                    aws_secret_access_key=credentials['SecretAccessKey'],
+                    aws_session_token=credentials['SessionToken'],
+                )
+            else:
+                client = get_session().client(service, region_name=_region(region))
+            _clients.put(key, client)
+    return client
+
+
+# Account ID of a role ARN
+def role_account(role_arn):
+    return role_arn.split(":")[4]
+
+
+def log_stats():
+    logging.info("Session cache - credentials hits: {} misses: {} | clients hits: {} misses: {} size: {}".format(
+        _credentials.hits, _credentials.misses, _clients.hits, _clients.misses, len(_clients)))
+
+
+def clear():
+    global _session
+    _credentials.clear()
+    _clients.clear()
+    _session = None
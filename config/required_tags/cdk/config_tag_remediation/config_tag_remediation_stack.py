@@ -43,6 +43,8 @@ class ConfigTagRemediationStack(Stack):
             bucket_name='config-tag-remediation'
         )
 
+        # lambda.zip is dist/config.zip from `python build.py config` at the
+        # repository root, built from config/required_tags/lambda
         self.lambda_function = lambda_.Function(
             self, 'config_tag_remediation_lambda',
             function_name='config_tag_remediation',
@@ -54,9 +56,16 @@ class ConfigTagRemediationStack(Stack):
             handler='handler.lambda_handler',
             runtime=lambda_.Runtime.PYTHON_3_9,
             timeout=Duration.seconds(900),
-            role=self.config_remediation_role
+            role=self.config_remediation_role,
+            environment={
+                'LOG_LEVEL': 'INFO',
+                'METRICS_NAMESPACE': 'TagCompliance'
+            }
         )
 
+        # periodic sweeps continue themselves in a new invocation
+        self.lambda_function.grant_invoke(self.config_remediation_role)
+
 
 class ConfigTagRuleStack(Stack):
     def __init__(self, app: App, id: str, lambda_function, admin_role, **kwargs) -> None:
@@ -67,6 +76,8 @@ class ConfigTagRuleStack(Stack):
             config_rule_name='required_tag_remediation',
             description='Custom Config Rule for determining required tag conpliance and automating redemiation.',
             configuration_changes=True,
+            periodic=True,
+            maximum_execution_frequency=config.MaximumExecutionFrequency.TWENTY_FOUR_HOURS,
             lambda_function=lambda_function,
             input_parameters={
                 "Key1": "Value1"
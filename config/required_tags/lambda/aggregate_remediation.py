@@ -0,0 +1,217 @@
+# Organization-wide remediation driven from a Config aggregator.
+#
+# Finds every resource the required tags rule reports as NON_COMPLIANT across
+# all accounts and regions in the aggregator, partitions them by
+# (account, region) and remediates the partitions concurrently. Each
+# partition assumes the remediation role in its account once and batches its
+# tag_resources calls through a RemediationQueue.
+#
+#   python aggregate_remediation.py --aggregator org-aggregator
+#   python aggregate_remediation.py --aggregator org-aggregator --workers 32 --dry-run
+#
+# Run from the aggregator account with permission to query the aggregator
+# and assume the remediation role in the member accounts. With POLICY_SOURCE
+# set, each resource gets the policy of its type and account, as in the rule.
+
+import json
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from metrics import instrumented, timer
+from policy_document import resolve_policy
+from remediation import RemediationQueue
+from session_cache import get_client, get_credentials
+
+DEFAULT_RULE_NAME = "required_tag_remediation"
+DEFAULT_ROLE_NAME = "configRemediationLambdaRole"
+# Concurrent (account, region) partitions
+DEFAULT_WORKERS = 16
+# select_aggregate_resource_config returns at most 100 results per page
+QUERY_PAGE_SIZE = 100
+# resourceIds per IN (...) lookup
+LOOKUP_BATCH_SIZE = 100
+
+# Conditions on configRuleList can match different entries of the list, so
+# the results are narrowed to this rule's own NON_COMPLIANT entry afterwards
+NON_COMPLIANT_QUERY = (
+    "SELECT accountId, awsRegion, configuration.targetResourceId, configuration.targetResourceType, "
+    "configuration.configRuleList "
+    "WHERE resourceType = 'AWS::Config::ResourceCompliance' "
+    "AND configuration.configRuleList.complianceType = 'NON_COMPLIANT' "
+    "AND configuration.configRuleList.configRuleName = '{rule}'"
+)
+
+RESOURCE_QUERY = (
+    "SELECT resourceId, resourceType, arn, tags "
+    "WHERE accountId = '{account}' AND awsRegion = '{region}' "
+    "AND resourceType = '{resource_type}' AND resourceId IN ({ids})"
+)
+
+
+def _quote(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+# Yield every result of an aggregator query, one page at a time
+def select_all(config, aggregator, expression):
+    kwargs = {
+        "Expression": expression,
+        "ConfigurationAggregatorName": aggregator,
+        "Limit": QUERY_PAGE_SIZE
+    }
+    while True:
+        with timer("SelectAggregateResourceConfig"):
+            response = config.select_aggregate_resource_config(**kwargs)
+        for result in response.get("Results", []):
+            yield json.loads(result)
+        if not response.get("NextToken"):
+            return
+        kwargs["NextToken"] = response["NextToken"]
+
+
+# Rule parameters as deployed in the aggregator account
+def get_rule_parameters(config, rule_name):
+    rules = config.describe_config_rules(ConfigRuleNames=[rule_name])["ConfigRules"]
+    return json.loads(rules[0].get("InputParameters", "{}"))
+
+
+# True when the rule itself, not just another rule, finds the resource non-compliant
+def rule_non_compliant(target, rule_name):
+    return any(rule.get("configRuleName") == rule_name and rule.get("complianceType") == "NON_COMPLIANT"
+               for rule in target.get("configRuleList", []))
+
+
+# {(account, region): {resource type: [resource ids]}}
+def find_non_compliant(config, aggregator, rule_name):
+    partitions = {}
+    for result in select_all(config, aggregator, NON_COMPLIANT_QUERY.format(rule=rule_name.replace("'", "''"))):
+        target = result.get("configuration", {})
+        if not rule_non_compliant(target, rule_name):
+            continue
+        key = (result["accountId"], result["awsRegion"])
+        partitions.setdefault(key, {}).setdefault(
+            target["targetResourceType"], []).append(target["targetResourceId"])
+    return partitions
+
+
+# The configuration item subset resolve_policy needs, with ARN and recorded
+# tags, of each resource, looked up in batches. Tags are Config's recorded
+# state, the same state the rule evaluated.
+def lookup_resources(config, aggregator, account, region, resources_by_type):
+    for resource_type, resource_ids in resources_by_type.items():
+        for i in range(0, len(resource_ids), LOOKUP_BATCH_SIZE):
+            expression = RESOURCE_QUERY.format(
+                account=account,
+                region=region,
+                resource_type=resource_type,
+                ids=", ".join(_quote(r) for r in resource_ids[i:i + LOOKUP_BATCH_SIZE]))
+            for result in select_all(config, aggregator, expression):
+                yield {
+                    "resourceType": result["resourceType"],
+                    "resourceId": result["resourceId"],
+                    "ARN": result["arn"],
+                    "awsAccountId": account,
+                    "awsRegion": region,
+                    "tags": {t["key"]: t["value"] for t in result.get("tags", [])}
+                }
+
+
+def role_arn(account, role_name, partition="aws"):
+    return "arn:" + partition + ":iam::" + account + ":role/" + role_name
+
+
+# Partition of the aggregator account (aws, aws-cn, aws-us-gov, ...); the
+# member accounts are in the same one
+def current_partition():
+    return get_client("sts").get_caller_identity()["Arn"].split(":")[1]
+
+
+# Remediate one (account, region). Returns a summary dict.
+def remediate_partition(config, aggregator, account, region, resources_by_type, rule_parameters, role_name,
+                        dry_run=False, partition="aws"):
+    summary = {"account": account, "region": region, "resources": 0,
+               "tagged": 0, "failed": 0, "error": None}
+    try:
+        queue = None
+        if not dry_run:
+            credentials = get_credentials(role_arn(account, role_name, partition))
+            queue = RemediationQueue(credentials, region, account)
+
+        for configuration_item in lookup_resources(config, aggregator, account, region, resources_by_type):
+            summary["resources"] += 1
+            arn = configuration_item["ARN"]
+            policy = resolve_policy(rule_parameters, configuration_item)
+            incorrect_value, tag_not_present, _ = policy.check(configuration_item["tags"])
+            tag_list = policy.remediation_tags(incorrect_value + tag_not_present)
+            if not tag_list:
+                continue
+            if dry_run:
+                logging.info("Would tag " + arn + " with " + str(tag_list))
+                continue
+            queue.add(arn, tag_list)
+
+        if queue is not None:
+            summary["failed"] = len(queue.flush())
+            summary["tagged"] = queue.tagged
+    except Exception as e:
+        # one unreachable account must not stop the rest of the run
+        logging.error("Remediation failed in " + account + "/" + region + ": " + str(e))
+        summary["error"] = str(e)
+    return summary
+
+
+def run(aggregator, rule_name=DEFAULT_RULE_NAME, role_name=DEFAULT_ROLE_NAME,
+        workers=DEFAULT_WORKERS, rule_parameters=None, dry_run=False):
+    config = get_client("config")
+    if rule_parameters is None:
+        rule_parameters = get_rule_parameters(config, rule_name)
+
+    partitions = find_non_compliant(config, aggregator, rule_name)
+    logging.info("Found non-compliant resources in " + str(len(partitions)) + " account/region partitions")
+    if not partitions:
+        return []
+
+    partition = current_partition()
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(partitions)))) as pool:
+        futures = [pool.submit(remediate_partition, config, aggregator, account, region,
+                               resources_by_type, rule_parameters, role_name, dry_run, partition)
+                   for (account, region), resources_by_type in sorted(partitions.items())]
+        summaries = [future.result() for future in futures]
+
+    logging.info("Aggregate remediation: " + str(sum(s["tagged"] for s in summaries)) + " tagged, " +
+                 str(sum(s["failed"] for s in summaries)) + " failed, " +
+                 str(sum(1 for s in summaries if s["error"])) + " partitions with errors")
+    return summaries
+
+
+# Lambda entry point, e.g. on a schedule in the aggregator account
+@instrumented
+def aggregate_handler(event, context):
+    return run(
+        event["aggregator"],
+        rule_name=event.get("ruleName", DEFAULT_RULE_NAME),
+        role_name=event.get("roleName", DEFAULT_ROLE_NAME),
+        workers=int(event.get("workers", DEFAULT_WORKERS)),
+        rule_parameters=event.get("ruleParameters"),
+        dry_run=bool(event.get("dryRun", False)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Remediate required tags across a Config aggregator")
+    parser.add_argument("--aggregator", required=True)
+    parser.add_argument("--rule", default=DEFAULT_RULE_NAME)
+    parser.add_argument("--role-name", default=DEFAULT_ROLE_NAME)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--parameters", help="rule parameters JSON, instead of reading them from the rule")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO)
+    summaries = run(args.aggregator, args.rule, args.role_name, args.workers,
+                    json.loads(args.parameters) if args.parameters else None, args.dry_run)
+    for summary in summaries:
+        print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
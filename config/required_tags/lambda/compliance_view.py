@@ -0,0 +1,304 @@
+# Materialized view of the latest evaluation of each resource, with the tags
+# it is missing or has wrong values for, so dashboards can ask "what is
+# non-compliant, by tag key / account / resource type" without paging
+# through get_compliance_details_by_config_rule.
+#
+# Rows are upserted incrementally as evaluations happen. An older
+# configuration item never overwrites a newer one, and a row whose state did
+# not change is not written again.
+#
+# COMPLIANCE_VIEW_TABLE  DynamoDB table (partition key "pk", sort key "sk")
+# COMPLIANCE_VIEW_PATH   SQLite file, for local runs and tests
+#
+#   python compliance_view.py counts --by tag
+#   python compliance_view.py resources --by account --value 123456789012
+
+import os
+import json
+import sqlite3
+import logging
+import argparse
+from datetime import timezone
+from metrics import count, timer
+
+# Dimensions a non-compliant resource is counted and listed under
+DIMENSIONS = ("tag", "account", "resource_type")
+BATCH_WRITE_SIZE = 25
+BATCH_WRITE_RETRIES = 3
+
+
+# (account, region) of a configuration item, from its ARN when the item does
+# not carry them
+def resource_location(configuration_item):
+    arn = (configuration_item.get("ARN") or "").split(":")
+    account = configuration_item.get("awsAccountId") or (arn[4] if len(arn) > 5 else "")
+    region = configuration_item.get("awsRegion") or (arn[3] if len(arn) > 5 else "")
+    return account, region
+
+
+# account/region/resource type/resource ID: resource IDs are only unique
+# within one account and region
+def resource_key(configuration_item, account=None):
+    default_account, region = resource_location(configuration_item)
+    return "/".join((account or default_account, region,
+                     configuration_item["resourceType"], configuration_item["resourceId"]))
+
+
+# Capture time as a string in Config's format (2022-07-26T19:43:33.411Z), so
+# rows compare in time order. get_resource_config_history returns datetimes
+# for oversized items.
+def capture_time(configuration_item):
+    value = configuration_item.get("configurationItemCaptureTime", "")
+    if hasattr(value, "strftime"):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return value.strftime("%Y-%m-%dT%H:%M:%S.") + "%03dZ" % (value.microsecond // 1000)
+    return value
+
+
+# The view row for one evaluated configuration item
+def view_row(configuration_item, evaluation, account=None):
+    violation = evaluation.get("violation", {})
+    account = account or resource_location(configuration_item)[0]
+    return {
+        "resource_key": resource_key(configuration_item, account),
+        "account": account,
+        "resource_type": configuration_item["resourceType"],
+        "resource_id": configuration_item["resourceId"],
+        "compliance_type": evaluation["compliance_type"],
+        "missing": sorted(violation.get("tag_not_present", [])),
+        "incorrect": sorted(violation.get("incorrect_value", [])),
+        "updated_at": capture_time(configuration_item)
+    }
+
+
+# (dimension, value) pairs the row is counted under
+def memberships(row):
+    if row is None or row["compliance_type"] != "NON_COMPLIANT":
+        return set()
+    found = {("account", row["account"]), ("resource_type", row["resource_type"])}
+    for tag_key in row["missing"] + row["incorrect"]:
+        found.add(("tag", tag_key))
+    return found
+
+
+def same_state(old, row):
+    return old is not None and all(
+        old[field] == row[field] for field in ("compliance_type", "missing", "incorrect", "account"))
+
+
+class SQLiteComplianceView:
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        # one commit per upsert; WAL keeps that from being an fsync each
+        self.db.executescript(
+            "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;"
+            "CREATE TABLE IF NOT EXISTS compliance_view ("
+            "resource_key TEXT PRIMARY KEY, account TEXT, resource_type TEXT, resource_id TEXT, "
+            "compliance_type TEXT, missing TEXT, incorrect TEXT, updated_at TEXT);"
+            "CREATE INDEX IF NOT EXISTS by_account ON compliance_view (compliance_type, account);"
+            "CREATE INDEX IF NOT EXISTS by_resource_type ON compliance_view (compliance_type, resource_type);"
+            "CREATE TABLE IF NOT EXISTS violation_tag ("
+            "tag_key TEXT, resource_key TEXT, PRIMARY KEY (tag_key, resource_key));"
+            "CREATE INDEX IF NOT EXISTS by_resource ON violation_tag (resource_key);")
+        self.db.commit()
+
+    def _row(self, values):
+        if values is None:
+            return None
+        row = dict(zip(("resource_key", "account", "resource_type", "resource_id", "compliance_type",
+                        "missing", "incorrect", "updated_at"), values))
+        row["missing"] = json.loads(row["missing"])
+        row["incorrect"] = json.loads(row["incorrect"])
+        return row
+
+    def get(self, key):
+        return self._row(self.db.execute(
+            "SELECT * FROM compliance_view WHERE resource_key = ?", (key,)).fetchone())
+
+    # Returns False when the row was older than or the same as the stored one
+    def upsert(self, row):
+        old = self.get(row["resource_key"])
+        if old is not None and (old["updated_at"] > row["updated_at"] or same_state(old, row)):
+            return False
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO compliance_view VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (row["resource_key"], row["account"], row["resource_type"], row["resource_id"],
+                 row["compliance_type"], json.dumps(row["missing"]), json.dumps(row["incorrect"]),
+                 row["updated_at"]))
+            self.db.execute("DELETE FROM violation_tag WHERE resource_key = ?", (row["resource_key"],))
+            self.db.executemany(
+                "INSERT INTO violation_tag VALUES (?, ?)",
+                [(value, row["resource_key"]) for dimension, value in memberships(row) if dimension == "tag"])
+        return True
+
+    # {value: number of non-compliant resources} for a dimension
+    def counts(self, dimension):
+        if dimension == "tag":
+            query = "SELECT tag_key, COUNT(*) FROM violation_tag GROUP BY tag_key"
+        else:
+            query = ("SELECT " + self._column(dimension) + ", COUNT(*) FROM compliance_view "
+                     "WHERE compliance_type = 'NON_COMPLIANT' GROUP BY " + self._column(dimension))
+        return dict(self.db.execute(query).fetchall())
+
+    # Non-compliant rows under one dimension value
+    def resources(self, dimension, value):
+        if dimension == "tag":
+            rows = self.db.execute(
+                "SELECT v.* FROM violation_tag t JOIN compliance_view v USING (resource_key) "
+                "WHERE t.tag_key = ?", (value,))
+        else:
+            rows = self.db.execute(
+                "SELECT * FROM compliance_view WHERE compliance_type = 'NON_COMPLIANT' AND " +
+                self._column(dimension) + " = ?", (value,))
+        return [self._row(values) for values in rows]
+
+    def _column(self, dimension):
+        if dimension not in DIMENSIONS:
+            raise ValueError("Unknown dimension " + str(dimension))
+        return dimension
+
+
+# Single-table layout, every query a key lookup (<key> is resource_key):
+#   pk "resource#<key>"             sk "state"       the row
+#   pk "count#<dimension>"          sk <value>       n, non-compliant resources
+#   pk "member#<dimension>#<value>" sk <key>         the row, per membership
+# Counters are adjusted with ADD for the memberships a row gains or loses.
+class DynamoDBComplianceView:
+    def __init__(self, table):
+        from session_cache import get_client
+
+        self.table = table
+        self.client = get_client("dynamodb")
+
+    def _item(self, pk, sk, row):
+        return {
+            "pk": {"S": pk},
+            "sk": {"S": sk},
+            "row": {"S": json.dumps(row, sort_keys=True)},
+            "updated_at": {"S": row["updated_at"]}
+        }
+
+    def get(self, key):
+        item = self.client.get_item(
+            TableName=self.table,
+            Key={"pk": {"S": "resource#" + key}, "sk": {"S": "state"}},
+            ConsistentRead=True
+        ).get("Item")
+        return json.loads(item["row"]["S"]) if item else None
+
+    def upsert(self, row):
+        from botocore.exceptions import ClientError
+
+        old = self.get(row["resource_key"])
+        if old is not None and (old["updated_at"] > row["updated_at"] or same_state(old, row)):
+            return False
+        try:
+            self.client.put_item(
+                TableName=self.table,
+                Item=self._item("resource#" + row["resource_key"], "state", row),
+                ConditionExpression="attribute_not_exists(pk) OR updated_at <= :updated_at",
+                ExpressionAttributeValues={":updated_at": {"S": row["updated_at"]}}
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+        before, after = memberships(old), memberships(row)
+        writes = [{"PutRequest": {"Item": self._item("member#" + d + "#" + v, row["resource_key"], row)}}
+                  for d, v in sorted(after)]
+        writes += [{"DeleteRequest": {"Key": {"pk": {"S": "member#" + d + "#" + v},
+                                              "sk": {"S": row["resource_key"]}}}}
+                   for d, v in sorted(before - after)]
+        self._batch_write(writes)
+        for delta, changed in ((1, after - before), (-1, before - after)):
+            for dimension, value in sorted(changed):
+                self.client.update_item(
+                    TableName=self.table,
+                    Key={"pk": {"S": "count#" + dimension}, "sk": {"S": value}},
+                    UpdateExpression="ADD n :delta",
+                    ExpressionAttributeValues={":delta": {"N": str(delta)}}
+                )
+        return True
+
+    def _batch_write(self, writes):
+        for i in range(0, len(writes), BATCH_WRITE_SIZE):
+            pending = writes[i:i + BATCH_WRITE_SIZE]
+            for _ in range(BATCH_WRITE_RETRIES + 1):
+                response = self.client.batch_write_item(RequestItems={self.table: pending})
+                pending = response.get("UnprocessedItems", {}).get(self.table, [])
+                if not pending:
+                    break
+            if pending:
+                logging.error("Compliance view writes not applied: " + str(len(pending)))
+
+    def _query(self, pk):
+        paginator = self.client.get_paginator("query")
+        for page in paginator.paginate(
+                TableName=self.table,
+                KeyConditionExpression="pk = :pk",
+                ExpressionAttributeValues={":pk": {"S": pk}}):
+            for item in page.get("Items", []):
+                yield item
+
+    def counts(self, dimension):
+        return {item["sk"]["S"]: int(item["n"]["N"]) for item in self._query("count#" + dimension)
+                if int(item["n"]["N"]) > 0}
+
+    def resources(self, dimension, value):
+        return [json.loads(item["row"]["S"]) for item in self._query("member#" + dimension + "#" + value)]
+
+
+_view = None
+
+
+# Configured view, or None when it is disabled
+def get_compliance_view():
+    global _view
+    if _view is None:
+        if os.environ.get("COMPLIANCE_VIEW_TABLE"):
+            _view = DynamoDBComplianceView(os.environ["COMPLIANCE_VIEW_TABLE"])
+        elif os.environ.get("COMPLIANCE_VIEW_PATH"):
+            _view = SQLiteComplianceView(os.environ["COMPLIANCE_VIEW_PATH"])
+    return _view
+
+
+# Upsert one evaluation. Failures are logged, never raised: the view must
+# not hold up reporting to Config.
+def record_evaluation(view, configuration_item, evaluation, account=None):
+    try:
+        with timer("ComplianceViewUpsert"):
+            if view.upsert(view_row(configuration_item, evaluation, account)):
+                count("ComplianceViewUpdates")
+    except Exception as e:
+        logging.error("Could not update compliance view: " + str(e))
+
+
+# Query entry point for dashboards:
+#   {"by": "tag"}                             counts per tag key
+#   {"by": "account", "value": "1234..."}     non-compliant resources
+def query_handler(event, context):
+    view = get_compliance_view()
+    if view is None:
+        raise ValueError("COMPLIANCE_VIEW_TABLE or COMPLIANCE_VIEW_PATH must be set")
+    if event.get("value") is None:
+        return view.counts(event["by"])
+    return view.resources(event["by"], event["value"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the compliance view")
+    parser.add_argument("query", choices=("counts", "resources"))
+    parser.add_argument("--by", choices=DIMENSIONS, default="tag")
+    parser.add_argument("--value", help="dimension value, for resources")
+    args = parser.parse_args()
+    if args.query == "resources" and args.value is None:
+        parser.error("resources needs --value")
+
+    print(json.dumps(query_handler({"by": args.by, "value": args.value}, None), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 # Ensure that resources have required tags, and that tags have valid values.
 #
-# Trigger Type: Change Triggered
+# Trigger Type: Change Triggered, Periodic (see sweep.py), tagging API calls
+# (see tag_events.py)
 # Scope of Changes: EC2:Instance, EC2::Volume
 # Accepted Parameters: requiredTagKey1, requiredTagValues1, requiredTagKey2, ...
 # Example Values: 'CostCenter', 'R&D,Ops', 'Environment', 'Stage,Dev,Prod', ...
@@ -8,10 +9,16 @@
 
 import json
 import os
-import boto3
 import logging
-from botocore.exceptions import ClientError
-from remediation import add_default_tag
+from compliance_view import get_compliance_view, record_evaluation
+from metrics import count, instrumented, log_payload, timer
+from policy import get_policy, parse_rule_parameters
+from policy_document import resolve_policy
+from ratelimit import THROTTLE_ERRORS, backoff, client_region, get_limiter
+from remediation import RemediationQueue, add_default_tag
+from retry_queue import send_retry
+from session_cache import get_client, get_credentials, role_account
+from state_cache import get_state_store, is_unchanged, remember
 
 logging.getLogger().setLevel(os.environ['LOG_LEVEL'])
 
@@ -21,47 +28,30 @@ logging.getLogger().setLevel(os.environ['LOG_LEVEL'])
 APPLICABLE_RESOURCES = ["AWS::EC2::Instance", "AWS::EC2::Volume", "AWS::S3::Bucket", "AWS::DynamoDB::Table", "AWS::DynamoDB::GlobalTable", "AWS::RDS::DBCluster",
                         "AWS::RDS::DBInstance", "AWS::EFS::FileSystem", "AWS::FSx::FileSystem", "AWS::DocDB::DBCluster", "AWS::DocDB::DBInstance", "AWS::Neptune::DBCluster", "AWS::Neptune::DBInstance"]
 
+# PutEvaluations accepts at most 100 evaluations per call
+MAX_EVALUATIONS_PER_CALL = 100
+PUT_EVALUATIONS_RETRIES = 3
 
-# Iterate through required tags ensureing each required tag is present,
-# and value is one of the given valid values
-def find_violation(current_tags, required_tags, configuration_item, credentials):
+
+# Check each required tag is present and its value is one of the given valid
+# values. required_tags is the rule parameters dict or a compiled TagPolicy.
+def find_violation(current_tags, required_tags, configuration_item, credentials, queue=None):
+    policy = get_policy(required_tags)
+    current_tags = current_tags or {}
     logging.info("Resource Id: " + configuration_item['resourceId'])
-    logging.info("Required Tags: " + str(required_tags))
-    logging.info("Current Tags: " + str(current_tags))
-
-    incorrect_value = []
-    case_mismatch = []
-    tag_not_present = []
-
-    for rtag, rvalues in required_tags.items():
-        if rtag not in ['exec_role', 'Name']:
-            tag_present = False
-            value_match = False
-            for key, value in current_tags.items():
-                if key == rtag:
-                    tag_present = True
-                    rvaluesplit = rvalues.split(",")
-                    for rvalue in rvaluesplit:
-                        if value == rvalue:
-                            value_match = True
-                    if not value_match:
-                        incorrect_value += rtag
-                    break
-                elif key.lower() == rtag.lower():
-                    case_mismatch += rtag
-                    break
-
-            if tag_present and value_match:
-                logging.info("No violation found for tag: " + rtag)
-                current_tags.pop(rtag)
-            else:
-                tag_not_present += [rtag]
-                logging.warn("Incorrect tag or value mismatch for " + rtag)
+    logging.debug("Required Tags: " + str(policy.allowed))
+    logging.debug("Current Tags: " + str(current_tags))
+
+    incorrect_value, tag_not_present, case_mismatch = policy.check(current_tags)
 
+    if case_mismatch:
+        logging.warning("Tag key case mismatch for " + str(case_mismatch))
     if incorrect_value or tag_not_present:
-        logging.warn("Remediating tags.")
-        add_default_tag(required_tags, incorrect_value,
-                        tag_not_present, configuration_item, credentials)
+        logging.warning("Incorrect tag or value mismatch for " +
+                        str(incorrect_value + tag_not_present))
+        logging.warning("Remediating tags.")
+        add_default_tag(policy, incorrect_value,
+                        tag_not_present, configuration_item, credentials, queue)
 
     return {
         "incorrect_value": incorrect_value,
@@ -69,7 +59,7 @@ def find_violation(current_tags, required_tags, configuration_item, credentials)
     }
 
 
-def evaluate_compliance(configuration_item, rule_parameters, credentials):
+def evaluate_compliance(configuration_item, rule_parameters, credentials, queue=None):
     if configuration_item["resourceType"] not in APPLICABLE_RESOURCES:
         return {
             "compliance_type": "NOT_APPLICABLE",
@@ -84,15 +74,19 @@ def evaluate_compliance(configuration_item, rule_parameters, credentials):
         }
 
     current_tags = configuration_item.get('tags')
-    violation = find_violation(
-        current_tags, rule_parameters, configuration_item, credentials)
+    with timer("Evaluation"):
+        violation = find_violation(
+            current_tags, resolve_policy(rule_parameters, configuration_item),
+            configuration_item, credentials, queue)
 
     if violation['incorrect_value'] or violation['tag_not_present']:
+        count("NonCompliant")
         return {
             "compliance_type": "NON_COMPLIANT",
             "annotation": "Required tags are not present or contain incorrect values. \n Missing tags: {} \n Incorrect Values: {}".format(str(violation['tag_not_present']), str(violation['incorrect_value'])),
             "incorrect_value": str(violation['incorrect_value']),
             "tag_not_present": str(violation['tag_not_present']),
+            "violation": violation
         }
     else:
         return {
@@ -101,58 +95,251 @@ def evaluate_compliance(configuration_item, rule_parameters, credentials):
         }
 
 
+# Build the PutEvaluations entry for one evaluated configuration item
+def build_evaluation(configuration_item, evaluation):
+    annotation = (evaluation["annotation"][:250] + '..') if len(
+        evaluation["annotation"]) > 250 else evaluation["annotation"]
+
+    return {
+        "ComplianceResourceType":
+            configuration_item["resourceType"],
+        "ComplianceResourceId":
+            configuration_item["resourceId"],
+        "ComplianceType":
+            evaluation["compliance_type"],
+        "Annotation":
+            annotation,
+        "OrderingTimestamp":
+            configuration_item["configurationItemCaptureTime"]
+    }
+
+
+# Send evaluations in chunks of MAX_EVALUATIONS_PER_CALL, retrying only the
+# FailedEvaluations of each chunk with exponential backoff. Calls go through
+# the account's adaptive PutEvaluations rate limit.
+def put_evaluations(config, evaluations, result_token, account=None):
+    # botocore is already loaded by the time a client exists
+    from botocore.exceptions import ClientError
+
+    limiter = get_limiter("config:PutEvaluations", account, client_region(config))
+    failed = []
+    for i in range(0, len(evaluations), MAX_EVALUATIONS_PER_CALL):
+        pending = evaluations[i:i + MAX_EVALUATIONS_PER_CALL]
+        for attempt in range(PUT_EVALUATIONS_RETRIES + 1):
+            if attempt:
+                count("PutEvaluationsRetries")
+                backoff(attempt - 1)
+            limiter.acquire()
+            try:
+                with timer("PutEvaluations"):
+                    response = config.put_evaluations(
+                        Evaluations=pending,
+                        ResultToken=result_token
+                    )
+                logging.debug(response)
+                pending = response.get('FailedEvaluations', [])
+            except ClientError as e:
+                logging.warning("put_evaluations failed: " + str(e))
+                if e.response.get('Error', {}).get('Code') in THROTTLE_ERRORS:
+                    limiter.throttled()
+            if not pending:
+                break
+        if pending:
+            logging.error("Evaluations not delivered: " + str(len(pending)))
+            failed += pending
+    return failed
+
+
+# Remember the evaluations that reached Config. An undelivered one must not
+# be cached, or every redelivery of the item would be skipped as unchanged.
+def remember_delivered(store, evaluated, failed):
+    undelivered = {(e["ComplianceResourceType"], e["ComplianceResourceId"]) for e in failed}
+    for configuration_item, rule_parameters, evaluation in evaluated:
+        if (configuration_item["resourceType"], configuration_item["resourceId"]) not in undelivered:
+            remember(store, configuration_item, rule_parameters, evaluation)
+
+
+# Oversized notifications only carry a summary, so fetch the latest item
+def get_configuration_item(invoking_event, config):
+    if invoking_event.get("messageType") != "OversizedConfigurationItemChangeNotification":
+        return invoking_event["configurationItem"]
+
+    summary = invoking_event["configurationItemSummary"]
+    with timer("GetResourceConfigHistory"):
+        response = config.get_resource_config_history(
+            resourceType=summary["resourceType"],
+            resourceId=summary["resourceId"],
+            limit=1
+        )
+    configuration_item = response["configurationItems"][0]
+    configuration_item["ARN"] = configuration_item.get("arn")
+    return configuration_item
+
+
+@instrumented
 def lambda_handler(event, context):
-    logging.debug(event)
+    log_payload("Event", event)
+    if event.get("detail-type") == "AWS API Call via CloudTrail":
+        from tag_events import tag_event_handler
+        return tag_event_handler(event, context)
+    # events handed back through the retry queue
+    if "Records" in event:
+        return batch_handler(event, context)
     invoking_event = json.loads(event["invokingEvent"])
-    configuration_item = invoking_event["configurationItem"]
-    rule_parameters = json.loads(event["ruleParameters"])
+    if invoking_event.get("messageType") == "ScheduledNotification":
+        from sweep import sweep_handler
+        return sweep_handler(event, context)
+    rule_parameters = parse_rule_parameters(event["ruleParameters"])
 
     result_token = "No token found."
     if "resultToken" in event:
         result_token = event["resultToken"]
 
-    sts_client = boto3.client('sts')
+    # nothing changed since the last evaluation: skip the role, remediation
+    # and put_evaluations round trips entirely
+    store = get_state_store()
+    if store and "configurationItem" in invoking_event and is_unchanged(
+            store, invoking_event["configurationItem"], rule_parameters):
+        count("StateCacheSkips")
+        return
 
-    assumed_role_object = sts_client.assume_role(
-        RoleArn=rule_parameters['exec_role'],
-        RoleSessionName="AsssumeCrossAccount"
-    )
-
-    credentials = assumed_role_object['Credentials']
+    account = role_account(rule_parameters['exec_role'])
+    credentials = get_credentials(rule_parameters['exec_role'])
+    config = get_client("config", credentials)
+    configuration_item = get_configuration_item(invoking_event, config)
 
+    queue = RemediationQueue(credentials, account=account)
     evaluation = evaluate_compliance(
-        configuration_item, rule_parameters, credentials)
+        configuration_item, rule_parameters, credentials, queue)
     logging.info(evaluation["compliance_type"] +
                  ": " + evaluation["annotation"])
-
-    config = boto3.client(
-        "config",
-        aws_access_key_id=credentials['AccessKeyId'],
-        aws_secret_access_key=credentials['SecretAccessKey'],
-        aws_session_token=credentials['SessionToken'],
-    )
-
-    evaluation["annotation"] = (evaluation["annotation"][:250] + '..') if len(
-        evaluation["annotation"]) > 250 else evaluation["annotation"]
-
-    response = config.put_evaluations(
-        Evaluations=[
-            {
-                "ComplianceResourceType":
-                    configuration_item["resourceType"],
-                "ComplianceResourceId":
-                    configuration_item["resourceId"],
-                "ComplianceType":
-                    evaluation["compliance_type"],
-                "Annotation":
-                    evaluation["annotation"],
-                "OrderingTimestamp":
-                    configuration_item["configurationItemCaptureTime"]
-            },
-        ],
-        ResultToken=result_token
-    )
-    logging.debug(response)
+    unremediated = queue.flush()
+    if unremediated:
+        send_retry(event)
+
+    failed = put_evaluations(
+        config, [build_evaluation(configuration_item, evaluation)], result_token, account)
+    # an item whose remediation failed has to be evaluated again on retry
+    if store and not unremediated:
+        remember_delivered(store, [(configuration_item, rule_parameters, evaluation)], failed)
+    view = get_compliance_view()
+    if view:
+        record_evaluation(view, configuration_item, evaluation, account)
+
+
+# Batch entry point. Accepts either
+#   {"ruleParameters": ..., "resultToken": ..., "configurationItems": [...]}
+# or an SQS event whose message bodies are Config rule events. Evaluations
+# are reported with one put_evaluations call per 100 evaluations that share
+# a result token, so only the single-token form (sweep, snapshot or
+# synthetic configurationItems batches) saves put_evaluations calls. Every
+# Config rule invocation carries its own result token: an SQS batch of them
+# still makes one put_evaluations call per message, and shares only the
+# exec role's credentials and the remediation queue. Remediation is queued
+# and sent as multi-ARN tag_resources calls before reporting, and the events
+# behind any ARN that could not be tagged go to the retry queue.
+# SQS messages with an ARN that could not be tagged or an evaluation that
+# was not delivered are instead returned as batchItemFailures, so SQS
+# redelivers them and moves them to the dead-letter queue after
+# maxReceiveCount (the event source mapping needs ReportBatchItemFailures).
+@instrumented
+def batch_handler(event, context):
+    if "Records" in event:
+        events = [json.loads(record["body"]) for record in event["Records"]]
+        message_ids = [record["messageId"] for record in event["Records"]]
+    else:
+        events = [event]
+        message_ids = None
+
+    # evaluations must be reported against the result token they came with,
+    # which is one batch per message for Config rule events
+    batches = {}
+    queues = {}
+    # ARN -> (index into events, configuration item), for retries
+    sources = {}
+    # (resource type, resource id) -> index into events, for undelivered evaluations
+    origins = {}
+    store = get_state_store()
+    view = get_compliance_view()
+    for index, item_event in enumerate(events):
+        rule_parameters = item_event["ruleParameters"]
+        if isinstance(rule_parameters, str):
+            rule_parameters = parse_rule_parameters(rule_parameters)
+        result_token = item_event.get("resultToken", "No token found.")
+
+        credentials = get_credentials(rule_parameters['exec_role'])
+        config = get_client("config", credentials)
+
+        if "configurationItems" in item_event:
+            configuration_items = item_event["configurationItems"]
+        else:
+            configuration_items = [get_configuration_item(
+                json.loads(item_event["invokingEvent"]), config)]
+
+        queue = queues.get(rule_parameters['exec_role'])
+        if queue is None:
+            queue = queues[rule_parameters['exec_role']] = RemediationQueue(
+                credentials, account=role_account(rule_parameters['exec_role']))
+
+        key = (rule_parameters['exec_role'], result_token)
+        # (config client, evaluations, (item, parameters, evaluation) to remember)
+        batch = batches.setdefault(key, (config, [], []))
+        policy = get_policy(rule_parameters)
+        for configuration_item in configuration_items:
+            if store and is_unchanged(store, configuration_item, rule_parameters):
+                count("StateCacheSkips")
+                continue
+            evaluation = evaluate_compliance(
+                configuration_item, policy, credentials, queue)
+            batch[1].append(build_evaluation(configuration_item, evaluation))
+            if configuration_item.get("ARN"):
+                sources[configuration_item["ARN"]] = (index, configuration_item)
+            origins[(configuration_item["resourceType"], configuration_item["resourceId"])] = index
+            batch[2].append((configuration_item, rule_parameters, evaluation))
+            if view:
+                record_evaluation(view, configuration_item, evaluation,
+                                  role_account(rule_parameters['exec_role']))
+
+    unremediated = set()
+    # index into events -> configuration items that failed to tag
+    retries = {}
+    for queue in queues.values():
+        failures = queue.flush()
+        unremediated.update(failures)
+        for arn in failures:
+            if arn in sources:
+                index, configuration_item = sources[arn]
+                retries.setdefault(index, []).append(configuration_item)
+    if message_ids is None:
+        for index, configuration_items in retries.items():
+            if "configurationItems" in events[index]:
+                send_retry(dict(events[index], configurationItems=configuration_items))
+            else:
+                send_retry(events[index])
+
+    failed = 0
+    # indexes into events that SQS has to deliver again
+    redeliver = set(retries)
+    for (exec_role, result_token), (config, evaluations, evaluated) in batches.items():
+        logging.info("Reporting " + str(len(evaluations)) + " evaluations")
+        undelivered = put_evaluations(config, evaluations, result_token, role_account(exec_role))
+        failed += len(undelivered)
+        for e in undelivered:
+            redeliver.add(origins.get((e["ComplianceResourceType"], e["ComplianceResourceId"])))
+        if store:
+            # an item whose remediation failed has to be evaluated again on retry
+            remember_delivered(store, [e for e in evaluated if e[0].get("ARN") not in unremediated],
+                               undelivered)
+
+    result = {
+        "evaluated": sum(len(b[1]) for b in batches.values()),
+        "failed": failed,
+        "remediation_failed": len(unremediated)
+    }
+    if message_ids is not None:
+        result["batchItemFailures"] = [
+            {"itemIdentifier": message_ids[i]} for i in sorted(i for i in redeliver if i is not None)]
+    return result
 
 
 def main():
@@ -0,0 +1,168 @@
+# Plan/apply split for remediation.
+#
+# plan   evaluates recorded Config rule events (one JSON event per line, as the
+#        Lambda receives them) and writes a remediation plan: one
+#        {"tags", "arns", "region", "role"} batch per line, ARNs grouped by
+#        identical tag mutation, and only the newest event per resource kept.
+#        snapshot.py writes plans in the same format.
+# apply  sends a reviewed plan with batched tag_resources calls, at most
+#        --rate calls/s and slower while throttled (see ratelimit.py).
+#        Finished batches are appended to a checkpoint file, so an
+#        interrupted or time-boxed run resumes where it stopped.
+#
+#   python plan.py plan events.jsonl -o plan.jsonl
+#   python plan.py apply plan.jsonl --rate 5 --max-seconds 3600
+#
+# Set REMEDIATION_MODE=report on the Lambda to evaluate without tagging and
+# leave remediation to reviewed plans.
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+# handler sets the log level from the Lambda environment at import
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+
+from handler import evaluate_compliance  # noqa: E402
+from policy import get_policy  # noqa: E402
+from ratelimit import set_rate  # noqa: E402
+from remediation import RemediationPlan, RemediationQueue  # noqa: E402
+from session_cache import get_credentials, role_account  # noqa: E402
+
+# tag_resources calls per second during apply
+DEFAULT_APPLY_RATE = 5.0
+
+
+def read_events(path):
+    with (sys.stdin if path == "-" else open(path)) as events:
+        for line in events:
+            if line.strip():
+                yield json.loads(line)
+
+
+# Evaluate events into per-role plans written to out. Returns counts.
+def build_plan(events, out):
+    plans = {}
+    # ARN -> capture time of the newest event seen, so replays out of order
+    # and repeated events for one resource collapse to a single mutation
+    newest = {}
+    summary = {"events": 0, "stale": 0, "unsupported": 0}
+
+    for event in events:
+        summary["events"] += 1
+        invoking_event = event["invokingEvent"]
+        if isinstance(invoking_event, str):
+            invoking_event = json.loads(invoking_event)
+        configuration_item = invoking_event.get("configurationItem")
+        if configuration_item is None:
+            # scheduled and oversized notifications carry no item to plan from
+            summary["unsupported"] += 1
+            continue
+
+        rule_parameters = event["ruleParameters"]
+        if isinstance(rule_parameters, str):
+            rule_parameters = json.loads(rule_parameters)
+        role = rule_parameters.get("exec_role")
+        plan = plans.get(role)
+        if plan is None:
+            plan = plans[role] = RemediationPlan(out, role, dedupe=True)
+
+        arn = configuration_item.get("ARN")
+        captured = configuration_item.get("configurationItemCaptureTime", "")
+        if arn in newest and captured < newest[arn]:
+            summary["stale"] += 1
+            continue
+        newest[arn] = captured
+        plan.discard(arn)
+        evaluate_compliance(configuration_item, get_policy(rule_parameters), None, plan)
+
+    for plan in plans.values():
+        plan.flush()
+    summary["planned_resources"] = sum(p.tagged for p in plans.values())
+    summary["planned_batches"] = sum(p.batches for p in plans.values())
+    return summary
+
+
+def read_plan(path):
+    with open(path) as plan:
+        for n, line in enumerate(plan):
+            if line.strip():
+                yield n, json.loads(line)
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path) as checkpoint:
+        return {int(line) for line in checkpoint if line.strip()}
+
+
+# Apply a plan, skipping batches already in the checkpoint. Batches with
+# failed ARNs are still checkpointed; the failures are written to failed_out
+# in plan format so they can be applied again on their own.
+def apply_plan(plan_path, checkpoint_path, failed_out, rate=DEFAULT_APPLY_RATE, max_seconds=None):
+    done = load_checkpoint(checkpoint_path)
+    set_rate("tag:TagResources", rate)
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    summary = {"batches": 0, "resumed": 0, "tagged": 0, "failed": 0, "complete": True}
+
+    with open(checkpoint_path, "a") as checkpoint:
+        for n, entry in read_plan(plan_path):
+            if n in done:
+                summary["resumed"] += 1
+                continue
+            if deadline and time.monotonic() >= deadline:
+                logging.warning("Apply window over, resume with the same checkpoint")
+                summary["complete"] = False
+                break
+
+            role = entry.get("role")
+            credentials = get_credentials(role) if role else None
+            queue = RemediationQueue(credentials, entry.get("region"), role_account(role) if role else None)
+            failures = queue.send(entry["tags"], entry["arns"])
+
+            if failures:
+                failed_out.write(json.dumps(dict(entry, arns=sorted(failures))) + "\n")
+                failed_out.flush()
+            checkpoint.write(str(n) + "\n")
+            checkpoint.flush()
+            summary["batches"] += 1
+            summary["tagged"] += queue.tagged
+            summary["failed"] += len(failures)
+
+    logging.info("Applied " + str(summary["batches"]) + " batches, " +
+                 str(summary["tagged"]) + " resources tagged, " + str(summary["failed"]) + " failed")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan and apply required tag remediation")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    plan = commands.add_parser("plan", help="evaluate Config rule events into a remediation plan")
+    plan.add_argument("events", help="JSONL of Config rule events, or - for stdin")
+    plan.add_argument("-o", "--output", default="plan.jsonl")
+
+    apply = commands.add_parser("apply", help="apply a remediation plan")
+    apply.add_argument("plan")
+    apply.add_argument("--checkpoint", help="default: <plan>.checkpoint")
+    apply.add_argument("--failed", help="default: <plan>.failed.jsonl")
+    apply.add_argument("--rate", type=float, default=DEFAULT_APPLY_RATE, help="tag_resources calls per second")
+    apply.add_argument("--max-seconds", type=float, help="stop after this long, for off-peak windows")
+    args = parser.parse_args()
+
+    if args.command == "plan":
+        with open(args.output, "w") as out:
+            summary = build_plan(read_events(args.events), out)
+    else:
+        with open(args.failed or args.plan + ".failed.jsonl", "a") as failed_out:
+            summary = apply_plan(args.plan, args.checkpoint or args.plan + ".checkpoint",
+                                 failed_out, args.rate, args.max_seconds)
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import json
+from functools import lru_cache
+from types import MappingProxyType
+
+# Rule parameters that are not required tags
+EXCLUDED_PARAMETERS = ('exec_role', 'Name')
+
+
+# Rule parameters compiled once into lookup tables so that checking a resource
+# is a handful of dict/set lookups instead of nested loops and string splits.
+# Compiled policies are shared between invocations, so the tables are
+# read-only views and the allowed values frozensets.
+class TagPolicy:
+    __slots__ = ('required', 'allowed', 'defaults', 'folded')
+
+    def __init__(self, rule_parameters):
+        allowed = {}
+        defaults = {}
+        for rtag, rvalues in rule_parameters.items():
+            if rtag in EXCLUDED_PARAMETERS:
+                continue
+            rvaluesplit = rvalues.split(",")
+            allowed[rtag] = frozenset(rvaluesplit)
+            defaults[rtag] = rvaluesplit[0]
+
+        object.__setattr__(self, 'required', tuple(allowed))
+        object.__setattr__(self, 'allowed', MappingProxyType(allowed))
+        object.__setattr__(self, 'defaults', MappingProxyType(defaults))
+        object.__setattr__(self, 'folded', MappingProxyType({k.casefold(): k for k in allowed}))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("TagPolicy is immutable")
+
+    # Return (incorrect_value, tag_not_present, case_mismatch) for a tag dict
+    def check(self, current_tags):
+        incorrect_value = []
+        tag_not_present = []
+        case_mismatch = []
+        allowed = self.allowed
+
+        for rtag in self.required:
+            value = current_tags.get(rtag)
+            if value is None:
+                tag_not_present.append(rtag)
+            elif value not in allowed[rtag]:
+                incorrect_value.append(rtag)
+
+        if tag_not_present and current_tags:
+            missing = set(tag_not_present)
+            for key in current_tags:
+                rtag = self.folded.get(key.casefold())
+                if rtag in missing and key != rtag:
+                    case_mismatch.append(rtag)
+
+        return incorrect_value, tag_not_present, case_mismatch
+
+    # Default value for each tag that needs remediating
+    def remediation_tags(self, tag_keys):
+        return {rtag: self.defaults[rtag] for rtag in tag_keys if rtag in self.defaults}
+
+
+# ruleParameters arrive as the same JSON string on every invocation of a rule;
+# parse each distinct string once. The result is shared, do not modify it.
+@lru_cache(maxsize=32)
+def parse_rule_parameters(serialized_parameters):
+    return json.loads(serialized_parameters)
+
+
+@lru_cache(maxsize=32)
+def _compile(serialized_parameters):
+    return TagPolicy(json.loads(serialized_parameters))
+
+
+# Memoized by the serialized ruleParameters, so every invocation with the same
+# parameter set shares one compiled policy. Key order is kept so annotations
+# list tags in the order the rule declares them.
+def get_policy(rule_parameters):
+    if isinstance(rule_parameters, TagPolicy):
+        return rule_parameters
+    return _compile(json.dumps(rule_parameters))
@@ -0,0 +1,179 @@
+# Central tag policy document, loaded from S3 or SSM Parameter Store instead
+# of Config ruleParameters. Set POLICY_SOURCE to
+#   s3://bucket/key               (JSON object)
+#   ssm:/parameter/name           (JSON String or SecureString parameter)
+# ruleParameters then only carry exec_role.
+#
+# The document is kept in-process and revalidated at most every
+# POLICY_TTL_SECONDS: S3 with a conditional If-None-Match GET (304 when
+# unchanged), SSM by parameter version. Warm invocations inside the TTL make
+# no call at all, and a changed policy is picked up within one TTL as
+# resources are next evaluated, without re-evaluating everything at once.
+# If a revalidation fails the cached document stays in use.
+#
+# Document format. Values are lists, or comma-separated strings as in
+# ruleParameters; the first value is the remediation default, and null drops
+# a requirement inherited from a broader level.
+#   {
+#     "version": "2024-06-01",
+#     "required_tags": {"CostCenter": ["R&D", "Ops"]},
+#     "resource_types": {"AWS::S3::Bucket": {"DataClass": ["internal", "public"]}},
+#     "ous": {"ou-ab12-cd34ef56": {"required_tags": {...}, "resource_types": {...}}},
+#     "accounts": {"123456789012": "ou-ab12-cd34ef56"}
+#   }
+# Levels merge in that order, OU levels last. An account's OU comes from
+# "accounts", or from organizations:ListParents when it is not listed there.
+
+import os
+import json
+import time
+import logging
+import threading
+from metrics import count, timer
+from policy import get_policy
+from session_cache import LRUCache, get_client
+
+POLICY_SOURCE = os.environ.get('POLICY_SOURCE')
+POLICY_TTL_SECONDS = int(os.environ.get('POLICY_TTL_SECONDS', 300))
+MAX_CACHED_OUS = 1024
+
+_document = None
+# ETag (S3) or parameter version (SSM) of the cached document
+_version = None
+_checked_at = 0.0
+_compiled = {}
+_lock = threading.Lock()
+# account -> OU ID, or "" for accounts with no OU
+_ous = LRUCache("ous", MAX_CACHED_OUS)
+
+
+def _fetch_s3(source, version):
+    from botocore.exceptions import ClientError
+
+    bucket, key = source[len("s3://"):].split("/", 1)
+    params = {"Bucket": bucket, "Key": key}
+    if version:
+        params["IfNoneMatch"] = version
+    try:
+        response = get_client('s3').get_object(**params)
+    except ClientError as e:
+        if e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 304 or \
+                e.response.get('Error', {}).get('Code') in ('304', 'NotModified'):
+            return None, version
+        raise
+    return json.loads(response['Body'].read()), response['ETag']
+
+
+# SSM has no conditional get; an unchanged version is not re-parsed
+def _fetch_ssm(source, version):
+    parameter = get_client('ssm').get_parameter(
+        Name=source[len("ssm:"):], WithDecryption=True)['Parameter']
+    if version and str(parameter['Version']) == version:
+        return None, version
+    return json.loads(parameter['Value']), str(parameter['Version'])
+
+
+# The current document, fetched or revalidated when the TTL has passed.
+# Returns None when no POLICY_SOURCE is configured.
+def get_document(source=None):
+    global _document, _version, _checked_at
+    source = source or POLICY_SOURCE
+    if not source:
+        return None
+    if _document is not None and time.monotonic() - _checked_at < POLICY_TTL_SECONDS:
+        return _document
+
+    with _lock:
+        if _document is not None and time.monotonic() - _checked_at < POLICY_TTL_SECONDS:
+            return _document
+        fetch = _fetch_s3 if source.startswith("s3://") else _fetch_ssm
+        try:
+            with timer("PolicyFetch"):
+                document, version = fetch(source, _version if _document is not None else None)
+        except Exception as e:
+            if _document is None:
+                raise
+            logging.warning("Could not revalidate tag policy, keeping version " +
+                            str(_version) + ": " + str(e))
+            _checked_at = time.monotonic()
+            return _document
+
+        _checked_at = time.monotonic()
+        if document is None:
+            count("PolicyNotModified")
+        else:
+            logging.info("Loaded tag policy " + str(document.get("version")) + " (" + str(version) + ")")
+            count("PolicyLoads")
+            _document, _version = document, version
+            _compiled.clear()
+    return _document
+
+
+# Version of the document in use, "" without a POLICY_SOURCE. Part of the
+# state cache digest, so cached evaluations expire with the policy.
+def policy_version():
+    return (_version or "") if get_document() is not None else ""
+
+
+def account_ou(document, account):
+    if not account or not document.get("ous"):
+        return None
+    if account in document.get("accounts", {}):
+        return document["accounts"][account]
+
+    ou = _ous.get(account)
+    if ou is None:
+        try:
+            with timer("ListParents"):
+                parents = get_client('organizations').list_parents(ChildId=account)['Parents']
+            ou = next((p['Id'] for p in parents if p['Type'] == 'ORGANIZATIONAL_UNIT'), "")
+        except Exception as e:
+            logging.warning("Could not look up the OU of " + account + ": " + str(e))
+            ou = ""
+        _ous.put(account, ou)
+    return ou or None
+
+
+def _merge(parameters, tags):
+    for key, values in (tags or {}).items():
+        if values is None:
+            parameters.pop(key, None)
+        else:
+            parameters[key] = values if isinstance(values, str) else ",".join(values)
+
+
+# Required tags for a resource type in an OU, as ruleParameters-style values
+def document_parameters(document, resource_type, ou=None):
+    parameters = {}
+    levels = [document]
+    if ou and ou in document.get("ous", {}):
+        levels.append(document["ous"][ou])
+    for level in levels:
+        _merge(parameters, level.get("required_tags"))
+        _merge(parameters, level.get("resource_types", {}).get(resource_type))
+    return parameters
+
+
+# The TagPolicy for one configuration item: from the policy document when one
+# is configured, otherwise from the rule parameters (or compiled TagPolicy)
+def resolve_policy(rule_parameters, configuration_item):
+    document = get_document()
+    if document is None:
+        return get_policy(rule_parameters)
+
+    arn = configuration_item.get("ARN") or ""
+    account = configuration_item.get("awsAccountId") or (arn.split(":")[4] if arn.count(":") >= 5 else None)
+    key = (configuration_item["resourceType"], account_ou(document, account))
+    policy = _compiled.get(key)
+    if policy is None:
+        policy = _compiled[key] = get_policy(document_parameters(document, *key))
+    return policy
+
+
+def clear():
+    global _document, _version, _checked_at
+    _document = None
+    _version = None
+    _checked_at = 0.0
+    _compiled.clear()
+    _ous.clear()
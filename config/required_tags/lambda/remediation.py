@@ -1,36 +1,186 @@
-from urllib import response
-import boto3
+import os
+import json
 import logging
-from botocore.exceptions import ClientError
+from metrics import count, record, timer
+from policy import get_policy
+from ratelimit import THROTTLE_ERRORS, backoff, client_region, get_limiter
+from session_cache import get_client
 
+# TagResources accepts at most 20 ARNs per call when they share one tag map
+MAX_ARNS_PER_CALL = 20
+TAG_RESOURCES_RETRIES = 3
+# Failures that will not succeed on retry
+NON_RETRYABLE_ERRORS = ["InvalidParameterException"]
+# "apply" tags non-compliant resources as they are evaluated, "report" only
+# evaluates them, leaving remediation to a reviewed plan (see plan.py)
+REMEDIATION_MODE = os.environ.get('REMEDIATION_MODE', 'apply')
 
-def add_default_tag(required_tags, incorrect_value, tag_not_present, configuration_item, credentials):
+
+# Pick the first allowed value of each tag that needs remediating
+def default_tags(required_tags, incorrect_value, tag_not_present):
+    return get_policy(required_tags).remediation_tags(incorrect_value + tag_not_present)
+
+
+# Collects pending remediations and sends them as multi-ARN tag_resources
+# calls, one group per identical tag map
+class RemediationQueue:
+    def __init__(self, credentials, region=None, account=None):
+        self.client = get_client('resourcegroupstaggingapi', credentials, region)
+        self.limiter = get_limiter("tag:TagResources", account, client_region(self.client))
+        self.groups = {}
+        self.failed = {}
+        self.tagged = 0
+
+    def add(self, arn, tag_list):
+        key = tuple(sorted(tag_list.items()))
+        arns = self.groups.setdefault(key, [])
+        if arn not in arns:
+            arns.append(arn)
+        if len(arns) >= MAX_ARNS_PER_CALL:
+            self._send(dict(key), arns)
+            self.groups.pop(key)
+
+    def flush(self):
+        for key, arns in self.groups.items():
+            self._send(dict(key), arns)
+        self.groups = {}
+        logging.info("Remediation queue tagged " + str(self.tagged) +
+                     " resources, " + str(len(self.failed)) + " failed")
+        return self.failed
+
+    # Send one batch now. Returns the failures among arns.
+    def send(self, tag_list, arns):
+        self._send(tag_list, arns)
+        return {arn: self.failed[arn] for arn in arns if arn in self.failed}
+
+    def _send(self, tag_list, arns):
+        from botocore.exceptions import ClientError
+
+        for i in range(0, len(arns), MAX_ARNS_PER_CALL):
+            pending = arns[i:i + MAX_ARNS_PER_CALL]
+            logging.info("Remediating tags: " + str(tag_list) +
+                         " on " + str(len(pending)) + " resources")
+            for attempt in range(TAG_RESOURCES_RETRIES + 1):
+                if attempt:
+                    count("TagResourcesRetries")
+                    backoff(attempt - 1)
+                self.limiter.acquire()
+                try:
+                    with timer("TagResources"):
+                        response = self.client.tag_resources(
+                            ResourceARNList=pending,
+                            Tags=tag_list
+                        )
+                    logging.debug(response)
+                except ClientError as e:
+                    logging.warning("tag_resources failed: " + str(e))
+                    if e.response.get('Error', {}).get('Code') in THROTTLE_ERRORS:
+                        count("Throttles")
+                        self.limiter.throttled()
+                    continue
+
+                failures = response.get('FailedResourcesMap', {})
+                if any(f.get('ErrorCode') in THROTTLE_ERRORS for f in failures.values()):
+                    count("Throttles")
+                    self.limiter.throttled()
+                self.tagged += len(pending) - len(failures)
+                count("ResourcesTagged", len(pending) - len(failures))
+                record("ResourcesPerTagCall", len(pending) - len(failures), "Count")
+                retry = []
+                for arn, failure in failures.items():
+                    if failure.get('ErrorCode') in NON_RETRYABLE_ERRORS:
+                        self.failed[arn] = failure
+                    else:
+                        retry.append(arn)
+                pending = retry
+                if not pending:
+                    break
+
+            for arn in pending:
+                self.failed.setdefault(arn, {"ErrorCode": "RetriesExhausted"})
+                logging.error("Failed to tag " + arn)
+
+
+# Region part of an ARN, empty for global resources such as S3 buckets
+def arn_region(arn):
+    parts = arn.split(":", 4)
+    return parts[3] if len(parts) > 3 else ""
+
+
+# Same interface as RemediationQueue, but writes each batch as a JSON line
+#   {"tags": {...}, "arns": [...], "region": "...", "role": "<exec_role>"}
+# to out instead of calling tag_resources, so remediation can be reviewed
+# and applied later (see plan.py). Batches never mix regions. With dedupe,
+# only the last mutation seen for each ARN is kept and batches are written
+# on flush; without it batches are streamed out as they fill.
+class RemediationPlan:
+    def __init__(self, out, role=None, dedupe=False):
+        self.out = out
+        self.role = role
+        self.dedupe = dedupe
+        self.groups = {}
+        self.latest = {}
+        self.failed = {}
+        self.tagged = 0
+        self.batches = 0
+
+    def add(self, arn, tag_list):
+        key = (arn_region(arn), tuple(sorted(tag_list.items())))
+        if self.dedupe:
+            self.latest[arn] = key
+            return
+        arns = self.groups.setdefault(key, [])
+        if arn not in arns:
+            arns.append(arn)
+        if len(arns) >= MAX_ARNS_PER_CALL:
+            self._write(key, arns)
+            self.groups.pop(key)
+
+    # Drop anything planned for arn, e.g. when a later event finds it compliant
+    def discard(self, arn):
+        self.latest.pop(arn, None)
+
+    def flush(self):
+        for arn, key in self.latest.items():
+            self.groups.setdefault(key, []).append(arn)
+        self.latest = {}
+        for key, arns in sorted(self.groups.items()):
+            for i in range(0, len(arns), MAX_ARNS_PER_CALL):
+                self._write(key, arns[i:i + MAX_ARNS_PER_CALL])
+        self.groups = {}
+        logging.info("Remediation plan holds " + str(self.tagged) +
+                     " resources in " + str(self.batches) + " batches")
+        return self.failed
+
+    def _write(self, key, arns):
+        region, tag_items = key
+        entry = {"tags": dict(tag_items), "arns": arns}
+        if region:
+            entry["region"] = region
+        if self.role:
+            entry["role"] = self.role
+        self.out.write(json.dumps(entry) + "\n")
+        self.tagged += len(arns)
+        self.batches += 1
+
+
+# Remediate one resource. With a queue the write is deferred to queue.flush(),
+# otherwise it is sent immediately.
+def add_default_tag(required_tags, incorrect_value, tag_not_present, configuration_item, credentials, queue=None):
     arn = configuration_item['ARN']
-    tag_list = {}
-
-    tag = boto3.client(
-        'resourcegroupstaggingapi',
-        aws_access_key_id=credentials['AccessKeyId'],
-        aws_secret_access_key=credentials['SecretAccessKey'],
-        aws_session_token=credentials['SessionToken']
-    )
-
-    remediated_tags = incorrect_value + tag_not_present
-    for mtag in remediated_tags:
-        for rtag, rvalues in required_tags.items():
-            rvaluesplit = rvalues.split(",")
-            missing_value = rvaluesplit[0]
-            if mtag == rtag:
-                required_tags.pop(rtag)
-                tag_list[rtag] = missing_value
-                break
-
-    logging.info("Remediating tags: " + str(tag_list))
-
-    response = tag.tag_resources(
-        ResourceARNList=[arn],
-        Tags=tag_list
-    )
-    logging.debug(response)
+    tag_list = default_tags(required_tags, incorrect_value, tag_not_present)
+    if not tag_list:
+        return
+
+    if REMEDIATION_MODE == "report" and not isinstance(queue, RemediationPlan):
+        logging.info("Report-only mode, not tagging " + arn + " with " + str(tag_list))
+        return
+
+    if queue is None:
+        queue = RemediationQueue(credentials)
+        queue.add(arn, tag_list)
+        queue.flush()
+    else:
+        queue.add(arn, tag_list)
 
     return
@@ -0,0 +1 @@
+../../../common/retry_queue.py
\ No newline at end of file
@@ -0,0 +1,202 @@
+# Evaluate the required tags rule against a Config configuration snapshot.
+#
+# Reads the (optionally gzipped) snapshot JSON that the delivery channel
+# writes to S3, one configuration item at a time, so memory stays bounded by
+# the largest single item regardless of the snapshot size. Writes a JSONL
+# compliance report and a batched remediation plan (see RemediationPlan)
+# without calling any AWS API other than reading the snapshot.
+#
+#   python snapshot.py snapshot.json.gz --parameters-file params.json \
+#       --report report.jsonl --plan plan.jsonl
+#   python snapshot.py s3://bucket/AWSLogs/.../ConfigSnapshot/x.json.gz --parameters '{...}'
+#   zcat snapshot.json.gz | python snapshot.py - --parameters-file params.json
+
+import io
+import os
+import sys
+import json
+import gzip
+import argparse
+
+# handler sets the log level from the Lambda environment at import; per-item
+# logging would dominate a full snapshot run
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+
+from compliance_view import get_compliance_view, record_evaluation  # noqa: E402
+from handler import APPLICABLE_RESOURCES, build_evaluation, evaluate_compliance  # noqa: E402
+from policy import get_policy  # noqa: E402
+from remediation import RemediationPlan  # noqa: E402
+
+READ_SIZE = 1024 * 1024
+ITEMS_KEY = "configurationItems"
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = _WHITESPACE + ",:]}"
+
+
+# Text stream over a path, s3:// URL or binary stream, gunzipped if needed
+def open_snapshot(source):
+    if isinstance(source, str):
+        if source == "-":
+            stream = sys.stdin.buffer
+        elif source.startswith("s3://"):
+            from session_cache import get_client
+            bucket, key = source[len("s3://"):].split("/", 1)
+            stream = get_client("s3").get_object(Bucket=bucket, Key=key)["Body"]
+        else:
+            stream = open(source, "rb")
+    else:
+        stream = source
+
+    if not hasattr(stream, "peek"):
+        stream = io.BufferedReader(_RawReader(stream), READ_SIZE)
+    if stream.peek(2)[:2] == b"\x1f\x8b":
+        stream = gzip.GzipFile(fileobj=stream)
+    return io.TextIOWrapper(stream, encoding="utf-8")
+
+
+# Adapts any object with read(n) (e.g. a botocore StreamingBody) to io.RawIOBase
+class _RawReader(io.RawIOBase):
+    def __init__(self, stream):
+        self.stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+# Incremental reader over a text stream: holds only the unparsed tail
+class _Scanner:
+    def __init__(self, text):
+        self.text = text
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        if self.eof:
+            return False
+        chunk = self.text.read(READ_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError("Malformed snapshot: expected " + repr(char) +
+                             " but found " + repr(self.peek()))
+        self.pos += 1
+
+    # Decode the next complete JSON value, reading more input as needed
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+                # a number cut off by the chunk boundary decodes as a shorter one
+                if self.eof or (end < len(self.buffer) and self.buffer[end] in _DELIMITERS):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+# Yield each configuration item of a snapshot document
+def iter_configuration_items(text):
+    scanner = _Scanner(text)
+    scanner.expect("{")
+    if scanner.peek() == "}":
+        return
+    while True:
+        key = scanner.value()
+        scanner.expect(":")
+        if key != ITEMS_KEY:
+            scanner.value()
+        else:
+            scanner.expect("[")
+            if scanner.peek() == "]":
+                scanner.pos += 1
+            else:
+                while True:
+                    yield scanner.value()
+                    if scanner.peek() == "]":
+                        scanner.pos += 1
+                        break
+                    scanner.expect(",")
+        if scanner.peek() == "}":
+            return
+        scanner.expect(",")
+
+
+# Evaluate every applicable item, writing one report line per item and queuing
+# remediation into plan. With COMPLIANCE_VIEW_PATH or COMPLIANCE_VIEW_TABLE set
+# the compliance view is backfilled as well. Returns counts by compliance type.
+def evaluate_snapshot(source, rule_parameters, report, plan):
+    policy = get_policy(rule_parameters)
+    applicable = frozenset(APPLICABLE_RESOURCES)
+    view = get_compliance_view()
+    summary = {"skipped": 0}
+
+    with open_snapshot(source) as text:
+        for configuration_item in iter_configuration_items(text):
+            if configuration_item.get("resourceType") not in applicable:
+                summary["skipped"] += 1
+                continue
+            evaluation = evaluate_compliance(configuration_item, policy, None, plan)
+            entry = build_evaluation(configuration_item, evaluation)
+            entry["ARN"] = configuration_item.get("ARN")
+            entry["AwsRegion"] = configuration_item.get("awsRegion")
+            report.write(json.dumps(entry, default=str) + "\n")
+            if view:
+                record_evaluation(view, configuration_item, evaluation)
+            compliance_type = evaluation["compliance_type"]
+            summary[compliance_type] = summary.get(compliance_type, 0) + 1
+
+    plan.flush()
+    summary["planned_resources"] = plan.tagged
+    summary["planned_batches"] = plan.batches
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate required tags against a Config snapshot")
+    parser.add_argument("snapshot", help="snapshot file, s3:// URL or - for stdin (gzipped or plain)")
+    parameters = parser.add_mutually_exclusive_group(required=True)
+    parameters.add_argument("--parameters", help="rule parameters JSON")
+    parameters.add_argument("--parameters-file", help="file holding the rule parameters JSON")
+    parser.add_argument("--report", default="report.jsonl")
+    parser.add_argument("--plan", default="plan.jsonl")
+    args = parser.parse_args()
+
+    if args.parameters_file:
+        with open(args.parameters_file) as f:
+            rule_parameters = json.load(f)
+    else:
+        rule_parameters = json.loads(args.parameters)
+
+    with open(args.report, "w") as report, open(args.plan, "w") as plan_file:
+        summary = evaluate_snapshot(args.snapshot, rule_parameters, report, RemediationPlan(plan_file))
+    print(json.dumps(summary))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# Remembers the last evaluation of each resource so that re-delivered
+# configuration items whose tags and rule parameters have not changed can be
+# skipped without assuming a role, remediating or calling put_evaluations.
+#
+# Entries are keyed like the compliance view, by account, region, resource
+# type and resource ID.
+#
+# STATE_CACHE_TABLE  DynamoDB table (partition key "resource_key", TTL attribute "expires_at")
+# STATE_CACHE_PATH   SQLite file, for local runs and tests
+# STATE_CACHE_TTL    seconds an entry stays valid, default one day
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import logging
+from compliance_view import resource_key
+from policy_document import policy_version
+from session_cache import get_client
+
+DEFAULT_TTL = 24 * 60 * 60
+
+
+# Includes the central policy document version, so a policy change expires
+# every cached evaluation
+def parameters_digest(rule_parameters):
+    return hashlib.sha256((json.dumps(rule_parameters, sort_keys=True) + policy_version()).encode()).hexdigest()
+
+
+def state_digest(configuration_item, rule_parameters):
+    state = [
+        configuration_item["resourceId"],
+        sorted((configuration_item.get("tags") or {}).items()),
+        parameters_digest(rule_parameters)
+    ]
+    return hashlib.sha256(json.dumps(state).encode()).hexdigest()
+
+
+class SQLiteStateStore:
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS evaluation_state ("
+            "resource_key TEXT PRIMARY KEY, digest TEXT, parameters_digest TEXT, "
+            "compliance_type TEXT, expires_at INTEGER)")
+        self.db.execute("DELETE FROM evaluation_state WHERE expires_at < ?", (int(time.time()),))
+        self.db.commit()
+
+    def get(self, key):
+        row = self.db.execute(
+            "SELECT digest, parameters_digest, compliance_type FROM evaluation_state "
+            "WHERE resource_key = ? AND expires_at >= ?", (key, int(time.time()))).fetchone()
+        if row is None:
+            return None
+        return {"digest": row[0], "parameters_digest": row[1], "compliance_type": row[2]}
+
+    def put(self, key, digest, params_digest, compliance_type):
+        self.db.execute(
+            "INSERT OR REPLACE INTO evaluation_state VALUES (?, ?, ?, ?, ?)",
+            (key, digest, params_digest, compliance_type, int(time.time()) + self.ttl))
+        self.db.commit()
+
+
+class DynamoDBStateStore:
+    def __init__(self, table, ttl=DEFAULT_TTL):
+        self.table = table
+        self.ttl = ttl
+        self.client = get_client("dynamodb")
+
+    def get(self, key):
+        item = self.client.get_item(
+            TableName=self.table,
+            Key={"resource_key": {"S": key}}
+        ).get("Item")
+        # DynamoDB TTL deletion is lazy, so expiry is checked here as well
+        if item is None or int(item["expires_at"]["N"]) < time.time():
+            return None
+        return {
+            "digest": item["digest"]["S"],
+            "parameters_digest": item["parameters_digest"]["S"],
+            "compliance_type": item["compliance_type"]["S"]
+        }
+
+    def put(self, key, digest, params_digest, compliance_type):
+        self.client.put_item(
+            TableName=self.table,
+            Item={
+                "resource_key": {"S": key},
+                "digest": {"S": digest},
+                "parameters_digest": {"S": params_digest},
+                "compliance_type": {"S": compliance_type},
+                "expires_at": {"N": str(int(time.time()) + self.ttl)}
+            }
+        )
+
+
+_store = None
+
+
+# Configured store, or None when the cache is disabled
+def get_state_store():
+    global _store
+    if _store is None:
+        ttl = int(os.environ.get("STATE_CACHE_TTL", DEFAULT_TTL))
+        if os.environ.get("STATE_CACHE_TABLE"):
+            _store = DynamoDBStateStore(os.environ["STATE_CACHE_TABLE"], ttl)
+        elif os.environ.get("STATE_CACHE_PATH"):
+            _store = SQLiteStateStore(os.environ["STATE_CACHE_PATH"], ttl)
+    return _store
+
+
+# True when the item would produce the same evaluation as last time. The full
+# digest is always compared: where tags live in a configuration item differs
+# by resource type, so a configurationItemDiff cannot tell reliably whether
+# tags changed.
+def is_unchanged(store, configuration_item, rule_parameters):
+    if configuration_item.get("configurationItemStatus") not in ("OK", "ResourceDiscovered"):
+        return False
+    cached = store.get(resource_key(configuration_item))
+    if cached is None:
+        return False
+    unchanged = cached["digest"] == state_digest(configuration_item, rule_parameters)
+    if unchanged:
+        logging.info("Skipping unchanged " + resource_key(configuration_item) +
+                     " (" + cached["compliance_type"] + ")")
+    return unchanged
+
+
+def remember(store, configuration_item, rule_parameters, evaluation):
+    if configuration_item.get("configurationItemStatus") not in ("OK", "ResourceDiscovered"):
+        return
+    store.put(
+        resource_key(configuration_item),
+        state_digest(configuration_item, rule_parameters),
+        parameters_digest(rule_parameters),
+        evaluation["compliance_type"]
+    )
@@ -0,0 +1,117 @@
+# Periodic full-account sweep of the required tags rule.
+#
+# Trigger Type: Periodic (ScheduledNotification)
+# Pages through the resources AWS Config records of the applicable types with
+# config.select_resource_config, one page at a time; evaluates, remediates and
+# reports each page before fetching the next, and hands the pagination token
+# to a fresh invocation before the Lambda timeout. Config, unlike the Resource
+# Groups Tagging API, also returns resources that were never tagged. The
+# exec_role needs config:SelectResourceConfig.
+
+import json
+import logging
+from datetime import datetime, timezone
+from compliance_view import get_compliance_view, record_evaluation
+from handler import APPLICABLE_RESOURCES, build_evaluation, evaluate_compliance, put_evaluations
+from metrics import timer
+from policy import get_policy, parse_rule_parameters
+from remediation import RemediationQueue
+from session_cache import get_client, get_credentials, role_account
+
+# select_resource_config returns at most 100 results per call
+RESOURCES_PER_PAGE = 100
+# Stop paging when less than this is left and continue in a new invocation
+SWEEP_TIME_RESERVE_MS = 60 * 1000
+# Deleted resources were reported when Config recorded the deletion
+DELETED_STATUSES = ("ResourceDeleted", "ResourceDeletedNotRecorded")
+
+
+# Advanced query for every recorded resource of the applicable types
+def resource_query():
+    return ("SELECT resourceId, resourceType, arn, awsRegion, tags, configurationItemStatus "
+            "WHERE resourceType IN (" + ", ".join("'" + t + "'" for t in APPLICABLE_RESOURCES) + ")")
+
+
+# Yield (resources, next_token) one page at a time so memory stays bounded
+# by the page size regardless of how many resources the account holds
+def iter_resource_pages(client, query, pagination_token=None):
+    while True:
+        kwargs = {
+            "Expression": query,
+            "Limit": RESOURCES_PER_PAGE
+        }
+        if pagination_token:
+            kwargs["NextToken"] = pagination_token
+        with timer("SelectResourceConfig"):
+            response = client.select_resource_config(**kwargs)
+        pagination_token = response.get("NextToken")
+        yield [json.loads(result) for result in response.get("Results", [])], pagination_token
+        if not pagination_token:
+            return
+
+
+# Build the subset of a configuration item that evaluate_compliance uses from
+# an advanced query result
+def configuration_item_from_query(result, capture_time, account=None):
+    return {
+        "resourceType": result["resourceType"],
+        "resourceId": result["resourceId"],
+        "ARN": result.get("arn", ""),
+        "tags": {t["key"]: t["value"] for t in result.get("tags", [])},
+        "configurationItemStatus": result.get("configurationItemStatus", "OK"),
+        "configurationItemCaptureTime": capture_time,
+        "awsAccountId": account,
+        "awsRegion": result.get("awsRegion")
+    }
+
+
+def sweep_handler(event, context):
+    rule_parameters = parse_rule_parameters(event["ruleParameters"])
+    result_token = event.get("resultToken", "No token found.")
+    pagination_token = event.get("paginationToken")
+
+    account = role_account(rule_parameters['exec_role'])
+    credentials = get_credentials(rule_parameters['exec_role'])
+    config = get_client("config", credentials)
+    queue = RemediationQueue(credentials, account=account)
+    policy = get_policy(rule_parameters)
+    view = get_compliance_view()
+    capture_time = datetime.now(timezone.utc).isoformat()
+
+    swept = 0
+    for resources, pagination_token in iter_resource_pages(config, resource_query(), pagination_token):
+        evaluations = []
+        for resource in resources:
+            configuration_item = configuration_item_from_query(
+                resource, capture_time, account)
+            if configuration_item["configurationItemStatus"] in DELETED_STATUSES:
+                continue
+            evaluation = evaluate_compliance(
+                configuration_item, policy, credentials, queue)
+            if view:
+                record_evaluation(view, configuration_item, evaluation, account)
+            evaluations.append(build_evaluation(
+                configuration_item, evaluation))
+
+        queue.flush()
+        put_evaluations(config, evaluations, result_token, account)
+        swept += len(resources)
+
+        if pagination_token and context.get_remaining_time_in_millis() < SWEEP_TIME_RESERVE_MS:
+            logging.info("Swept " + str(swept) +
+                         " resources, continuing in a new invocation")
+            continue_sweep(event, pagination_token, context)
+            return {"swept": swept, "continued": True}
+
+    logging.info("Sweep complete, " + str(swept) + " resources in this invocation")
+    return {"swept": swept, "continued": False}
+
+
+# Re-invoke this function asynchronously from the checkpointed token
+def continue_sweep(event, pagination_token, context):
+    event = dict(event, paginationToken=pagination_token)
+    get_client("lambda").invoke(
+        FunctionName=context.invoked_function_arn,
+        InvocationType="Event",
+        Payload=json.dumps(event)
+    )
@@ -0,0 +1,236 @@
+# Near-real-time evaluation of resources whose tags changed, from the
+# CloudTrail events of the tagging API calls instead of Config configuration
+# items.
+#
+# Trigger Type: EventBridge, AWS API Call via CloudTrail
+#   tagging.amazonaws.com            TagResources, UntagResources
+#   ec2.amazonaws.com                CreateTags, DeleteTags
+#   s3.amazonaws.com                 PutBucketTagging, DeleteBucketTagging
+#   dynamodb, elasticfilesystem,     TagResource, UntagResource
+#   fsx .amazonaws.com
+# Each call matches one entry of TAG_API_EVENTS. Calls made by the exec role
+# itself, i.e. this function's own remediation, are skipped (see
+# is_own_event). Tag Change on Resource events are not used: they do not say
+# who changed the tags, and each of the calls above emits one as well.
+#
+# Only resource types whose ARN ends in the Config resource ID are evaluated
+# (see ARN_RESOURCE_TYPES). Each becomes a lightweight configuration item and
+# goes through the same evaluate_compliance and remediation as Config items,
+# with its current tags read with get_resources. Resources where none of the
+# changed keys is a required tag are skipped.
+#
+# Without a Config result token nothing can be reported with put_evaluations,
+# and the state cache is not written, so Config still evaluates and reports
+# the recorded item later; this path only remediates sooner and keeps the
+# compliance view current.
+#
+# TAG_EVENT_RULE_PARAMETERS  the rule's ruleParameters JSON. exec_role is
+#                            assumed under the account the event came from.
+
+import os
+import logging
+from compliance_view import get_compliance_view, record_evaluation
+from handler import evaluate_compliance
+from metrics import count, timer
+from policy import parse_rule_parameters
+from policy_document import resolve_policy
+from remediation import RemediationQueue
+from session_cache import get_client, get_credentials
+
+TAG_EVENT_RULE_PARAMETERS = os.environ.get('TAG_EVENT_RULE_PARAMETERS')
+# ResourceARNList accepts at most 100 ARNs per get_resources call
+MAX_ARNS_PER_LOOKUP = 100
+
+# (service, resource type from the ARN) -> Config resource type, for the
+# types whose ARN ends in their Config resource ID. RDS (and DocDB and
+# Neptune, which share its ARN namespace) are left to Config: their Config
+# resource ID is the DbiResourceId or cluster resource ID, not the name in
+# the ARN.
+ARN_RESOURCE_TYPES = {
+    ("ec2", "instance"): "AWS::EC2::Instance",
+    ("ec2", "volume"): "AWS::EC2::Volume",
+    ("s3", ""): "AWS::S3::Bucket",
+    ("dynamodb", "table"): "AWS::DynamoDB::Table",
+    ("elasticfilesystem", "file-system"): "AWS::EFS::FileSystem",
+    ("fsx", "file-system"): "AWS::FSx::FileSystem",
+}
+# EC2 ID prefix -> resource type in the ARN
+EC2_ID_TYPES = {"i": "instance", "vol": "volume"}
+
+
+# The exec role of the rule, in another member account
+def account_role(exec_role, account):
+    parts = exec_role.split(":")
+    if account and len(parts) > 4:
+        parts[4] = account
+    return ":".join(parts)
+
+
+# True when the call was made by the exec role, i.e. by this function's
+# remediation in the event's account
+def is_own_event(detail, exec_role, account):
+    issuer = detail.get("userIdentity", {}).get("sessionContext", {}).get("sessionIssuer", {}).get("arn")
+    return issuer is not None and issuer == account_role(exec_role, account)
+
+
+# Build the subset of a Config configuration item that evaluate_compliance
+# uses for a resource known only by ARN. resourceType is "Unknown" for types
+# not in ARN_RESOURCE_TYPES.
+def configuration_item_from_arn(arn, capture_time, account=None, region=None):
+    parts = arn.split(":", 5)
+    service, name = parts[2], parts[5]
+    if "/" in name:
+        resource_kind, resource_id = name.split("/", 1)
+    elif ":" in name:
+        resource_kind, resource_id = name.split(":", 1)
+    else:
+        resource_kind, resource_id = "", name
+
+    return {
+        "resourceType": ARN_RESOURCE_TYPES.get((service, resource_kind), "Unknown"),
+        "resourceId": resource_id,
+        "ARN": arn,
+        "tags": None,
+        "configurationItemStatus": "OK",
+        "configurationItemCaptureTime": capture_time,
+        "awsAccountId": account or parts[4],
+        "awsRegion": parts[3] or region
+    }
+
+
+def _keys(tags):
+    if isinstance(tags, dict):
+        return list(tags)
+    return [tag.get("key") or tag.get("Key") for tag in tags or []]
+
+
+# Extractors take the call's requestParameters, the ARN prefix
+# "arn:<partition>:", and the event's account and region, and return
+# (ARNs, changed keys). No changed keys means they are unknown.
+def _tagging_api(parameters, prefix, account, region):
+    return (parameters.get("resourceARNList", []),
+            _keys(parameters.get("tags")) + list(parameters.get("tagKeys") or []))
+
+
+def _ec2(parameters, prefix, account, region):
+    arns = []
+    for item in (parameters.get("resourcesSet") or {}).get("items", []):
+        resource_type = EC2_ID_TYPES.get(item.get("resourceId", "").split("-")[0])
+        if resource_type:
+            arns.append(prefix + "ec2:" + region + ":" + account + ":" + resource_type + "/" + item["resourceId"])
+    return arns, _keys((parameters.get("tagSet") or {}).get("items"))
+
+
+def _s3(parameters, prefix, account, region):
+    return [prefix + "s3:::" + parameters["bucketName"]], []
+
+
+def _efs(parameters, prefix, account, region):
+    resource_id = parameters.get("resourceId", "")
+    if not resource_id.startswith("fs-"):
+        return [], []
+    return ([prefix + "elasticfilesystem:" + region + ":" + account + ":file-system/" + resource_id],
+            _keys(parameters.get("tags")) + list(parameters.get("tagKeys") or []))
+
+
+def _by_arn(field):
+    def extract(parameters, prefix, account, region):
+        return [parameters[field]], _keys(parameters.get("tags")) + list(parameters.get("tagKeys") or [])
+    return extract
+
+
+# (eventSource, eventName) -> extractor
+TAG_API_EVENTS = {
+    ("tagging.amazonaws.com", "TagResources"): _tagging_api,
+    ("tagging.amazonaws.com", "UntagResources"): _tagging_api,
+    ("ec2.amazonaws.com", "CreateTags"): _ec2,
+    ("ec2.amazonaws.com", "DeleteTags"): _ec2,
+    ("s3.amazonaws.com", "PutBucketTagging"): _s3,
+    ("s3.amazonaws.com", "DeleteBucketTagging"): _s3,
+    ("dynamodb.amazonaws.com", "TagResource"): _by_arn("resourceArn"),
+    ("dynamodb.amazonaws.com", "UntagResource"): _by_arn("resourceArn"),
+    ("elasticfilesystem.amazonaws.com", "TagResource"): _efs,
+    ("elasticfilesystem.amazonaws.com", "UntagResource"): _efs,
+    ("fsx.amazonaws.com", "TagResource"): _by_arn("resourceARN"),
+    ("fsx.amazonaws.com", "UntagResource"): _by_arn("resourceARN"),
+}
+
+
+# (ARN, changed keys) for each resource the call changed
+def changed_resources(event, partition="aws"):
+    detail = event.get("detail", {})
+    extract = TAG_API_EVENTS.get((detail.get("eventSource"), detail.get("eventName")))
+    if extract is None or detail.get("errorCode"):
+        return []
+    arns, changed = extract(detail.get("requestParameters") or {}, "arn:" + partition + ":",
+                            event.get("account", ""), event.get("region", ""))
+    return [(arn, changed) for arn in arns]
+
+
+# Current tags of arns. Resources that no longer exist are left out.
+def fetch_tags(tagging, arns):
+    found = {}
+    for i in range(0, len(arns), MAX_ARNS_PER_LOOKUP):
+        with timer("GetResources"):
+            response = tagging.get_resources(ResourceARNList=arns[i:i + MAX_ARNS_PER_LOOKUP])
+        for resource in response.get("ResourceTagMappingList", []):
+            found[resource["ResourceARN"]] = {t["Key"]: t["Value"] for t in resource.get("Tags", [])}
+    return found
+
+
+# True when a required tag, in any letter case, is among the changed keys
+def touches_required(policy, changed_keys):
+    return not changed_keys or any(key.casefold() in policy.folded for key in changed_keys)
+
+
+def tag_event_handler(event, context):
+    if not TAG_EVENT_RULE_PARAMETERS:
+        raise ValueError("TAG_EVENT_RULE_PARAMETERS must be set to evaluate tag events")
+    rule_parameters = parse_rule_parameters(TAG_EVENT_RULE_PARAMETERS)
+
+    account = event.get("account")
+    region = event.get("region")
+    count("TagEvents")
+    if is_own_event(event.get("detail", {}), rule_parameters['exec_role'], account):
+        count("OwnTagEventsSkipped")
+        return {"evaluated": 0, "skipped": 0, "remediation_failed": 0}
+    changes = changed_resources(event, rule_parameters['exec_role'].split(":")[1])
+    if not changes:
+        return {"evaluated": 0, "skipped": 0, "remediation_failed": 0}
+
+    pending = []
+    for arn, changed_keys in changes:
+        configuration_item = configuration_item_from_arn(arn, event.get("time", ""), account, region)
+        if configuration_item["resourceType"] == "Unknown" or not touches_required(
+                resolve_policy(rule_parameters, configuration_item), changed_keys):
+            continue
+        pending.append(configuration_item)
+
+    if not pending:
+        count("TagEventsSkipped", len(changes))
+        return {"evaluated": 0, "skipped": len(changes), "remediation_failed": 0}
+
+    credentials = get_credentials(account_role(rule_parameters['exec_role'], account), region)
+    # CloudTrail events carry at most the changed tags; read the current ones
+    current = fetch_tags(get_client("resourcegroupstaggingapi", credentials, region),
+                         [ci["ARN"] for ci in pending])
+    for configuration_item in pending:
+        configuration_item["tags"] = current.get(configuration_item["ARN"])
+    # resources deleted since the event are not evaluated
+    pending = [ci for ci in pending if ci["tags"] is not None]
+
+    queue = RemediationQueue(credentials, region, account)
+    view = get_compliance_view()
+    for configuration_item in pending:
+        evaluation = evaluate_compliance(configuration_item, rule_parameters, credentials, queue)
+        logging.info(configuration_item["ARN"] + " " + evaluation["compliance_type"])
+        if view:
+            record_evaluation(view, configuration_item, evaluation, account)
+
+    # Config evaluates the recorded item later and remediates what failed here
+    failed = queue.flush()
+    if failed:
+        logging.error("Could not remediate " + str(sorted(failed)) + ", leaving them to Config")
+    count("TagEventsEvaluated", len(pending))
+    count("TagEventsSkipped", len(changes) - len(pending))
+    return {"evaluated": len(pending), "skipped": len(changes) - len(pending), "remediation_failed": len(failed)}
@@ -2,12 +2,20 @@ module "lambda_function" {
   source = "terraform-aws-modules/lambda/aws"
 
   publish        = true
-  create_package = true
+  create_package = false
+  # built by `python build.py config` at the repository root, with the
+  # shared modules from common/ copied in
+  local_existing_package = "${path.module}/../../../dist/config.zip"
 
   function_name = "config_required_tags"
-  handler       = "index.handler"
+  handler       = "handler.lambda_handler"
   runtime       = "python3.9"
-  source_path   = "${path.module}/../lambda/"
+  timeout       = 900
+
+  environment_variables = {
+    LOG_LEVEL         = "INFO"
+    METRICS_NAMESPACE = "TagCompliance"
+  }
 
   # TO-DO: this access should be reduced
   policies                      = ["arn:aws:iam::aws:policy/AWSLambdaExecute", "arn:aws:iam::aws:policy/AmazonEC2FullAccess", "arn:aws:iam::aws:policy/AWSConfigRole", "arn:aws:iam::aws:policy/ResourceGroupsandTagEditorFullAccess", "arn:aws:iam::aws:policy/AmazonSESFullAccess"]
@@ -0,0 +1,422 @@
+# Offline check of CloudFormation templates against the SCPs in scp_policies/,
+# without deploying anything.
+#
+# Each template resource is expanded into the create API calls CloudFormation
+# would make for it: the IAM action, the ARN of every resource the call
+# creates, and the aws:RequestTag/* and aws:TagKeys values it would send.
+# Each call is then evaluated against the SCP statements, which are compiled
+# once into an index keyed by action, with precompiled resource patterns.
+#
+#   python scp_simulator.py --policy scp_policies/ec2_ebs_policy.json cfn/*.yaml
+#   python scp_simulator.py --policy-dir scp_policies --stack-tag Project=x templates/
+#
+# Exits 1 when any call is denied, so it can gate merges. Resource types
+# missing from RESOURCE_CALLS are listed as unmodeled and never denied.
+# Requests carry aws:RequestTag/*, aws:TagKeys, aws:RequestedRegion and, as
+# CloudFormation makes them, aws:CalledVia and aws:ViaAWSService; any other
+# condition key is treated as absent from the request.
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+from fnmatch import fnmatchcase
+from multiprocessing import Pool
+
+DEFAULT_REGION = "us-east-1"
+DEFAULT_ACCOUNT = "123456789012"
+
+# Resource type -> [(action, [(ARN template, tag source)])]. The tag source
+# says which tags reach that ARN in the request: "resource" for the
+# resource's Tags, None for none, or a property that switches propagation on.
+RESOURCE_CALLS = {
+    "AWS::EC2::Instance": [("ec2:RunInstances", [
+        ("arn:aws:ec2:{region}:{account}:instance/*", "resource"),
+        # CloudFormation does not tag the root volume or primary ENI at launch
+        ("arn:aws:ec2:{region}:{account}:volume/*", "PropagateTagsToVolumeOnCreation"),
+        ("arn:aws:ec2:{region}:{account}:network-interface/*", None),
+        ("arn:aws:ec2:{region}::image/*", None),
+        ("arn:aws:ec2:{region}:{account}:subnet/*", None),
+        ("arn:aws:ec2:{region}:{account}:security-group/*", None),
+    ])],
+    "AWS::EC2::Volume": [("ec2:CreateVolume", [("arn:aws:ec2:{region}:{account}:volume/*", "resource")])],
+    "AWS::EC2::SecurityGroup": [("ec2:CreateSecurityGroup", [
+        ("arn:aws:ec2:{region}:{account}:security-group/*", "resource"),
+        ("arn:aws:ec2:{region}:{account}:vpc/*", None),
+    ])],
+    "AWS::EC2::LaunchTemplate": [("ec2:CreateLaunchTemplate", [
+        ("arn:aws:ec2:{region}:{account}:launch-template/*", "resource")])],
+    "AWS::EC2::NatGateway": [("ec2:CreateNatGateway", [
+        ("arn:aws:ec2:{region}:{account}:natgateway/*", "resource")])],
+    "AWS::EC2::EIP": [("ec2:AllocateAddress", [("arn:aws:ec2:{region}:{account}:elastic-ip/*", "resource")])],
+    "AWS::RDS::DBInstance": [("rds:CreateDBInstance", [("arn:aws:rds:{region}:{account}:db:{name}", "resource")])],
+    "AWS::RDS::DBCluster": [("rds:CreateDBCluster", [("arn:aws:rds:{region}:{account}:cluster:{name}", "resource")])],
+    "AWS::S3::Bucket": [("s3:CreateBucket", [("arn:aws:s3:::{name}", None)])],
+    "AWS::DynamoDB::Table": [("dynamodb:CreateTable", [
+        ("arn:aws:dynamodb:{region}:{account}:table/{name}", "resource")])],
+    "AWS::Lambda::Function": [("lambda:CreateFunction", [
+        ("arn:aws:lambda:{region}:{account}:function:{name}", "resource")])],
+}
+
+# Properties holding the physical name used in ARNs, per resource type
+NAME_PROPERTIES = {
+    "AWS::RDS::DBInstance": "DBInstanceIdentifier",
+    "AWS::RDS::DBCluster": "DBClusterIdentifier",
+    "AWS::S3::Bucket": "BucketName",
+    "AWS::DynamoDB::Table": "TableName",
+    "AWS::Lambda::Function": "FunctionName",
+}
+
+
+class PolicyError(Exception):
+    pass
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+# IAM wildcard pattern (* and ?) to a compiled case-sensitive regex
+def compile_pattern(pattern, ignore_case=False):
+    regex = re.escape(pattern).replace(r"\*", ".*").replace(r"\?", ".")
+    return re.compile(regex + r"\Z", re.IGNORECASE if ignore_case else 0)
+
+
+# Condition block -> list of (operator, key, values, qualifier, if_exists)
+def compile_conditions(conditions):
+    compiled = []
+    for operator, block in (conditions or {}).items():
+        qualifier = None
+        if ":" in operator:
+            qualifier, operator = operator.split(":", 1)
+        if_exists = operator.endswith("IfExists")
+        if if_exists:
+            operator = operator[:-len("IfExists")]
+        if operator not in CONDITION_OPERATORS:
+            raise PolicyError("Unsupported condition operator " + operator)
+        for key, values in block.items():
+            compiled.append((operator, key.lower(), [str(v) for v in _as_list(values)], qualifier, if_exists))
+    return compiled
+
+
+class Statement:
+    __slots__ = ('sid', 'effect', 'actions', 'not_actions', 'resources', 'not_resources', 'conditions')
+
+    def __init__(self, statement, sid):
+        self.sid = statement.get("Sid", sid)
+        self.effect = statement["Effect"]
+        self.actions = [compile_pattern(a, True) for a in _as_list(statement.get("Action", []))]
+        self.not_actions = [compile_pattern(a, True) for a in _as_list(statement.get("NotAction", []))]
+        self.resources = [compile_pattern(r) for r in _as_list(statement.get("Resource", []))]
+        self.not_resources = [compile_pattern(r) for r in _as_list(statement.get("NotResource", []))]
+        self.conditions = compile_conditions(statement.get("Condition"))
+
+    def matches_action(self, action):
+        if self.not_actions:
+            return not any(p.match(action) for p in self.not_actions)
+        return any(p.match(action) for p in self.actions)
+
+    def matches_resource(self, arn):
+        if self.not_resources:
+            return not any(p.match(arn) for p in self.not_resources)
+        return any(p.match(arn) for p in self.resources)
+
+    def matches_context(self, context):
+        return all(evaluate_condition(condition, context) for condition in self.conditions)
+
+
+def _string_test(operator):
+    if operator.endswith("Like"):
+        return lambda value, expected: fnmatchcase(value, expected)
+    if operator.endswith("IgnoreCase") or operator == "Bool":
+        return lambda value, expected: value.lower() == expected.lower()
+    return lambda value, expected: value == expected
+
+
+CONDITION_OPERATORS = {
+    "Null", "Bool", "StringEquals", "StringNotEquals", "StringLike", "StringNotLike",
+    "StringEqualsIgnoreCase", "StringNotEqualsIgnoreCase",
+}
+
+
+# One condition against the request context ({lower-case key: [values]}).
+# Keys missing from the request follow IAM: positive operators fail,
+# negated operators and ...IfExists pass.
+def evaluate_condition(condition, context):
+    operator, key, expected, qualifier, if_exists = condition
+    values = context.get(key)
+    if operator == "Null":
+        return (values is None) == (expected[0].lower() == "true")
+
+    negated = "Not" in operator
+    test = _string_test(operator.replace("Not", ""))
+    if values is None:
+        return if_exists or negated or qualifier == "ForAllValues"
+
+    def matches(value):
+        return any(test(value, e) for e in expected)
+
+    if qualifier == "ForAllValues":
+        result = all(matches(v) for v in values)
+    else:
+        result = any(matches(v) for v in values)
+    return not result if negated else result
+
+
+# SCP statements indexed by action: exact actions, per-service wildcards
+# ("ec2:Create*") and everything else (NotAction, "*")
+class PolicyIndex:
+    def __init__(self):
+        self.statements = []
+        self.exact = {}
+        self.service = {}
+        self.other = []
+        self.has_allow = False
+        self._cache = {}
+
+    def add_policy(self, document, name=""):
+        for n, raw in enumerate(_as_list(document.get("Statement", []))):
+            statement = Statement(raw, name + "#" + str(n))
+            self.statements.append(statement)
+            self.has_allow = self.has_allow or statement.effect == "Allow"
+            if "NotAction" in raw:
+                self.other.append(statement)
+                continue
+            for action in _as_list(raw.get("Action", [])):
+                action = action.lower()
+                service, _, operation = action.partition(":")
+                if "*" not in action and "?" not in action:
+                    self.exact.setdefault(action, []).append(statement)
+                elif service and "*" not in service and "?" not in service:
+                    self.service.setdefault(service, []).append(statement)
+                else:
+                    self.other.append(statement)
+        self._cache.clear()
+
+    # Statements whose Action/NotAction covers action, memoized per action
+    def candidates(self, action):
+        action = action.lower()
+        found = self._cache.get(action)
+        if found is None:
+            found = list(self.exact.get(action, []))
+            found += [s for s in self.service.get(action.partition(":")[0], []) if s.matches_action(action)]
+            found += [s for s in self.other if s.matches_action(action)]
+            # a statement listing several matching patterns is indexed once per pattern
+            found = list({id(s): s for s in found}.values())
+            self._cache[action] = found
+        return found
+
+    # ("deny", sid) / ("implicit-deny", None) / ("allow", sid or None)
+    def evaluate(self, action, arn, context):
+        allowed_by = None
+        for statement in self.candidates(action):
+            if not statement.matches_resource(arn) or not statement.matches_context(context):
+                continue
+            if statement.effect == "Deny":
+                return "deny", statement.sid
+            allowed_by = statement.sid
+        if self.has_allow and allowed_by is None:
+            return "implicit-deny", None
+        return "allow", allowed_by
+
+
+def load_policies(paths):
+    index = PolicyIndex()
+    for path in paths:
+        with open(path) as f:
+            index.add_policy(json.load(f), os.path.basename(path))
+    return index
+
+
+# Template loading. YAML short-form intrinsics (!Ref, !Sub, ...) are kept as
+# {"Fn::<name>": value} so that tag values built from them still count as set.
+def load_template(path):
+    with open(path) as f:
+        text = f.read()
+    if text.lstrip().startswith("{"):
+        return json.loads(text)
+    return _yaml_load(text)
+
+
+_yaml_loader = None
+
+
+def _yaml_load(text):
+    global _yaml_loader
+    if _yaml_loader is None:
+        import yaml
+
+        base = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+        class TemplateLoader(base):
+            pass
+
+        def intrinsic(loader, suffix, node):
+            if isinstance(node, yaml.ScalarNode):
+                value = loader.construct_scalar(node)
+            elif isinstance(node, yaml.SequenceNode):
+                value = loader.construct_sequence(node, deep=True)
+            else:
+                value = loader.construct_mapping(node, deep=True)
+            return {("Ref" if suffix == "Ref" else "Fn::" + suffix): value}
+
+        TemplateLoader.add_multi_constructor("!", intrinsic)
+        _yaml_loader = TemplateLoader
+    import yaml
+    return yaml.load(text, Loader=_yaml_loader)
+
+
+def _tag_value(value):
+    return value if isinstance(value, str) else str(value) if not isinstance(value, dict) else "${" + next(iter(value), "") + "}"
+
+
+# {key: value} of a resource's Tags property plus stack tags. Keys built
+# with intrinsics cannot be known offline and are skipped.
+def resource_tags(properties, stack_tags):
+    tags = dict(stack_tags)
+    raw = properties.get("Tags") or []
+    if isinstance(raw, dict):
+        raw = [{"Key": k, "Value": v} for k, v in raw.items()]
+    if isinstance(raw, list):
+        for tag in raw:
+            if isinstance(tag, dict) and isinstance(tag.get("Key"), str):
+                tags[tag["Key"]] = _tag_value(tag.get("Value", ""))
+    return tags
+
+
+def request_context(tags, region):
+    context = {
+        "aws:requestedregion": [region],
+        "aws:calledvia": ["cloudformation.amazonaws.com"],
+        "aws:viaawsservice": ["true"],
+    }
+    if tags:
+        context["aws:tagkeys"] = list(tags)
+        for key, value in tags.items():
+            context["aws:requesttag/" + key.lower()] = [value]
+    return context
+
+
+# API calls a template would make: (logical id, resource type, action, ARN,
+# context). Returns (calls, unmodeled resource types).
+def expand_template(template, stack_tags=None, region=DEFAULT_REGION, account=DEFAULT_ACCOUNT):
+    calls = []
+    unmodeled = []
+    empty_context = request_context({}, region)
+    for logical_id, resource in (template.get("Resources") or {}).items():
+        resource_type = resource.get("Type", "")
+        specs = RESOURCE_CALLS.get(resource_type)
+        if specs is None:
+            unmodeled.append(resource_type)
+            continue
+        properties = resource.get("Properties") or {}
+        tags = resource_tags(properties, stack_tags or {})
+        name = properties.get(NAME_PROPERTIES.get(resource_type, ""))
+        name = name if isinstance(name, str) else logical_id.lower()
+        tagged_context = request_context(tags, region)
+        for action, targets in specs:
+            for arn_template, tag_source in targets:
+                if tag_source == "resource" or (tag_source and properties.get(tag_source) in (True, "true")):
+                    context = tagged_context
+                else:
+                    context = empty_context
+                arn = arn_template.format(region=region, account=account, name=name)
+                calls.append((logical_id, resource_type, action, arn, context))
+    return calls, unmodeled
+
+
+def check_template(index, template, stack_tags=None, region=DEFAULT_REGION, account=DEFAULT_ACCOUNT):
+    calls, unmodeled = expand_template(template, stack_tags, region, account)
+    denials = []
+    for logical_id, resource_type, action, arn, context in calls:
+        decision, sid = index.evaluate(action, arn, context)
+        if decision != "allow":
+            denials.append({"resource": logical_id, "type": resource_type, "action": action,
+                            "arn": arn, "decision": decision, "statement": sid})
+    return {"calls": len(calls), "denied": denials, "unmodeled": sorted(set(unmodeled))}
+
+
+def template_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.endswith((".yaml", ".yml", ".json", ".template")):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+_worker = None
+
+
+def _init_worker(policies, stack_tags, region, account):
+    global _worker
+    _worker = (load_policies(policies), stack_tags, region, account)
+
+
+def _check_path(path):
+    index, stack_tags, region, account = _worker
+    return dict(check_template(index, load_template(path), stack_tags, region, account), template=path)
+
+
+# Results per template, in order. Template parsing dominates, so jobs > 1
+# spreads it over processes, each with its own compiled index.
+def check_paths(paths, policies, stack_tags, region, account, jobs=1):
+    init = (policies, stack_tags, region, account)
+    if jobs <= 1:
+        _init_worker(*init)
+        for path in paths:
+            yield _check_path(path)
+        return
+    with Pool(jobs, _init_worker, init) as pool:
+        for result in pool.imap(_check_path, paths, chunksize=64):
+            yield result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check CloudFormation templates against SCPs offline")
+    parser.add_argument("templates", nargs="+", help="template files or directories")
+    parser.add_argument("--policy", action="append", default=[], help="SCP JSON file, repeatable")
+    parser.add_argument("--policy-dir", help="directory of SCP JSON files")
+    parser.add_argument("--stack-tag", action="append", default=[], help="Key=Value tag applied to the stack")
+    parser.add_argument("--region", default=DEFAULT_REGION)
+    parser.add_argument("--account", default=DEFAULT_ACCOUNT)
+    parser.add_argument("--json", action="store_true", help="one JSON result per template")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="parallel processes")
+    args = parser.parse_args()
+
+    policies = list(args.policy)
+    if args.policy_dir:
+        policies += sorted(os.path.join(args.policy_dir, n) for n in os.listdir(args.policy_dir) if n.endswith(".json"))
+    if not policies:
+        parser.error("give --policy or --policy-dir")
+    stack_tags = dict(tag.split("=", 1) for tag in args.stack_tag)
+
+    start = time.perf_counter()
+    checked = denied = 0
+    for result in check_paths(list(template_paths(args.templates)), policies, stack_tags,
+                              args.region, args.account, args.jobs):
+        checked += 1
+        denied += bool(result["denied"])
+        if args.json:
+            print(json.dumps(result))
+            continue
+        status = "DENY" if result["denied"] else "ALLOW"
+        print(status + "  " + result["template"])
+        for denial in result["denied"]:
+            print("      " + denial["resource"] + " " + denial["action"] + " on " + denial["arn"] +
+                  " (" + (denial["statement"] or denial["decision"]) + ")")
+        for resource_type in result["unmodeled"]:
+            print("      unmodeled: " + resource_type)
+
+    elapsed = time.perf_counter() - start
+    print(str(checked) + " templates, " + str(denied) + " denied in " + str(round(elapsed, 3)) + "s",
+          file=sys.stderr)
+    return 1 if denied else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
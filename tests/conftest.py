@@ -0,0 +1,78 @@
+# Both Lambda directories are importable side by side: their module names do
+# not overlap, and the modules they share come from common/.
+
+import os
+import sys
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+for path in (os.path.join(ROOT, "config", "required_tags", "lambda"),
+             os.path.join(ROOT, "auto-tag", "lambda")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("METRICS_ENABLED", "false")
+os.environ.setdefault("RATE_LIMITS", "ec2:CreateTags=1e9,tag:TagResources=1e9,config:PutEvaluations=1e9")
+
+
+def assume_role(**params):
+    return {"Credentials": {"AccessKeyId": "ASIA" + params["RoleArn"].split(":")[4],
+                            "SecretAccessKey": "secret", "SessionToken": "token",
+                            "Expiration": datetime.now(timezone.utc) + timedelta(hours=1)}}
+
+
+# Stand-in for boto3: every client call is recorded in calls and answered
+# by responders[(service, operation)](**params), or with an empty response
+class FakeAWS:
+    def __init__(self):
+        self.calls = []
+        self.counts = Counter()
+        self.responders = {("sts", "assume_role"): assume_role}
+
+    def client(self, service, **kwargs):
+        return FakeClient(self, service)
+
+    def call(self, service, operation, params):
+        self.calls.append((service, operation, params))
+        self.counts[service + "." + operation] += 1
+        responder = self.responders.get((service, operation))
+        return responder(**params) if responder else {}
+
+    def params(self, service, operation):
+        return [p for s, o, p in self.calls if (s, o) == (service, operation)]
+
+
+class FakeClient:
+    def __init__(self, aws, service):
+        self._aws = aws
+        self._service = service
+
+    def get_paginator(self, operation):
+        client = self
+
+        class Paginator:
+            def paginate(self, **params):
+                yield client._aws.call(client._service, operation, params)
+        return Paginator()
+
+    def __getattr__(self, operation):
+        if operation.startswith("_"):
+            raise AttributeError(operation)
+        return lambda **params: self._aws.call(self._service, operation, params)
+
+
+# Routes session_cache.get_client to a fresh FakeAWS
+@pytest.fixture
+def aws(monkeypatch):
+    import session_cache
+
+    fake = FakeAWS()
+    session_cache.clear()
+    monkeypatch.setattr(session_cache, "_session", fake)
+    yield fake
+    session_cache.clear()
@@ -0,0 +1,35 @@
+import json
+
+import pytest
+
+import policy_document
+from aggregate_remediation import remediate_partition
+
+BUCKET = {"resourceType": "AWS::S3::Bucket", "resourceId": "logs", "arn": "arn:aws:s3:::logs",
+          "tags": [{"key": "CostCenter", "value": "R&D"}]}
+DOCUMENT = {"version": "1", "required_tags": {"CostCenter": ["R&D"]},
+            "resource_types": {"AWS::S3::Bucket": {"DataClass": ["internal", "public"]}}}
+
+
+@pytest.fixture
+def policy_source(aws, monkeypatch):
+    monkeypatch.setattr(policy_document, "POLICY_SOURCE", "ssm:/tags/policy")
+    aws.responders[("ssm", "get_parameter")] = lambda **p: {
+        "Parameter": {"Value": json.dumps(DOCUMENT), "Version": 1}}
+    policy_document.clear()
+    yield
+    policy_document.clear()
+
+
+# ruleParameters carry only exec_role when the policy comes from POLICY_SOURCE
+def test_policy_is_resolved_per_resource(aws, policy_source):
+    pytest.importorskip("botocore.exceptions")
+    aws.responders[("config", "select_aggregate_resource_config")] = lambda **p: {
+        "Results": [json.dumps(BUCKET)]}
+
+    summary = remediate_partition(aws.client("config"), "org", "111111111111", "us-east-1",
+                                  {"AWS::S3::Bucket": ["logs"]}, {"exec_role": "role"}, "remediation")
+
+    assert summary["error"] is None and summary["failed"] == 0
+    assert [(p["ResourceARNList"], p["Tags"]) for p in aws.params("resourcegroupstaggingapi", "tag_resources")] == [
+        (["arn:aws:s3:::logs"], {"DataClass": "internal"})]
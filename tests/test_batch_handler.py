@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+pytest.importorskip("botocore.exceptions")
+
+import handler  # noqa: E402
+import state_cache  # noqa: E402
+from state_cache import SQLiteStateStore, is_unchanged  # noqa: E402
+
+EXEC_ROLE = "arn:aws:iam::111111111111:role/configRemediationLambdaRole"
+PARAMETERS = {"CostCenter": "R&D,Ops", "exec_role": EXEC_ROLE}
+
+
+def configuration_item(resource_id, tags):
+    return {"resourceType": "AWS::EC2::Instance", "resourceId": resource_id,
+            "ARN": "arn:aws:ec2:us-east-1:111111111111:instance/" + resource_id,
+            "awsAccountId": "111111111111", "awsRegion": "us-east-1", "configurationItemStatus": "OK",
+            "configurationItemCaptureTime": "2024-01-01T00:00:00.000Z", "tags": tags}
+
+
+def sqs_event(*items):
+    return {"Records": [{"messageId": "m-" + ci["resourceId"], "body": json.dumps({
+        "invokingEvent": json.dumps({"messageType": "ConfigurationItemChangeNotification",
+                                     "configurationItem": ci}),
+        "ruleParameters": json.dumps(PARAMETERS),
+        "resultToken": "token-" + ci["resourceId"]})} for ci in items]}
+
+
+@pytest.fixture
+def store(monkeypatch, aws):
+    store = SQLiteStateStore(":memory:")
+    monkeypatch.setattr(state_cache, "_store", store)
+    monkeypatch.setattr(handler, "backoff", lambda attempt: None)
+    monkeypatch.delenv("COMPLIANCE_VIEW_TABLE", raising=False)
+    monkeypatch.delenv("COMPLIANCE_VIEW_PATH", raising=False)
+    return store
+
+
+def test_all_delivered(aws, store):
+    compliant, untagged = configuration_item("i-1", {"CostCenter": "R&D"}), configuration_item("i-2", {})
+
+    result = handler.batch_handler(sqs_event(compliant, untagged), None)
+
+    assert result == {"evaluated": 2, "failed": 0, "remediation_failed": 0, "batchItemFailures": []}
+    assert aws.params("resourcegroupstaggingapi", "tag_resources")[0]["Tags"] == {"CostCenter": "R&D"}
+    assert is_unchanged(store, compliant, PARAMETERS)
+    assert is_unchanged(store, untagged, PARAMETERS)
+
+
+def test_undelivered_evaluation_is_redelivered_and_not_cached(aws, store):
+    first, second = configuration_item("i-1", {"CostCenter": "R&D"}), configuration_item("i-2", {"CostCenter": "Ops"})
+
+    def put_evaluations(Evaluations, ResultToken):
+        return {"FailedEvaluations": [e for e in Evaluations if e["ComplianceResourceId"] == "i-2"]}
+    aws.responders[("config", "put_evaluations")] = put_evaluations
+
+    result = handler.batch_handler(sqs_event(first, second), None)
+
+    assert result["failed"] == 1
+    assert result["batchItemFailures"] == [{"itemIdentifier": "m-i-2"}]
+    assert is_unchanged(store, first, PARAMETERS)
+    assert not is_unchanged(store, second, PARAMETERS)
+
+
+def test_unremediated_item_is_redelivered_and_not_cached(aws, store):
+    broken, fine = configuration_item("i-1", {}), configuration_item("i-2", {})
+
+    def tag_resources(ResourceARNList, Tags):
+        return {"FailedResourcesMap": {broken["ARN"]: {"ErrorCode": "InvalidParameterException"}}}
+    aws.responders[("resourcegroupstaggingapi", "tag_resources")] = tag_resources
+
+    result = handler.batch_handler(sqs_event(broken, fine), None)
+
+    assert result["remediation_failed"] == 1
+    assert result["batchItemFailures"] == [{"itemIdentifier": "m-i-1"}]
+    assert not is_unchanged(store, broken, PARAMETERS)
+    assert is_unchanged(store, fine, PARAMETERS)
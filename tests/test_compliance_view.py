@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from compliance_view import DynamoDBComplianceView, SQLiteComplianceView, resource_key, view_row
+
+NON_COMPLIANT = {"compliance_type": "NON_COMPLIANT",
+                 "violation": {"tag_not_present": ["CostCenter"], "incorrect_value": ["Environment"]}}
+COMPLIANT = {"compliance_type": "COMPLIANT"}
+
+
+def item(resource_id="i-1", account="111111111111", captured="2024-01-01T00:00:00.000Z",
+         resource_type="AWS::EC2::Instance", region="us-east-1"):
+    return {"resourceType": resource_type, "resourceId": resource_id, "awsAccountId": account,
+            "awsRegion": region, "configurationItemCaptureTime": captured}
+
+
+def test_counts_and_resources_follow_upserts():
+    view = SQLiteComplianceView(":memory:")
+    assert view.upsert(view_row(item("i-1"), NON_COMPLIANT))
+    assert view.upsert(view_row(item("i-2"), NON_COMPLIANT))
+
+    assert view.counts("tag") == {"CostCenter": 2, "Environment": 2}
+    assert view.counts("account") == {"111111111111": 2}
+    assert [r["resource_id"] for r in view.resources("tag", "CostCenter")] == ["i-1", "i-2"]
+
+    assert view.upsert(view_row(item("i-1", captured="2024-01-02T00:00:00.000Z"), COMPLIANT))
+    assert view.counts("tag") == {"CostCenter": 1, "Environment": 1}
+    assert view.counts("resource_type") == {"AWS::EC2::Instance": 1}
+
+
+def test_same_resource_id_in_two_accounts_counts_twice():
+    view = SQLiteComplianceView(":memory:")
+    for account in ("111111111111", "222222222222"):
+        assert view.upsert(view_row(item("orders", account, resource_type="AWS::Lambda::Function"), NON_COMPLIANT))
+
+    assert view.counts("resource_type") == {"AWS::Lambda::Function": 2}
+    assert view.counts("account") == {"111111111111": 1, "222222222222": 1}
+    assert view.counts("tag") == {"CostCenter": 2, "Environment": 2}
+
+
+def test_key_falls_back_to_the_arn():
+    configuration_item = {"resourceType": "AWS::Lambda::Function", "resourceId": "orders",
+                          "ARN": "arn:aws:lambda:eu-west-1:222222222222:function:orders"}
+
+    assert resource_key(configuration_item) == "222222222222/eu-west-1/AWS::Lambda::Function/orders"
+
+
+def test_older_or_unchanged_rows_are_not_written():
+    view = SQLiteComplianceView(":memory:")
+    view.upsert(view_row(item(captured="2024-01-02T00:00:00.000Z"), COMPLIANT))
+
+    assert not view.upsert(view_row(item(captured="2024-01-01T00:00:00.000Z"), NON_COMPLIANT))
+    assert not view.upsert(view_row(item(captured="2024-01-03T00:00:00.000Z"), COMPLIANT))
+    assert view.counts("account") == {}
+
+
+def test_datetime_capture_times_are_stored_in_config_format():
+    captured = datetime(2024, 1, 1, 2, 0, 0, 250000, tzinfo=timezone(timedelta(hours=2)))
+
+    assert view_row(item(captured=captured), COMPLIANT)["updated_at"] == "2024-01-01T00:00:00.250Z"
+
+
+def test_dynamodb_rows_are_keyed_per_account(aws):
+    pytest.importorskip("botocore.exceptions")
+    view = DynamoDBComplianceView("compliance-view")
+    for account in ("111111111111", "222222222222"):
+        assert view.upsert(view_row(item("orders", account, resource_type="AWS::Lambda::Function"), NON_COMPLIANT))
+
+    assert [p["Item"]["pk"]["S"] for p in aws.params("dynamodb", "put_item")] == [
+        "resource#111111111111/us-east-1/AWS::Lambda::Function/orders",
+        "resource#222222222222/us-east-1/AWS::Lambda::Function/orders"]
+    increments = [p["Key"]["sk"]["S"] for p in aws.params("dynamodb", "update_item")
+                  if p["Key"]["pk"]["S"] == "count#resource_type"]
+    assert increments == ["AWS::Lambda::Function", "AWS::Lambda::Function"]
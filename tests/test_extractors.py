@@ -0,0 +1,22 @@
+from extractors import extract_resources, find_extractor
+
+
+def test_lookup_uses_event_source_and_name():
+    detail = {"eventSource": "dynamodb.amazonaws.com", "eventName": "CreateTable",
+              "responseElements": {"tableDescription": {"tableArn": "arn:aws:dynamodb:us-east-1:1:table/t"}}}
+
+    spec = find_extractor(detail)
+
+    assert spec.backend == "tagging"
+    assert extract_resources(spec, detail) == ["arn:aws:dynamodb:us-east-1:1:table/t"]
+    assert find_extractor(dict(detail, eventSource="glue.amazonaws.com")) is None
+
+
+def test_fan_out_paths_and_arn_templates():
+    run = {"eventSource": "ec2.amazonaws.com", "eventName": "RunInstances",
+           "responseElements": {"instancesSet": {"items": [{"instanceId": "i-1"}, {"instanceId": "i-2"}]}}}
+    bucket = {"eventSource": "s3.amazonaws.com", "eventName": "CreateBucket",
+              "userIdentity": {"arn": "arn:aws-cn:iam::1:user/u"}, "requestParameters": {"bucketName": "b"}}
+
+    assert extract_resources(find_extractor(run), run) == ["i-1", "i-2"]
+    assert extract_resources(find_extractor(bucket), bucket) == ["arn:aws-cn:s3:::b"]
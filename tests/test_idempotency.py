@@ -0,0 +1,40 @@
+import pytest
+
+import idempotency
+
+DETAIL = {"eventID": "event-1"}
+OWNER = ("alice", "AROA:alice")
+
+
+@pytest.fixture(autouse=True)
+def clean_claims():
+    idempotency.clear()
+    yield
+    idempotency.clear()
+
+
+def test_duplicate_event_is_skipped():
+    key = idempotency.claim(DETAIL, ["i-1"], OWNER)
+
+    assert key
+    assert idempotency.claim(DETAIL, ["i-1"], OWNER) is None
+
+
+def test_released_claim_runs_again_in_full():
+    key = idempotency.claim(DETAIL, ["i-1", "i-2"], OWNER)
+    idempotency.remember_tagged([{"success": True, "resources": ["i-1", "i-2"]}], *OWNER)
+
+    idempotency.release(key)
+
+    assert idempotency.claim(DETAIL, ["i-1", "i-2"], OWNER)
+    assert idempotency.untagged(["i-1", "i-2"], *OWNER) == ["i-1", "i-2"]
+
+
+def test_resources_tagged_with_the_same_owner_are_skipped():
+    idempotency.claim(DETAIL, ["i-1"], OWNER)
+    idempotency.remember_tagged([{"success": True, "resources": ["i-1"]},
+                                 {"success": False, "resources": ["i-2"]}], *OWNER)
+
+    assert idempotency.untagged(["i-1", "i-2"], *OWNER) == ["i-2"]
+    assert idempotency.untagged(["i-1"], "bob", "AROA:bob") == ["i-1"]
+    assert idempotency.claim({"eventID": "event-2"}, ["i-1"], OWNER) is None
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+pytest.importorskip("botocore.exceptions")
+
+import idempotency  # noqa: E402
+import identity  # noqa: E402
+import index  # noqa: E402
+
+INSTANCE_TAGS = [{"Key": "Owner", "Value": "alice"}, {"Key": "PrincipalId", "Value": "AIDAALICE"},
+                 {"Key": "Team", "Value": "web"}]
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    idempotency.clear()
+    identity.clear()
+    yield
+    idempotency.clear()
+    identity.clear()
+
+
+def create_snapshot_record(snapshot_id):
+    detail = {"eventID": "event-" + snapshot_id, "eventSource": "ec2.amazonaws.com",
+              "eventName": "CreateSnapshot", "responseElements": {"snapshotId": snapshot_id},
+              "userIdentity": {"type": "IAMUser", "userName": "bob", "principalId": "AIDABOB"}}
+    return {"messageId": "m-" + snapshot_id, "body": json.dumps({"detail": detail})}
+
+
+# bob snapshots a volume of alice's instance: the Owner tagging and the
+# propagation from the instance run concurrently, and bob must win either way
+def test_snapshot_owner_does_not_depend_on_task_order(aws):
+    aws.responders.update({
+        ("ec2", "describe_snapshots"): lambda **p: {"Snapshots": [{"SnapshotId": "snap-1", "VolumeId": "vol-1"}]},
+        ("ec2", "describe_volumes"): lambda **p: {"Volumes": [
+            {"VolumeId": "vol-1", "Attachments": [{"InstanceId": "i-1"}]}]},
+        ("ec2", "describe_instances"): lambda **p: {"Reservations": [{"Instances": [
+            {"InstanceId": "i-1", "Tags": INSTANCE_TAGS}]}]},
+    })
+
+    assert index.process_records([create_snapshot_record("snap-1")]) == {"batchItemFailures": []}
+
+    written = {}
+    for params in aws.params("ec2", "create_tags"):
+        assert params["Resources"] == ["snap-1"]
+        for tag in params["Tags"]:
+            written.setdefault(tag["Key"], set()).add(tag["Value"])
+    assert written == {"Owner": {"bob"}, "PrincipalId": {"AIDABOB"}, "Team": {"web"}}
+
+
+@pytest.mark.parametrize("detail", [
+    # this function's own CreateTags
+    {"eventSource": "ec2.amazonaws.com", "eventName": "CreateTags", "userIdentity": {
+        "type": "AssumedRole", "sessionContext": {"sessionIssuer": {"arn": "arn:aws:iam::111111111111:role/auto-tag"}}}},
+    {"eventSource": "ec2.amazonaws.com", "eventName": "DescribeInstances", "userIdentity": {"type": "IAMUser"}},
+])
+def test_owner_is_not_resolved_for_events_that_are_not_handled(monkeypatch, detail):
+    monkeypatch.setattr(index, "AUTO_TAG_ROLE_ARN", "arn:aws:iam::111111111111:role/auto-tag")
+    monkeypatch.setattr(index, "resolve_owner", lambda identity: pytest.fail("owner resolved"))
+
+    assert index.parse_event(detail) is None
@@ -0,0 +1,32 @@
+import pytest
+
+from policy import get_policy
+
+
+def test_check_reports_missing_incorrect_and_case_mismatch():
+    policy = get_policy({"CostCenter": "R&D,Ops", "Environment": "Dev,Prod", "exec_role": "role"})
+
+    incorrect, missing, case_mismatch = policy.check({"CostCenter": "Finance", "environment": "Dev"})
+
+    assert incorrect == ["CostCenter"]
+    assert missing == ["Environment"]
+    assert case_mismatch == ["Environment"]
+    assert policy.remediation_tags(incorrect + missing) == {"CostCenter": "R&D", "Environment": "Dev"}
+
+
+def test_compliant_tags_and_excluded_parameters():
+    policy = get_policy({"CostCenter": "R&D", "exec_role": "role", "Name": "rule"})
+
+    assert policy.required == ("CostCenter",)
+    assert policy.check({"CostCenter": "R&D"}) == ([], [], [])
+
+
+def test_policies_are_shared_and_read_only():
+    parameters = {"CostCenter": "R&D,Ops"}
+    policy = get_policy(parameters)
+
+    assert get_policy(dict(parameters)) is policy
+    with pytest.raises(TypeError):
+        policy.allowed["Team"] = frozenset(["web"])
+    with pytest.raises(AttributeError):
+        policy.required = ()
@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+import pytest
+
+from propagation import propagate_to_children, tag_deltas
+
+INSTANCE_TAGS = {"Owner": "alice", "PrincipalId": "AROA:alice", "Team": "web", "aws:cloudformation:stack-name": "s"}
+
+
+def test_deltas_skip_reserved_tags_and_tags_the_child_has():
+    index = SimpleNamespace(instances={"i-1": INSTANCE_TAGS}, parents={"vol-1": "i-1", "vol-2": "i-1"},
+                            tags={"vol-2": {"Team": "web", "Owner": "alice", "PrincipalId": "AROA:alice"}})
+
+    assert tag_deltas(index) == {
+        frozenset({("Team", "web"), ("Owner", "alice"), ("PrincipalId", "AROA:alice")}): ["vol-1"]}
+
+
+def test_excluded_keys_are_not_propagated():
+    index = SimpleNamespace(instances={"i-1": INSTANCE_TAGS}, parents={"vol-1": "i-1"}, tags={})
+
+    assert tag_deltas(index, excluded=("Owner", "PrincipalId")) == {frozenset({("Team", "web")}): ["vol-1"]}
+
+
+# alice's instance, bob's snapshot of its root volume
+def snapshot_responders(aws):
+    aws.responders.update({
+        ("ec2", "describe_snapshots"): lambda **p: {"Snapshots": [
+            {"SnapshotId": "snap-1", "VolumeId": "vol-1", "Tags": [{"Key": "Owner", "Value": "bob"},
+                                                                  {"Key": "PrincipalId", "Value": "AROA:bob"}]}]},
+        ("ec2", "describe_volumes"): lambda **p: {"Volumes": [
+            {"VolumeId": "vol-1", "Attachments": [{"InstanceId": "i-1"}]}]},
+        ("ec2", "describe_instances"): lambda **p: {"Reservations": [{"Instances": [
+            {"InstanceId": "i-1", "Tags": [{"Key": k, "Value": v} for k, v in INSTANCE_TAGS.items()]}]}]},
+    })
+
+
+def test_snapshot_keeps_its_creators_owner(aws):
+    pytest.importorskip("botocore.exceptions")
+    snapshot_responders(aws)
+
+    results = propagate_to_children(aws.client("ec2"), snapshot_ids=["snap-1"])
+
+    assert [r["success"] for r in results] == [True]
+    assert aws.params("ec2", "create_tags") == [{"Resources": ["snap-1"], "Tags": [{"Key": "Team", "Value": "web"}]}]
@@ -0,0 +1,40 @@
+from state_cache import SQLiteStateStore, is_unchanged, remember
+
+PARAMETERS = {"CostCenter": "R&D", "exec_role": "arn:aws:iam::111111111111:role/r"}
+
+
+def item(tags, status="OK", account="111111111111"):
+    return {"resourceType": "AWS::EC2::Instance", "resourceId": "i-1", "awsAccountId": account,
+            "awsRegion": "us-east-1", "configurationItemStatus": status, "tags": tags}
+
+
+def test_unchanged_item_is_skipped_after_remember():
+    store = SQLiteStateStore(":memory:")
+    assert not is_unchanged(store, item({"CostCenter": "R&D"}), PARAMETERS)
+
+    remember(store, item({"CostCenter": "R&D"}), PARAMETERS, {"compliance_type": "COMPLIANT"})
+
+    assert is_unchanged(store, item({"CostCenter": "R&D"}), PARAMETERS)
+
+
+def test_tag_or_parameter_change_is_evaluated_again():
+    store = SQLiteStateStore(":memory:")
+    remember(store, item({"CostCenter": "R&D"}), PARAMETERS, {"compliance_type": "COMPLIANT"})
+
+    assert not is_unchanged(store, item({"CostCenter": "Ops"}), PARAMETERS)
+    assert not is_unchanged(store, item({"CostCenter": "R&D"}), dict(PARAMETERS, CostCenter="R&D,Ops"))
+
+
+def test_deleted_items_are_neither_remembered_nor_skipped():
+    store = SQLiteStateStore(":memory:")
+    remember(store, item({}, "ResourceDeleted"), PARAMETERS, {"compliance_type": "NOT_APPLICABLE"})
+
+    assert not is_unchanged(store, item({}), PARAMETERS)
+    assert not is_unchanged(store, item({}, "ResourceDeleted"), PARAMETERS)
+
+
+def test_same_resource_id_in_another_account_is_not_skipped():
+    store = SQLiteStateStore(":memory:")
+    remember(store, item({"CostCenter": "R&D"}), PARAMETERS, {"compliance_type": "COMPLIANT"})
+
+    assert not is_unchanged(store, item({"CostCenter": "R&D"}, account="222222222222"), PARAMETERS)
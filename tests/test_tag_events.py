@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+import tag_events
+from tag_events import changed_resources, configuration_item_from_arn
+
+EXEC_ROLE = "arn:aws:iam::111111111111:role/configRemediationLambdaRole"
+RULE_PARAMETERS = json.dumps({"CostCenter": "R&D", "exec_role": EXEC_ROLE})
+
+
+def cloudtrail_event(source, name, parameters, identity=None):
+    return {"detail-type": "AWS API Call via CloudTrail", "account": "222222222222", "region": "eu-west-1",
+            "time": "2024-01-01T00:00:00Z",
+            "detail": {"eventSource": source, "eventName": name, "requestParameters": parameters,
+                       "userIdentity": identity or {"type": "IAMUser", "userName": "alice"}}}
+
+
+def test_resource_id_is_the_config_id_or_the_type_is_unknown():
+    volume = configuration_item_from_arn("arn:aws:ec2:eu-west-1:222222222222:volume/vol-1", "t")
+    bucket = configuration_item_from_arn("arn:aws:s3:::logs", "t", "222222222222", "eu-west-1")
+    database = configuration_item_from_arn("arn:aws:rds:eu-west-1:222222222222:db:orders", "t")
+
+    assert (volume["resourceType"], volume["resourceId"], volume["awsAccountId"]) == (
+        "AWS::EC2::Volume", "vol-1", "222222222222")
+    assert (bucket["resourceType"], bucket["resourceId"], bucket["awsRegion"]) == (
+        "AWS::S3::Bucket", "logs", "eu-west-1")
+    # Config knows RDS instances by their DbiResourceId, not the name in the ARN
+    assert database["resourceType"] == "Unknown"
+
+
+def test_ec2_create_tags_yields_instance_and_volume_arns():
+    event = cloudtrail_event("ec2.amazonaws.com", "CreateTags", {
+        "resourcesSet": {"items": [{"resourceId": "i-1"}, {"resourceId": "vol-1"}, {"resourceId": "sg-1"}]},
+        "tagSet": {"items": [{"key": "CostCenter", "value": "R&D"}]}})
+
+    assert changed_resources(event) == [
+        ("arn:aws:ec2:eu-west-1:222222222222:instance/i-1", ["CostCenter"]),
+        ("arn:aws:ec2:eu-west-1:222222222222:volume/vol-1", ["CostCenter"])]
+
+
+def test_unsupported_and_failed_calls_change_nothing():
+    parameters = {"resourceARNList": ["arn:aws:s3:::logs"], "tags": {"CostCenter": "R&D"}}
+    failed = cloudtrail_event("tagging.amazonaws.com", "TagResources", parameters)
+    failed["detail"]["errorCode"] = "AccessDenied"
+
+    assert changed_resources(cloudtrail_event("tagging.amazonaws.com", "TagResources", parameters)) == [
+        ("arn:aws:s3:::logs", ["CostCenter"])]
+    assert changed_resources(failed) == []
+    assert changed_resources(cloudtrail_event("rds.amazonaws.com", "AddTagsToResource", {})) == []
+
+
+# The function's own remediation, with the exec role in the event's account
+def test_own_remediation_is_skipped(aws, monkeypatch):
+    monkeypatch.setattr(tag_events, "TAG_EVENT_RULE_PARAMETERS", RULE_PARAMETERS)
+    identity = {"type": "AssumedRole", "sessionContext": {"sessionIssuer": {
+        "arn": "arn:aws:iam::222222222222:role/configRemediationLambdaRole"}}}
+    event = cloudtrail_event("tagging.amazonaws.com", "TagResources", {
+        "resourceARNList": ["arn:aws:s3:::logs"], "tags": {"CostCenter": "R&D"}}, identity)
+
+    assert tag_events.tag_event_handler(event, None) == {"evaluated": 0, "skipped": 0, "remediation_failed": 0}
+    assert aws.calls == []
+
+
+def test_changed_resource_is_evaluated_and_remediated(aws, monkeypatch):
+    pytest.importorskip("botocore.exceptions")
+    monkeypatch.setattr(tag_events, "TAG_EVENT_RULE_PARAMETERS", RULE_PARAMETERS)
+    monkeypatch.delenv("COMPLIANCE_VIEW_PATH", raising=False)
+    monkeypatch.delenv("COMPLIANCE_VIEW_TABLE", raising=False)
+    aws.responders[("resourcegroupstaggingapi", "get_resources")] = lambda **p: {"ResourceTagMappingList": [
+        {"ResourceARN": "arn:aws:s3:::logs", "Tags": [{"Key": "Team", "Value": "web"}]}]}
+    event = cloudtrail_event("s3.amazonaws.com", "DeleteBucketTagging", {"bucketName": "logs"})
+
+    assert tag_events.tag_event_handler(event, None) == {"evaluated": 1, "skipped": 0, "remediation_failed": 0}
+    assert [p["RoleArn"] for p in aws.params("sts", "assume_role")] == [
+        "arn:aws:iam::222222222222:role/configRemediationLambdaRole"]
+    assert [p["Tags"] for p in aws.params("resourcegroupstaggingapi", "tag_resources")] == [{"CostCenter": "R&D"}]
@@ -0,0 +1,58 @@
+import pytest
+
+pytest.importorskip("botocore.exceptions")
+
+import tagging  # noqa: E402
+
+ARNS = ["arn:aws:s3:::a", "arn:aws:s3:::b"]
+THROTTLED = {"StatusCode": 400, "ErrorCode": "ThrottlingException"}
+INVALID = {"StatusCode": 400, "ErrorCode": "InvalidParameterException"}
+
+
+class Limiter:
+    def __init__(self):
+        self.throttles = 0
+
+    def acquire(self):
+        pass
+
+    def throttled(self):
+        self.throttles += 1
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = Limiter()
+    monkeypatch.setattr(tagging, "get_limiter", lambda *args, **kwargs: limiter)
+    monkeypatch.setattr(tagging, "backoff", lambda attempt: None)
+    return limiter
+
+
+# responses for consecutive tag_resources calls
+def respond(aws, *failure_maps):
+    responses = iter(failure_maps)
+    aws.responders[("resourcegroupstaggingapi", "tag_resources")] = lambda **p: {
+        "FailedResourcesMap": next(responses)}
+
+
+def test_throttled_arns_are_retried_through_the_limiter(aws, limiter):
+    respond(aws, {ARNS[0]: THROTTLED}, {})
+
+    result = tagging._tag_arn_chunk(aws.client("resourcegroupstaggingapi"), ARNS, {"Owner": "alice"})
+
+    assert result["success"] and result["attempts"] == 2
+    assert [p["ResourceARNList"] for p in aws.params("resourcegroupstaggingapi", "tag_resources")] == [
+        ARNS, [ARNS[0]]]
+    assert limiter.throttles == 1
+
+
+def test_other_failures_are_not_retried(aws, limiter):
+    respond(aws, {ARNS[0]: INVALID, ARNS[1]: {"StatusCode": 500, "ErrorCode": "InternalServiceException"}}, {})
+
+    result = tagging._tag_arn_chunk(aws.client("resourcegroupstaggingapi"), ARNS, {"Owner": "alice"})
+
+    assert not result["success"] and "InvalidParameterException" in result["error"]
+    # only the 5xx ARN is sent again
+    assert [p["ResourceARNList"] for p in aws.params("resourcegroupstaggingapi", "tag_resources")] == [
+        ARNS, [ARNS[1]]]
+    assert limiter.throttles == 0